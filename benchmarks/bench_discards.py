@@ -0,0 +1,102 @@
+"""
+Benchmark for petrarch2.check_discards() against the previous trie walk, on
+the sentences of an input file checked against a discard list. Sentences on
+which the two disagree are counted; the previous version missed phrases at
+the end of a sentence and did not restart a partial match at the word that
+broke it.
+
+Usage:
+    python benchmarks/bench_discards.py [-i INPUT.xml] [-d DISCARDS] [-r REPEAT]
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gc
+import os
+import sys
+import time
+import argparse
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from petrarch2 import petrarch2, PETRglobals, PETRreader, utilities
+
+
+def legacy_check_discards(SentenceText):
+    sent = SentenceText.upper().split()  # case insensitive matching
+    level = PETRglobals.DiscardList
+    depart_index = [0]
+    discardPhrase = ""
+
+    for i in range(len(sent)):
+
+        if '+' in level:
+            return [2, '+ ' + discardPhrase]
+        elif '$' in level:
+            return [1, ' ' + discardPhrase]
+        elif sent[i] in level:
+            depart_index.append(i)
+            level = level[sent[i]]
+            discardPhrase += " " + sent[i]
+        else:
+            if len(depart_index) == 0:
+                continue
+            i = depart_index[0]
+            level = PETRglobals.DiscardList
+    return [0, '']
+
+
+def read_sentences(path):
+    sentences = []
+    for _, elem in ET.iterparse(path):
+        if elem.tag == 'Sentence':
+            sentences.append(elem.find('Text').text.replace('\n', ' '))
+            elem.clear()
+    return sentences
+
+
+def timed(label, func, items, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        start = time.time()
+        for item in items:
+            func(item)
+        elapsed = time.time() - start
+        gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    print('{:<24} {:9.2f} us/sentence'.format(label,
+                                              1e6 * best / len(items)))
+
+
+def main():
+    aparse = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    aparse.add_argument('-i', '--input', default=utilities._get_data(
+        'data/text', 'GigaWord.sample.PETR.xml'))
+    aparse.add_argument('-d', '--discards', default=utilities._get_data(
+        'data/dictionaries', 'Phoenix.discards.txt'))
+    aparse.add_argument('-r', '--repeat', type=int, default=50)
+    args = aparse.parse_args()
+
+    PETRreader.read_discard_list(args.discards)
+    sentences = read_sentences(args.input)
+    print('{} sentences from {}'.format(len(sentences), args.input))
+
+    differ = sum(petrarch2.check_discards(text)[0] !=
+                 legacy_check_discards(text)[0] for text in sentences)
+    print('{} sentences discarded, {} with a different result than the '
+          'previous version'.format(
+              sum(petrarch2.check_discards(text)[0] > 0
+                  for text in sentences), differ))
+
+    timed('check_discards (legacy)', legacy_check_discards, sentences,
+          args.repeat)
+    timed('check_discards', petrarch2.check_discards, sentences,
+          args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Benchmark for reading parse trees: utilities._format_parsed_str() on the raw
+CoreNLP parses of an input file, and building the Sentence tree from the
+formatted string. The previous split-and-replace implementations are timed
+alongside for comparison.
+
+Usage:
+    python benchmarks/bench_parse_tree.py [-i INPUT.xml] [-r REPEAT]
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gc
+import os
+import sys
+import time
+import argparse
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from petrarch2 import utilities
+from petrarch2 import PETRtree
+
+
+def legacy_format_parsed_str(parsed_str):
+    if parsed_str.strip().startswith("(ROOT") and parsed_str.strip().endswith(")"):
+        parsed_str = parsed_str.strip()[5:-1].strip()
+    elif parsed_str.strip()[1:].strip().startswith("("):
+        parsed_str = parsed_str.strip()[1:-1]
+    parsed = parsed_str.split('\n')
+    parsed = [line.strip() + ' ' for line in [line1.strip() for line1 in
+                                              parsed if line1] if line]
+    parsed = [line.replace(')', ' ) ').upper() for line in parsed]
+    return ''.join(parsed)
+
+
+class LegacySentence(PETRtree.Sentence):
+
+    def __init__(self, parse, text, date):
+        self.treestr = parse.replace(')', ' )')
+        PETRtree.Sentence.__init__(self, parse, text, date)
+
+    def str_to_tree(self, str):
+        segs = str.split()
+        root = PETRtree.Phrase(segs[0][1:], self.date, self)
+        level_stack = [root]
+        existentials = []
+
+        for element in segs[1:]:
+            if element.startswith("("):
+                lab = element[1:]
+                if lab == "NP":
+                    new = PETRtree.NounPhrase(lab, self.date, self)
+                elif lab == "VP":
+                    new = PETRtree.VerbPhrase(lab, self.date, self)
+                    self.verbs.append(new)
+                elif lab == "PP":
+                    new = PETRtree.PrepPhrase(lab, self.date, self)
+                else:
+                    new = PETRtree.Phrase(lab, self.date, self)
+                    if lab == "EX":
+                        existentials.append(new)
+
+                new.parent = level_stack[-1]
+                new.index = len(level_stack[-1].children)
+                level_stack[-1].children.append(new)
+                level_stack.append(new)
+            elif element.endswith(")"):
+                try:
+                    level_stack.pop()
+                except:
+                    break
+            else:
+                level_stack[-1].text = element
+                self.txt += " " + element
+
+        for element in existentials:
+            try:
+                element.parent.convert_existential()
+            except:
+                pass
+        return root
+
+
+def read_parses(path):
+    parses = []
+    for _, elem in ET.iterparse(path):
+        if elem.tag == 'Sentence' and elem.find('Parse') is not None:
+            parses.append((elem.find('Parse').text, elem.find('Text').text))
+            elem.clear()
+    return parses
+
+
+def timed(label, func, items, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        start = time.time()
+        for item in items:
+            func(item)
+        elapsed = time.time() - start
+        gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    print('{:<28} {:9.1f} us/sentence'.format(label,
+                                               1e6 * best / len(items)))
+    return best
+
+
+def main():
+    aparse = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    aparse.add_argument('-i', '--input', default=utilities._get_data(
+        'data/text', 'GigaWord.sample.PETR.xml'))
+    aparse.add_argument('-r', '--repeat', type=int, default=20)
+    args = aparse.parse_args()
+
+    parses = read_parses(args.input)
+    print('{} parse trees from {}'.format(len(parses), args.input))
+
+    raw = [parse for parse, _ in parses]
+    timed('format (legacy)', legacy_format_parsed_str, raw, args.repeat)
+    timed('format', utilities._format_parsed_str, raw, args.repeat)
+
+    formatted = [(legacy_format_parsed_str(parse), text)
+                 for parse, text in parses]
+    for (parse, text), (legacy, _) in zip(parses, formatted):
+        new = PETRtree.Sentence(utilities._format_parsed_str(parse), text, 0)
+        old = LegacySentence(legacy, text, 0)
+        assert new.txt == old.txt, (new.txt, old.txt)
+
+    timed('build tree (legacy)',
+          lambda item: LegacySentence(item[0], item[1], 0), formatted,
+          args.repeat)
+    timed('build tree',
+          lambda item: PETRtree.Sentence(item[0], item[1], 0), formatted,
+          args.repeat)
+    timed('format + build (legacy)',
+          lambda item: LegacySentence(legacy_format_parsed_str(item[0]),
+                                      item[1], 0), parses, args.repeat)
+    timed('format + build',
+          lambda item: PETRtree.Sentence(
+              utilities._format_parsed_str(item[0]), item[1], 0), parses,
+          args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+Benchmark for PETRreader.iter_sentences() against the previous segmenter, which
+counted the brackets and quotes from the start of the remaining text at every
+candidate terminator and so took quadratic time on long stories. Both are run
+on wire stories made of the sample and validation texts, from a few sentences
+to very long ones, and on random text full of terminators, brackets, quotes
+and initials; any story they split differently is reported.
+
+Usage:
+    python benchmarks/bench_segmenter.py [-l 2000 20000 200000] [-r REPEAT]
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gc
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from petrarch2 import PETRreader, utilities
+
+
+def legacy_sentence_segmenter(paragr):
+    """
+    Function to break a string 'paragraph' into a list of sentences based on
+    the following rules:
+
+    1. Look for terminal [.,?,!] followed by a space and [A-Z]
+    2. If ., check against abbreviation list ABBREV_LIST: Get the string
+    between the . and the previous blank, lower-case it, and see if it is in
+    the list. Also check for single-letter initials. If true, continue search
+    for terminal punctuation
+    3. Extend selection to balance (...) and "...". Reapply termination rules
+    4. Add to sentlist if the length of the string is between MIN_SENTLENGTH
+    and MAX_SENTLENGTH
+    5. Returns sentlist
+
+    Parameters
+    ----------
+
+    paragr: String.
+            Content that will be split into constituent sentences.
+
+    Returns
+    -------
+
+    sentlist: List.
+                List of sentences.
+
+    """
+    # this is relatively high because we are only looking for sentences that
+    # will have subject and object
+    MIN_SENTLENGTH = 100
+    MAX_SENTLENGTH = 512
+
+    # sentence termination pattern used in sentence_segmenter(paragr)
+    terpat = re.compile('[\.\?!]\s+[A-Z\"]')
+
+    # source: LbjNerTagger1.11.release/Data/KnownLists/known_title.lst from
+    # University of Illinois with editing
+    ABBREV_LIST = ['mrs.', 'ms.', 'mr.', 'dr.', 'gov.', 'sr.', 'rev.', 'r.n.',
+                   'pres.', 'treas.', 'sect.', 'maj.', 'ph.d.', 'ed. psy.',
+                   'proc.', 'fr.', 'asst.', 'p.f.c.', 'prof.', 'admr.',
+                   'engr.', 'mgr.', 'supt.', 'admin.', 'assoc.', 'voc.',
+                   'hon.', 'm.d.', 'dpty.', 'sec.', 'capt.', 'c.e.o.',
+                   'c.f.o.', 'c.i.o.', 'c.o.o.', 'c.p.a.', 'c.n.a.', 'acct.',
+                   'llc.', 'inc.', 'dir.', 'esq.', 'lt.', 'd.d.', 'ed.',
+                   'revd.', 'psy.d.', 'v.p.', 'senr.', 'gen.', 'prov.',
+                   'cmdr.', 'sgt.', 'sen.', 'col.', 'lieut.', 'cpl.', 'pfc.',
+                   'k.p.h.', 'cent.', 'deg.', 'doz.', 'Fahr.', 'Cel.', 'F.',
+                   'C.', 'K.', 'ft.', 'fur.', 'gal.', 'gr.', 'in.', 'kg.',
+                   'km.', 'kw.', 'l.', 'lat.', 'lb.', 'lb per sq in.', 'long.',
+                   'mg.', 'mm.,, m.p.g.', 'm.p.h.', 'cc.', 'qr.', 'qt.', 'sq.',
+                   't.', 'vol.', 'w.', 'wt.']
+
+    sentlist = []
+    # controls skipping over non-terminal conditions
+    searchstart = 0
+    terloc = terpat.search(paragr)
+    while terloc:
+        isok = True
+        if paragr[terloc.start()] == '.':
+            if (paragr[terloc.start() - 1].isupper() and
+                    paragr[terloc.start() - 2] == ' '):
+                isok = False      # single initials
+            else:
+                # check abbreviations
+                loc = paragr.rfind(' ', 0, terloc.start() - 1)
+                if loc > 0:
+                    if paragr[
+                            loc + 1:terloc.start() + 1].lower() in ABBREV_LIST:
+                        isok = False
+        if paragr[:terloc.start()].count(
+                '(') != paragr[:terloc.start()].count(')'):
+            isok = False
+        if paragr[:terloc.start()].count('"') % 2 != 0:
+            isok = False
+        if isok:
+            if (len(paragr[:terloc.start()]) > MIN_SENTLENGTH and
+                    len(paragr[:terloc.start()]) < MAX_SENTLENGTH):
+                sentlist.append(paragr[:terloc.start() + 2])
+            paragr = paragr[terloc.end() - 1:]
+            searchstart = 0
+        else:
+            searchstart = terloc.start() + 2
+
+        terloc = terpat.search(paragr, searchstart)
+
+    # add final sentence
+    if (len(paragr) > MIN_SENTLENGTH and len(paragr) < MAX_SENTLENGTH):
+        sentlist.append(paragr)
+
+    return sentlist
+
+
+def read_texts(paths):
+    texts = []
+    for path in paths:
+        for _, elem in ET.iterparse(path):
+            if elem.tag == 'Sentence' and elem.find('Text') is not None:
+                texts.append(' '.join(elem.find('Text').text.split()))
+                elem.clear()
+    return texts
+
+
+def wire_story(texts, length, rng):
+    """ Sentences drawn from texts until the story is length characters """
+    parts = []
+    size = 0
+    while size < length:
+        text = rng.choice(texts)
+        parts.append(text)
+        size += len(text) + 1
+    return ' '.join(parts)
+
+
+def random_text(length, rng):
+    pieces = ['Mr. Smith', 'J. R. Doe', ' (', ') ', ' "', '" ', '. ', '? ',
+              '! ', 'The ', 'Gen. ', 'said ', 'a ', 'word ', 'Reuters ',
+              'x' * 40 + ' ']
+    return ''.join(rng.choice(pieces) for _ in range(length // 4))
+
+
+def timed(label, func, stories, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        start = time.time()
+        for story in stories:
+            func(story)
+        elapsed = time.time() - start
+        gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    size = sum(len(story) for story in stories)
+    print('{:<28} {:9.1f} us/story {:8.2f} MB/s'.format(
+        label, 1e6 * best / len(stories), size / best / 1e6))
+    return best
+
+
+def main():
+    aparse = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    aparse.add_argument('-l', '--lengths', type=int, nargs='+',
+                        default=[2000, 20000, 200000],
+                        help='story lengths in characters')
+    aparse.add_argument('-r', '--repeat', type=int, default=3)
+    aparse.add_argument('-s', '--seed', type=int, default=0)
+    args = aparse.parse_args()
+
+    rng = random.Random(args.seed)
+    texts = read_texts([
+        utilities._get_data('data/text', 'GigaWord.sample.PETR.xml'),
+        utilities._get_data('data/text', 'PETR.UnitTest.records.xml')])
+
+    checked = [random_text(rng.randint(10, 3000), rng) for _ in range(2000)]
+    differ = sum(list(PETRreader.iter_sentences(text)) !=
+                 legacy_sentence_segmenter(text) for text in checked)
+    print('{} random texts, {} split differently than by the previous '
+          'version'.format(len(checked), differ))
+
+    for length in args.lengths:
+        stories = [wire_story(texts, length, rng)
+                   for _ in range(max(1, 200000 // length))]
+        differ = sum(list(PETRreader.iter_sentences(story)) !=
+                     legacy_sentence_segmenter(story) for story in stories)
+        print('\n{} stories of {} characters, {} split differently'.format(
+            len(stories), length, differ))
+        timed('segmenter (legacy)', legacy_sentence_segmenter, stories,
+              args.repeat)
+        timed('iter_sentences', lambda story: list(
+            PETRreader.iter_sentences(story)), stories, args.repeat)
+
+    # an unclosed bracket holds back every sentence end after it, which the
+    # previous version recounted from the start of the text at each of them
+    story = '(' + 'The army said the talks would resume. ' * 5000
+    print('\nunclosed bracket, {} characters'.format(len(story)))
+    timed('segmenter (legacy)', legacy_sentence_segmenter, [story], 1)
+    timed('iter_sentences', lambda story: list(
+        PETRreader.iter_sentences(story)), [story], 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Throughput benchmark of a batch run on synthetic corpora (see synthetic.py) of
+1k, 10k and 100k sentences. Each corpus is coded with petrarch2.run() and the
+time it spends in each stage -- reading, discard checks, building the trees,
+coding the events, extracting the actor and event text, coding the issues and
+writing -- is reported per sentence, along with the sentence latency
+percentiles. The results are written as JSON; given a baseline written by an
+earlier run, the stages that got slower by more than the tolerance are
+listed and the exit status is 1.
+
+Usage:
+    python benchmarks/bench_stages.py [-n 1000 10000 100000] [-o RESULTS.json]
+                                      [-b BASELINE.json] [-t TOLERANCE]
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import sys
+import json
+import codecs
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from petrarch2 import petrarch2, PETRglobals, PETRreader, utilities
+import synthetic
+
+STAGES = ['read', 'discards', 'tree', 'events', 'phrases', 'issues', 'write']
+
+
+def bench_size(builder, sentences, workdir):
+    corpus = os.path.join(workdir, 'corpus.{}.xml'.format(sentences))
+    builder.write(corpus, sentences)
+
+    # petrarch2.run() writes evts.<name> in the current directory, and prints
+    # every story it codes
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    os.chdir(workdir)
+    sys.stdout = codecs.open(os.devnull, 'w', 'utf-8')
+    try:
+        start = time.time()
+        counts = petrarch2.run([corpus], 'bench.txt', True)
+        seconds = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        os.chdir(cwd)
+    os.remove(corpus)
+    os.remove(os.path.join(workdir, 'evts.bench.txt'))
+
+    stats = utilities.coding_stats(counts)
+    stages = stats['stages']
+    return {'sentences': sentences,
+            'seconds': seconds,
+            'sentences_per_second': sentences / seconds,
+            'events': stats['counts']['NEvents'],
+            'stage_us_per_sentence': dict(
+                (stage, 1e6 * stages.get(stage, 0.0) / sentences)
+                for stage in STAGES),
+            'latency': stats['latency']}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the per-sentence stage times of results against baseline and
+    returns the (size, stage, ratio) of those more than tolerance slower.
+    Stages under a microsecond per sentence in the baseline are too noisy to
+    compare.
+    """
+    slower = []
+    for size in sorted(results['sizes'], key=int):
+        if size not in baseline.get('sizes', {}):
+            continue
+        new = results['sizes'][size]['stage_us_per_sentence']
+        old = baseline['sizes'][size]['stage_us_per_sentence']
+        print('\n{} sentences: us/sentence (baseline -> now)'.format(size))
+        for stage in STAGES:
+            if stage not in old or stage not in new:
+                continue
+            ratio = new[stage] / old[stage] if old[stage] else 1.0
+            flag = ''
+            if old[stage] >= 1.0 and ratio > 1 + tolerance:
+                slower.append((size, stage, ratio))
+                flag = '  SLOWER'
+            print('  {:<9} {:9.1f} -> {:9.1f}  x{:.2f}{}'.format(
+                stage, old[stage], new[stage], ratio, flag))
+    return slower
+
+
+def main():
+    aparse = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    aparse.add_argument('-n', '--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    aparse.add_argument('-s', '--seed', type=int, default=0)
+    aparse.add_argument('-c', '--config', default=utilities._get_data(
+        'data/config/', 'PETR_config.ini'))
+    aparse.add_argument('--shapes', nargs='+',
+                        default=synthetic.default_shapes(),
+                        help='XML files whose parse trees are reused')
+    aparse.add_argument('-o', '--output', default='bench_stages.json',
+                        help='file to write the results to')
+    aparse.add_argument('-b', '--baseline',
+                        help='results of an earlier run to compare with')
+    aparse.add_argument('-t', '--tolerance', type=float, default=0.2,
+                        help='slowdown of a stage reported as a regression')
+    args = aparse.parse_args()
+
+    utilities.init_logger(os.devnull)
+    PETRreader.parse_Config(args.config)
+    PETRglobals.PrintEvents = False
+    petrarch2.read_dictionaries()
+    shapes = synthetic.read_shapes(args.shapes)
+
+    results = {'python': platform.python_version(),
+               'platform': platform.platform(),
+               'seed': args.seed,
+               'shapes': [os.path.basename(path) for path in args.shapes],
+               'sizes': {}}
+    workdir = tempfile.mkdtemp(prefix='petr_bench')
+    try:
+        for size in args.sizes:
+            # the same seed for every size: the smaller corpora are the
+            # beginning of the larger ones
+            builder = synthetic.CorpusBuilder(shapes, args.seed)
+            result = bench_size(builder, size, workdir)
+            results['sizes'][str(size)] = result
+            print('{:>7} sentences {:8.1f} s {:8.0f} sentences/s  p50 {:.2f} '
+                  'ms  p99 {:.2f} ms'.format(
+                      size, result['seconds'],
+                      result['sentences_per_second'],
+                      1e3 * result['latency']['p50'],
+                      1e3 * result['latency']['p99']))
+    finally:
+        shutil.rmtree(workdir)
+
+    with open(args.output, 'w') as fout:
+        json.dump(results, fout, indent=2, sort_keys=True)
+    print('Results:', args.output)
+
+    if args.baseline:
+        with open(args.baseline) as fin:
+            baseline = json.load(fin)
+        slower = compare(results, baseline, args.tolerance)
+        if slower:
+            print('\n{} stages more than {:.0%} slower than {}'.format(
+                len(slower), args.tolerance, args.baseline))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Synthetic parsed corpora of any size for benchmarking. The parse trees of a
+set of shape sentences -- by default the validation records -- are reused
+with their proper noun phrases replaced by actors sampled from
+PETRglobals.ActorDict, some of them with an agent from AgentDict, and their
+dictionary verbs replaced by verbs sampled from VerbDict, half of them verbs
+with patterns. The same seed, dictionaries and shapes always give the same
+corpus.
+
+Usage:
+    python benchmarks/synthetic.py -n SENTENCES -o CORPUS.xml [-s SEED]
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import sys
+import re
+import random
+import argparse
+import datetime
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from petrarch2 import petrarch2, PETRglobals, PETRreader, utilities
+
+# longest actor phrase sampled, in words
+MAX_ACTOR_WORDS = 4
+AGENT_SHARE = 0.25
+PATTERN_VERB_SHARE = 0.5
+MAX_STORY_SENTENCES = 5
+FIRST_DATE = datetime.date(1995, 1, 1).toordinal()
+LAST_DATE = datetime.date(2015, 12, 31).toordinal()
+_UNUSABLE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f()]')
+
+
+def _balanced(tokens):
+    # a single tree: the brackets only close the root at the last token
+    depth = 0
+    for index, token in enumerate(tokens):
+        depth += 1 if token[0] == '(' else -1 if token == ')' else 0
+        if depth <= 0:
+            return depth == 0 and index == len(tokens) - 1
+    return False
+
+
+def read_shapes(paths):
+    """
+    Token lists of the formatted parse trees of the sentences in paths; the
+    trees with unbalanced brackets are left out.
+    """
+    shapes = []
+    for path in paths:
+        for _, elem in ET.iterparse(path):
+            if elem.tag == 'Sentence':
+                parse = elem.find('Parse')
+                if parse is not None and parse.text and parse.text.strip():
+                    tokens = utilities.tokenize_parse(
+                        utilities._format_parsed_str(parse.text))
+                    if _balanced(tokens):
+                        shapes.append(tokens)
+                elem.clear()
+    return shapes
+
+
+def _words(trie, words):
+    # every key but '#' on every level of a nested-dict trie
+    stack = [trie]
+    while stack:
+        branch = stack.pop()
+        for word, value in branch.items():
+            if word != '#':
+                words.add(word)
+                if isinstance(value, dict):
+                    stack.append(value)
+    return words
+
+
+def _phrases(trie, max_words):
+    # the word sequences of a nested-dict trie that end in a '#' entry; a
+    # few dictionary words hold control characters, which XML cannot, or
+    # brackets, which would unbalance the parse tree
+    found = []
+    stack = [(trie, ())]
+    while stack:
+        branch, words = stack.pop()
+        if '#' in branch and words and not _UNUSABLE.search(' '.join(words)):
+            found.append(words)
+        if len(words) < max_words:
+            for word, value in branch.items():
+                if word != '#':
+                    stack.append((value, words + (word,)))
+    return sorted(found)
+
+
+class CorpusBuilder(object):
+    """
+    Builds synthetic sentences from shapes, the token lists of parse trees,
+    and the dictionaries loaded in PETRglobals, which need to be nested dicts
+    rather than a mapped trie.
+    """
+
+    def __init__(self, shapes, seed=0):
+        if not isinstance(PETRglobals.ActorDict, dict):
+            raise ValueError('sampling needs the actor dictionaries in '
+                             'memory; unset trie_name in the config')
+        self.shapes = shapes
+        self.random = random.Random(seed)
+        self.actors = _phrases(PETRglobals.ActorDict, MAX_ACTOR_WORDS)
+        self.agents = [words[0] for words in _phrases(PETRglobals.AgentDict,
+                                                      1)]
+        verbs = PETRglobals.VerbDict['verbs']
+        patterns = PETRglobals.VerbDict['phrases']
+        self.verbs = sorted(verb for verb in verbs if '#' in verbs[verb])
+        self.pattern_verbs = [verb for verb in self.verbs
+                              if verbs[verb]['#'].get('#', {}).get(
+                                  'meaning') in patterns]
+        self.dictionary_words = set()
+        for trie in (PETRglobals.ActorDict, PETRglobals.AgentDict, verbs):
+            _words(trie, self.dictionary_words)
+
+    def _actor(self):
+        leaves = ['(NNP {} )'.format(word)
+                  for word in self.random.choice(self.actors)]
+        if self.agents and self.random.random() < AGENT_SHARE:
+            leaves.append('(NN {} )'.format(self.random.choice(self.agents)))
+        return '(NP ' + ' '.join(leaves) + ' )'
+
+    def _verb(self):
+        if self.pattern_verbs and self.random.random() < PATTERN_VERB_SHARE:
+            return self.random.choice(self.pattern_verbs)
+        return self.random.choice(self.verbs)
+
+    def sentence(self):
+        """
+        Returns (text, parse) for a new sentence: the parse is in the
+        format of utilities._format_parsed_str().
+        """
+        tokens = self.random.choice(self.shapes)
+        verbs = PETRglobals.VerbDict['verbs']
+        dictionary_words = self.dictionary_words
+        out = []
+        index = 0
+        while index < len(tokens):
+            token = tokens[index]
+            # a noun phrase of proper nouns only is an actor slot, as are the
+            # made-up actors of the validation records, which are tagged NN
+            end = index + 1
+            while (end + 2 < len(tokens) and tokens[end + 2] == ')' and
+                   (tokens[end] in ('(NNP', '(NNPS') or
+                    (tokens[end] == '(NN' and
+                     tokens[end + 1] not in dictionary_words))):
+                end += 3
+            if token == '(NP' and end > index + 1 and tokens[end] == ')':
+                out.append(self._actor())
+                index = end + 1
+                continue
+            if (token.startswith('(VB') and index + 2 < len(tokens) and
+                    tokens[index + 2] == ')' and tokens[index + 1] in verbs):
+                out.append('{} {} )'.format(token, self._verb()))
+                index += 3
+                continue
+            out.append(token)
+            index += 1
+        parse = ' '.join(out)
+        words = [token for token in parse.split()
+                 if token != ')' and not token.startswith('(')]
+        text = ' '.join(words).capitalize()
+        return text, parse
+
+    def write(self, path, sentences):
+        """
+        Writes a corpus of the given number of sentences to path, in the
+        XML input format, as stories of 1 to MAX_STORY_SENTENCES sentences.
+        """
+        with io.open(path, 'w', encoding='utf-8') as fout:
+            fout.write('<Sentences>\n')
+            story = 0
+            written = 0
+            while written < sentences:
+                story += 1
+                date = datetime.date.fromordinal(self.random.randint(
+                    FIRST_DATE, LAST_DATE)).strftime('%Y%m%d')
+                length = min(self.random.randint(1, MAX_STORY_SENTENCES),
+                             sentences - written)
+                for number in range(1, length + 1):
+                    text, parse = self.sentence()
+                    fout.write(
+                        '<Sentence date={} id={} source="SYN" '
+                        'sentence="True">\n<Text>\n{}\n</Text>\n'
+                        '<Parse>\n{}\n</Parse>\n</Sentence>\n'.format(
+                            quoteattr(date),
+                            quoteattr('SYN{:07d}_{}'.format(story, number)),
+                            escape(text), escape(parse)))
+                written += length
+            fout.write('</Sentences>\n')
+
+
+def default_shapes():
+    return [utilities._get_data('data/text', 'PETR.UnitTest.records.xml')]
+
+
+def main():
+    aparse = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    aparse.add_argument('-n', '--sentences', type=int, default=1000)
+    aparse.add_argument('-o', '--output', required=True)
+    aparse.add_argument('-s', '--seed', type=int, default=0)
+    aparse.add_argument('-c', '--config', default=utilities._get_data(
+        'data/config/', 'PETR_config.ini'))
+    aparse.add_argument('--shapes', nargs='+', default=default_shapes(),
+                        help='XML files whose parse trees are reused')
+    args = aparse.parse_args()
+
+    PETRreader.parse_Config(args.config)
+    petrarch2.read_dictionaries()
+    builder = CorpusBuilder(read_shapes(args.shapes), args.seed)
+    builder.write(args.output, args.sentences)
+    print('Wrote {} sentences to {}'.format(args.sentences, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+##	PETRcache.py [module]
+##
+# Cache of coded sentences
+#
+# Wire-service corpora repeat the same sentence across outlets and re-runs. The
+# result of PETRtree.Sentence(...).get_events() depends only on the parse, on
+# where the sentence date falls among the actor date restrictions, and on the
+# dictionaries and options that were loaded, so it is cached under a hash of
+# those three. The cache has a bounded in-memory LRU tier and an optional
+# sqlite tier that survives across runs.
+#
+# This code is covered under the MIT license
+# ------------------------------------------------------------------------
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import bisect
+import hashlib
+import logging
+import sqlite3
+from collections import OrderedDict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import utilities
+
+CacheVersion = 1
+
+# new sentences are written to sqlite in batches, each in a transaction of its
+# own: a lost batch only costs recoding those sentences, and the write lock
+# that the processes of a -w run share is held only while a batch is written
+_COMMIT_EVERY = 256
+
+
+def actor_date_bounds(actor_dict):
+    """
+    Sorted list of the ordinal dates at which the coding of some actor changes
+    because of a date restriction. actor_dict is PETRglobals.ActorDict, either
+    the nested dicts or a PETRtrie node.
+    """
+    if hasattr(actor_dict, 'trie'):
+        entries = actor_dict.trie.payloads()
+    else:
+        entries = []
+        stack = [actor_dict]
+        while stack:
+            branch = stack.pop()
+            for word, value in branch.iteritems():
+                if word == '#':
+                    entries.append(value)
+                else:
+                    stack.append(value)
+    bounds = set()
+    for entry in entries:
+        if not isinstance(entry, list):
+            continue    # agent codes and the like
+        for item in entry:
+            if isinstance(item, tuple) and item[1]:
+                bounds.update(date for date in item[1] if date is not None)
+    return sorted(bounds)
+
+
+class SentenceCache(object):
+    """
+    Maps (parse, date) to the (coded_events, meta) pair of a sentence.
+
+    Parameters
+    ----------
+
+    size: Integer.
+          Number of sentences kept in memory; the least recently used are
+          dropped first.
+
+    path: String.
+          sqlite file for the on-disk tier, or "" to keep the cache in memory.
+
+    fingerprint: String.
+                 Identifies the dictionaries and options the results were
+                 coded with, e.g. from PETRreader.dictionary_fingerprint().
+
+    date_bounds: List.
+                 From actor_date_bounds(). Sentences whose dates fall between
+                 the same two bounds are coded the same way.
+    """
+
+    def __init__(self, size, path="", fingerprint="", date_bounds=()):
+        self.size = size
+        self.pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+        self._prefix = '{}|{}|'.format(CacheVersion, fingerprint)
+        self._bounds = list(date_bounds)
+        self._entries = OrderedDict()
+        self._db = None
+        self._pending = {}      # new entries not yet written to sqlite
+        if path:
+            self._db = sqlite3.connect(path, timeout=60)
+            # in WAL mode the reads of one process do not wait for the
+            # writes of another
+            self._db.execute('PRAGMA journal_mode = WAL')
+            self._db.execute('PRAGMA synchronous = OFF')
+            self._db.execute('CREATE TABLE IF NOT EXISTS sentences '
+                             '(key TEXT PRIMARY KEY, value BLOB)')
+            logging.getLogger('petr_log').info('Sentence cache ' + path)
+
+    def key(self, parsed, date):
+        """ Cache key of a sentence with the parse string parsed on date """
+        bucket = bisect.bisect_right(self._bounds, date)
+        parse = ' '.join(utilities.tokenize_parse(parsed))
+        text = '{}{}|{}'.format(self._prefix, bucket, parse)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """ The cached (coded_events, meta) for key, or None """
+        data = self._entries.pop(key, None)
+        if data is None:
+            data = self._pending.get(key)
+        if data is None and self._db is not None:
+            row = self._db.execute('SELECT value FROM sentences WHERE key = ?',
+                                   (key,)).fetchone()
+            if row:
+                data = bytes(row[0])
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._remember(key, data)
+        # a fresh copy every time: the caller adds to the meta dictionary
+        return pickle.loads(data)
+
+    def put(self, key, value):
+        """ Caches the (coded_events, meta) pair of a newly coded sentence """
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self._remember(key, data)
+        if self._db is not None:
+            self._pending[key] = data
+            if len(self._pending) >= _COMMIT_EVERY:
+                self.flush()
+
+    def flush(self):
+        """ Writes the new entries to sqlite in one transaction """
+        if self._db is not None and self._pending:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO sentences VALUES (?, ?)',
+                [(key, sqlite3.Binary(data))
+                 for key, data in self._pending.items()])
+            self._db.commit()
+            self._pending = {}
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _remember(self, key, data):
+        self._entries[key] = data
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+
+##	PETRcodes.py [module]
+##
+# Conversion between CAMEO event codes and the PETRARCH internal coding
+# ontology
+#
+# The conversion tables are built once, when the module is imported, instead
+# of on every call: convert_code() is called for every verb and every candidate
+# event. CAMEO_TO_PICO and PICO_TO_CAMEO are read-only.
+#
+# This code is covered under the MIT license
+# ------------------------------------------------------------------------
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+
+class _FrozenDict(dict):
+    """ A dict that cannot be changed after it is built """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('code tables are read-only')
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+
+_cameo_table = {"010": 0x1000,  # Make Public Statement
+                "011": 0x1000 - 0xFFFF,
+                "012": 0x100C,
+                "013": 0x1001,
+                "014": 0x1002,
+                "015": 0x10a0,
+                "016": 0x10a0 - 0xFFFF,
+                "017": 0x1003,
+                "018": 0x1004,
+                "019": 0x1005,
+
+
+                "020": 0x2000,  # Appeal
+                "021": 0x2070,
+                "0211": 0x2075,
+                "0212": 0x2076,
+                "0213": 0x2078,
+                "0214": 0x207A,
+                "022": 0x2080,
+                "023": 0x2040,
+                "0231": 0x2045,
+                "0232": 0x2046,
+                "0233": 0x2047,
+                "0234": 0x2049,
+                "024": 0x2060,
+                "0241": 0x2061,
+                "0242": 0x2062,
+                "0243": 0x2063,
+                "0244": 0x2064,
+                "025": 0x2200,
+                "0251": 0x220B,
+                "0252": 0x220C,
+                "0253": 0x220D,
+                "0254": 0x2205,
+                "0255": 0x220E,
+                "0256": 0x220F,
+                "026": 0x2010,
+                "027": 0x2020,
+                "028": 0x2030,
+
+
+                "030": 0x3000,  # Intend
+                "031": 0x3070,
+                "0311": 0x3075,
+                "0312": 0x3076,
+                "0313": 0x3078,
+                "0314": 0x307A,
+                "032": 0x3080,
+                "033": 0x3040,
+                "0331": 0x3045,
+                "0332": 0x3046,
+                "0333": 0x3047,
+                "0334": 0x3049,
+                "034": 0x3060,
+                "0341": 0x3061,
+                "0342": 0x3062,
+                "0343": 0x3063,
+                "0344": 0x3064,
+                "035": 0x3200,
+                "0351": 0x320B,
+                "0352": 0x320C,
+                "0353": 0x320D,
+                "0354": 0x3205,
+                "0355": 0x320E,
+                "0356": 0x320F,
+                "036": 0x3010,
+                "037": 0x3020,
+                "038": 0x3230,
+                "039": 0x3030,
+
+                "040": 0xB000,  # Consult
+                "041": 0xB001,
+                "042": 0xB002,
+                "043": 0xB003,
+                "044": 0xB010,
+                "045": 0xB030,
+                "046": 0xB010,
+
+
+                "050": 0x0080,        # Diplomatic Coop
+                "051": 0x0081,
+                "052": 0x0082,
+                "053": 0x0083,
+                "054": 0x0084,
+                "055": 0x0085,
+                "056": 0x0086,
+                "057": 0x0087,
+
+                "060": 0x0070,        # Material Coop
+                "061": 0x0075,
+                "062": 0x0076,
+                "063": 0x0078,
+                "064": 0x007A,
+
+                "070": 0x0040,        # Provide Aid
+                "071": 0x0045,
+                "072": 0x0046,
+                "073": 0x0047,
+                "074": 0x0049,
+                "075": 0x004E,
+
+                "080": 0x0200,  # Yield
+                "081": 0x020B,
+                "0811": 0x0203,
+                "0812": 0x0201,
+                "0813": 0x0204,
+                "0814": 0x0206,
+                "082": 0x020C,
+                "083": 0x0260,
+                "0831": 0x0261,
+                "0832": 0x0262,
+                "0833": 0x0263,
+                "0834": 0x0264,
+                "084": 0x0250,
+                "0841": 0x020C,
+                "0842": 0x020C,
+                "085": 0x0205,
+                "086": 0x020E,
+                "0861": 0x0209,
+                "0862": 0x020A,
+                "0863": 0x0207,
+                "087": 0x02C0,
+                "0871": 0x02C9,
+                "0872": 0x02C1,
+                "0873": 0x02C6,
+                "0874": 0x02C2,
+                "08": 0x0200,
+
+                "090": 0xA000,  # Investigate
+                "091": 0xA001,
+                "092": 0xA002,
+                "093": 0xA003,
+                "094": 0xA004,
+
+                "100": 0x4000,  # Demand
+                "101": 0x4070,
+                "1011": 0x4075,
+                "1012": 0x4076,
+                "1013": 0x4078,
+                "1014": 0x407A,
+                "102": 0x4080,
+                "103": 0x4040,
+                "1031": 0x4045,
+                "1032": 0x4046,
+                "1033": 0x4047,
+                "1034": 0x4049,
+                "104": 0x4060,
+                "1041": 0x4061,
+                "1042": 0x4062,
+                "1043": 0x4063,
+                "1044": 0x4064,
+                "105": 0x4200,
+                "1051": 0x420B,
+                "1052": 0x420C,
+                "1053": 0x420D,
+                "1054": 0x4205,
+                "1055": 0x420E,
+                "1056": 0x420F,
+                "106": 0x4010,
+                "107": 0x4020,
+                "108": 0x4030,
+
+
+                "110": 0x7000,  # Disapprove
+                "111": 0x7001,
+                "112": 0x70a0,
+                "1121": 0x70a1,
+                "1122": 0x70a2,
+                "1123": 0x70a3,
+                "1124": 0x70a4,
+                "1125": 0x70a5,
+                "113": 0x7002,
+                "114": 0x7003,
+                "115": 0x7008,
+                "116": 0x7005,
+
+
+                "120": -0xFFFF,  # Reject
+                "121": -0xFFFF + 0x0070,
+                "1211": -0xFFFF + 0x0075,
+                "1212": -0xFFFF + 0x0076,
+                "122": -0xFFFF + 0x2040 + 0x300,      # The 0x300 mask makes these not code
+                # from "refuse to request aid", but rather
+                "1221": -0xFFFF + 0x2045 + 0x300,
+                "1222": -0xFFFF + 0x2046 + 0x300,       # be a thing of their own while retaining
+                # the features of the meaning.
+                "1223": -0xFFFF + 0x2047 + 0x300,
+                "1224": -0xFFFF + 0x2049 + 0x300,
+                "123": -0xFFFF + 0x2060 + 0x300,
+                "1231": -0xFFFF + 0x2061 + 0x300,
+                "1232": -0xFFFF + 0x2062 + 0x300,
+                "1233": -0xFFFF + 0x2063 + 0x300,
+                "1234": -0xFFFF + 0x2064 + 0x300,
+                "124": -0xFFFF + 0x0200,
+                "1241": -0xFFFF + 0x020B,
+                "1242": -0xFFFF + 0x020C,
+                "1243": -0xFFFF + 0x020D,
+                "1244": -0xFFFF + 0x0205,
+                "1245": -0xFFFF + 0x020E,
+                "1246": -0xFFFF + 0x02C0,
+                "125": -0xFFFF + 0x0010,
+                "126": -0xFFFF + 0x0030,
+                "127": -0xFFFF + 0x0020,
+                "128": -0xFFFF + 0x0002,
+                "129": -0xFFFF + 0x0001,
+
+                "130": 0x6000,  # Threaten
+                "131": 0x6100,
+                "1311": 0x6140,
+                "1312": 0x6105,
+                "1313": 0x6180,
+                "132": 0x600B,
+                "1321": 0x6003,
+                "1322": 0x6001,
+                "1323": 0x6004,
+                "1324": 0x6006,
+                "133": 0x600C,
+                "134": 0x6010,
+                "135": 0x6030,
+                "136": 0x600E,
+                "137": 0x6004,
+                "138": 0x60A0,
+                "1381": 0x60A1,
+                "1382": 0x60A2,
+                "1383": 0x60A3,
+                "1384": 0x60A4,
+                "1385": 0x60B0,
+                "139": 0x6005,
+
+
+                "140": 0x5000,  # Protest
+                "145": 0x50A0,
+
+                "150": 0x8000,  # Exhibit Force Posture
+                "151": 0x8001,
+                "152": 0x8002,
+                "153": 0x8003,
+                "154": 0x8004,
+
+                "160": 0x0100,  # Reduce Relations
+                "161": 0x0180,
+                "162": 0x0140,
+                "1621": 0x0145,
+                "1622": 0x0146,
+                "1623": 0x0147,
+                "163": 0x000B,
+                "164": 0x0110,
+                "165": 0x0130,
+                "166": 0x0150,
+                "1661": 0x0159,
+                "1662": 0x015A,
+                "1663": 0x015E,
+
+                "170": 0x9000,  # Coerce
+                "171": 0x9010,
+                "1711": 0x9011,
+                "1712": 0x9012,
+                "172": 0x900B,
+                "1721": 0x9003,
+                "1722": 0x9001,
+                "1723": 0x9004,
+                "1724": 0x9006,
+                "173": 0x9020,
+                "174": 0x9030,
+                "175": 0x9040,
+
+                "180": 0x0090,  # Assault
+                "181": 0x0091,
+                "182": 0x0092,
+                "1821": 0x0093,
+                "1822": 0x0094,
+                "1823": 0x0095,
+                "1824": 0x0096,
+                "183": 0x0097,
+                "1831": 0x0098,
+                "1832": 0x0099,
+                "1833": 0x009A,
+                "1834": 0x009B,
+                "184": 0x009C,
+                "185": 0x009D,
+                "186": 0x009E,
+
+
+                "190": 0x00A0,  # Fight
+                "191": 0x00A1,
+                "192": 0x00A2,
+                "193": 0x00A3,
+                "194": 0x00A4,
+                "195": 0x00A5,
+                "1951": 0x00A6,
+                "1952": 0x00A7,
+                "196": 0x00A8,
+
+                "200": 0x00B0,  # Use Unconventional Mass Violence
+                "---": 0}
+
+# the reverse table resolves CAMEO codes that share an internal code exactly as
+# the conversion always has, by building it from the items of the same dict
+_pico_table = dict(map(lambda a: (a[1], a[0]), _cameo_table.items()) +
+                   [(0x30a0, "138"),   # Other weird quirks: want to attack
+                    ])
+
+CAMEO_TO_PICO = _FrozenDict(_cameo_table)
+PICO_TO_CAMEO = _FrozenDict(_pico_table)
+
+
+def _split_code(code):
+    """ (active, passive) internal codes of an 'ACTIVE:PASSIVE' CAMEO code """
+    cat = _cameo_table
+    active = code.split(":")
+    passive = active[1] if len(active) > 1 else "---"
+    active = active[0] if active[0] else "---"
+
+    if active in cat:
+        active = cat[active]
+    else:
+        active = cat[active[:2] + "0"]
+    if passive in cat:
+        passive = cat[passive]
+    else:
+        passive = cat[passive[:2] + "0"]
+
+    return active, passive
+
+
+# combined active/passive lookup: the codes in the table are converted here and
+# any other code, e.g. "040:081", the first time it is seen
+_code_pairs = dict((code, _split_code(code)) for code in _cameo_table)
+
+
+def convert_code(code, forward=1):
+    """
+    Convert a verb code between CAMEO and the Petrarch internal coding ontology.
+
+                New coding scheme:
+
+            0                0          0                       0
+            2 Appeal         1 Reduce   1 Meet                  1 Leadership
+            3 Intend         2 Yield    2 Settle                2 Policy
+            4 Demand                    3 Mediate               3 Rights
+            5 Protest                   4 Aid                   4 Regime
+            6 Threaten	                5 Expel                 5 Econ
+            1 Say                       6 Pol. Change           6 Military
+            7 Disapprove                7 Mat. Coop             7 Humanitarian
+            8 Posture                   8 Dip. Coop             8 Judicial
+            9 Coerce                    9 Assault	            9 Peacekeeping
+            A Investigate               A Fight		        	A Intelligence
+            B Consult  		       		B Mass violence			B Admin. Sanctions
+                                                                                            C Dissent
+                                                                                                D Release
+                                                                                            E Int'l Involvement
+                                                                                                            F D-escalation
+
+    In the first column, higher numbers take priority. i.e. “Say + Intend” is just “Intend” or “Intend + Consult” is just Consult
+
+
+    Parameters
+    ----------
+    code: string or int, depending on forward
+          Code to be converted
+
+    forward: boolean
+             Direction of conversion, True = CAMEO -> PICO
+
+
+    Returns
+    -------
+    Forward mode:
+        active, passive : int
+                          The two parts of the code [XXX:XXX], converted to the new system. The first is an inherent
+                          active meaning, the second is an inherent passive meaning. Both are not always present,
+                          most codes just have the active.
+
+    """
+
+    if forward:
+        try:
+            return _code_pairs[code]
+        except KeyError:
+            pair = _code_pairs[code] = _split_code(code)
+            return pair
+
+    if code and code in _pico_table:
+        return _pico_table[code]
+
+    return 0  # hex(code)
+
+
+def convert_codes(codes, forward=1):
+    """
+    Converts a sequence of codes in one call, for post-processing coded
+    events; the result is the list of what convert_code() returns for each.
+
+    Parameters
+    ----------
+    codes: iterable of strings or ints, depending on forward
+           Codes to be converted
+
+    forward: boolean
+             Direction of conversion, True = CAMEO -> PICO
+
+
+    Returns
+    -------
+    List of (active, passive) pairs in forward mode, otherwise of CAMEO code
+    strings, with 0 for internal codes that have no CAMEO equivalent.
+    """
+    if forward:
+        pairs = _code_pairs
+        return [pairs[code] if code in pairs else convert_code(code)
+                for code in codes]
+    table = _pico_table
+    return [table[code] if code and code in table else 0 for code in codes]
+
+
+def combine_code(selfcode, to_add):
+    """
+    Combines two verb codes, part of the verb interaction framework
+
+
+    Parameters
+    ----------
+    selfcode,to_add: ints
+                     Upper and lower verb codes, respectively
+
+    Returns
+    -------
+    combined value
+
+    """
+
+    if to_add < 0:
+        return to_add + selfcode
+    if selfcode >= 0x1000 and to_add >= 0x1000:
+        return to_add  # If both verbs are high-level, take the lower nested one. I think this is what we want?
+    if to_add >= selfcode:
+        return to_add
+
+    return selfcode + to_add
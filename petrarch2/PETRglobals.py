@@ -32,12 +32,17 @@
 # in more detail in the config.ini file.
 
 VerbDict = {'verbs':{}, 'phrases':{}, 'transformations' : {}}  # verb dictionary
+VerbPatterns = ({}, [], [], {}, [])  # state tables compiled from VerbDict['phrases']
+VerbTransforms = {}  # outcome of VerbDict['transformations'] by event signature
 ActorDict = {}  # actor dictionary
 ActorCodes = []  # actor code list
 AgentDict = {}  # agent dictionary
 DiscardList = {}  # discard list
+DiscardAutomaton = None  # phrase automaton over DiscardList
 IssueList = []
 IssueCodes = []
+IssueAutomaton = None  # phrase automaton over IssueList
+FirstWords = frozenset()  # words that an actor or agent entry starts with
 
 ConfigFileName = "PETR_config.ini"
 VerbFileName = ""  # verb dictionary
@@ -47,6 +52,8 @@ DiscardFileName = ""  # discard list
 TextFileList = []  # current text or validation file
 EventFileName = ""  # event output file
 IssueFileName = ""  # issues list
+SnapshotFileName = ""  # compiled snapshot of all of the dictionaries
+TrieFileName = ""  # memory-mapped actor and agent dictionaries
 
 # element followed by attribute and content pairs for XML line
 AttributeList = []
@@ -60,11 +67,21 @@ NewActorLength = 0  # Maximum length for new actors extracted from noun phrases
 # Defaults are more or less equivalent to TABARI
 RequireDyad = True  # Events require a non-null source and target
 StoponError = False  # Raise stop exception on errors rather than recovering
+CacheSize = 0  # Coded sentences kept in memory by the sentence cache
+CacheFileName = ""  # sqlite file of coded sentences kept across runs
+DedupeWindow = 0  # Number of recent stories checked for near-duplicates; 0 is off
+DedupeDistance = 9  # Most SimHash bits in which a near-duplicate story differs
+CheckpointStories = 1000  # Most stories written between checkpoints of a batch run
+XMLReaders = 1  # Number of XML input files read at the same time, in threads
+ReadQueue = 256  # Most sentence entries read ahead by each XML reader thread
+KeepCodingMeta = False  # Keep the parse trees and coding metadata of coded sentences
 
 # OUTPUT OPTIONS
 WriteActorRoot = False  # Include actor root in event record
 WriteActorText = False  # Include actor text in event record
 WriteEventText = False  # Include event text in event record
+PrintEvents = True  # Also print each event to the console as it is written
+FlushStories = 100  # Stories written between flushes of the event file
 
 RunTimeString = ''  # used in error and debugging files -- just set it once
 
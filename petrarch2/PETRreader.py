@@ -42,9 +42,15 @@ from __future__ import unicode_literals
 import io
 import re
 import os
+import gc
 import sys
 import math  # required for ordinal date calculations
+import hashlib
 import logging
+import Queue
+import itertools
+import threading
+import collections
 import xml.etree.ElementTree as ET
 from functools import reduce
 
@@ -53,8 +59,19 @@ try:
 except ImportError:
     from configparser import ConfigParser
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    from lxml import etree     # faster XML input parsing when installed
+except ImportError:
+    etree = ET
+
 import PETRglobals
 import utilities
+import PETRcodes
 
 
 # ================== STRINGS ================== #
@@ -168,6 +185,15 @@ def parse_Config(config_path):
                 'Dictionaries',
                 'issuefile_name')
 
+        if parser.has_option('Dictionaries', 'snapshot_name'):
+            PETRglobals.SnapshotFileName = parser.get(
+                'Dictionaries',
+                'snapshot_name')
+        if parser.has_option('Dictionaries', 'trie_name'):
+            PETRglobals.TrieFileName = parser.get(
+                'Dictionaries',
+                'trie_name')
+
         if parser.has_option('Options', 'new_actor_length'):
             try:
                 PETRglobals.NewActorLength = parser.getint(
@@ -179,6 +205,38 @@ def parse_Config(config_path):
                 raise
         print("new_actor_length =", PETRglobals.NewActorLength)
 
+        if parser.has_option('Options', 'cache_size'):
+            try:
+                PETRglobals.CacheSize = parser.getint('Options', 'cache_size')
+            except ValueError:
+                print(
+                    "Error in config.ini Option: cache_size value must be an integer")
+                raise
+        if parser.has_option('Options', 'cache_name'):
+            PETRglobals.CacheFileName = parser.get('Options', 'cache_name')
+
+        for optname, globname in (('dedupe_window', 'DedupeWindow'),
+                                  ('dedupe_distance', 'DedupeDistance'),
+                                  ('checkpoint_stories', 'CheckpointStories'),
+                                  ('xml_readers', 'XMLReaders'),
+                                  ('read_queue', 'ReadQueue'),
+                                  ('flush_stories', 'FlushStories')):
+            if parser.has_option('Options', optname):
+                try:
+                    value = parser.getint('Options', optname)
+                except ValueError:
+                    print("Error in config.ini Option: " + optname +
+                          " value must be an integer")
+                    raise
+                # the SimHash fingerprints are 64 bits, split into
+                # dedupe_distance + 1 bands of at least one bit
+                if optname == 'dedupe_distance' and not 0 <= value <= 63:
+                    print("Error in config.ini Option: dedupe_distance value "
+                          "must be between 0 and 63")
+                    raise ValueError('dedupe_distance must be between 0 '
+                                     'and 63')
+                setattr(PETRglobals, globname, value)
+
         PETRglobals.StoponError    = get_config_boolean('stop_on_error')
         PETRglobals.WriteActorRoot = get_config_boolean('write_actor_root')
         PETRglobals.WriteActorText = get_config_boolean('write_actor_text')
@@ -192,6 +250,13 @@ def parse_Config(config_path):
         else:
             PETRglobals.RequireDyad = True
 
+        PETRglobals.KeepCodingMeta = get_config_boolean('keep_coding_meta')
+
+        if parser.has_option('Options', 'print_events'):  # also defaults to True
+            PETRglobals.PrintEvents = get_config_boolean('print_events')
+        else:
+            PETRglobals.PrintEvents = True
+
         # otherwise this was set in command line
         if len(PETRglobals.EventFileName) == 0:
             PETRglobals.EventFileName = parser.get('Options', 'eventfile_name')
@@ -464,8 +529,9 @@ def read_discard_list(discard_path):
 
     The file format allows # to be used as a in-line comment delimiter.
 
-    File is stored as a simple list and the interpretation of the strings is done in
-    check_discards()
+    File is stored as a word trie in PETRglobals.DiscardList, and the automaton that
+    check_discards() uses to find the phrases is built from it in
+    PETRglobals.DiscardAutomaton.
 
     ===== EXAMPLE =====
     +5K RUN #  ELH 06 Oct 2009
@@ -518,6 +584,8 @@ def read_discard_list(discard_path):
 
         line = read_FIN_line()
     close_FIN()
+    PETRglobals.DiscardAutomaton = utilities.build_phrase_automaton(
+        PETRglobals.DiscardList, ['+', '$'])
 
 
 def read_issue_list(issue_path):
@@ -536,9 +604,9 @@ def read_issue_list(issue_path):
 
     The file format allows # to be used as a in-line comment delimiter.
 
-    File is stored in PETRglobals.IssueList as a list of tuples (string, index) where
-    index refers to the location of the code in PETRglobals.IssueCodes. The coding is done
-    in check_issues()
+    File is stored in PETRglobals.IssueList as a word trie whose '#' entries are the index
+    of the code in PETRglobals.IssueCodes, and compiled into the automaton
+    PETRglobals.IssueAutomaton. The coding is done in get_issues()
 
     Issues are written to the event record as a comma-delimited list to a tab-delimited
     field, e.g.
@@ -663,6 +731,8 @@ def read_issue_list(issue_path):
             path[segs[0]] = codeindex
         line = read_FIN_line()
     close_FIN()
+    PETRglobals.IssueAutomaton = utilities.build_phrase_automaton(
+        PETRglobals.IssueList, ['#'])
 
     """ debug
 	ka = 0
@@ -862,6 +932,8 @@ def read_verb_dictionary(verb_path):
                 continue
             pattern = line[1:].split("#")[0]
             # print(line)
+            # every synset expansion of a pattern shares its terminal entry
+            terminals = {}
             for pat in resolve_synset(pattern):
                 segs = pat.split("*")
 
@@ -953,7 +1025,9 @@ def read_verb_dictionary(verb_path):
                                 path = path.setdefault(",", {}) if not count == len(phrase[1]) else path
                                 count += 1
 
-                path["#"] = {'code': code[1:-1], 'line': line[:-1]}
+                if code not in terminals:
+                    terminals[code] = {'code': code[1:-1], 'line': line[:-1]}
+                path["#"] = terminals[code]
         elif syn and line.startswith("&"): #read SYNONYM SETS block information
             block_meaning = line.strip()
         elif syn and line.startswith("+"): #read SYNONYM SETS
@@ -983,7 +1057,7 @@ def read_verb_dictionary(verb_path):
             path = PETRglobals.VerbDict['transformations']
             while len(ev2) > 1:
                 source = ev2[0]
-                verb = reduce(lambda a, b: a + b, map(lambda c: utilities.convert_code(PETRglobals.VerbDict[
+                verb = reduce(lambda a, b: a + b, map(lambda c: PETRcodes.convert_code(PETRglobals.VerbDict[
                               'verbs'][c]['#']['#']['code'])[0] if not c == "Q" else -1, ev2[-1].split("_")), 0)
 
                 path = path.setdefault(verb, {})
@@ -1057,6 +1131,10 @@ def read_verb_dictionary(verb_path):
                 path = path.setdefault(
                     "#", {'code': code[1:-1], 'meaning': block_meaning, 'line': line[:-1]})
 
+    PETRglobals.VerbPatterns = utilities.build_verb_automaton(
+        PETRglobals.VerbDict['phrases'])
+    PETRglobals.VerbTransforms = {}
+
     # print(sorted(PETRglobals.VerbDict['phrases'].keys()))
     # print(PETRglobals.VerbDict.__sizeof__())
     # print(PETRglobals.VerbDict['phrases'].__sizeof__())
@@ -1783,10 +1861,39 @@ def dstr_to_ordate(datestring):
     return int(ordate)
 
 
+def make_date_interval(dates):
+    """
+    Converts the date restriction strings of an actor code into an interval of
+    ordinal dates (start, end): the code applies to dates with start <= date < end,
+    and None marks an open end. So
+
+        []                    -> (None, None)
+        ['<910625']           -> (None, dstr_to_ordate('910625'))
+        ['>920115']           -> (dstr_to_ordate('920115'), None)
+        ['911008', '920115']  -> (dstr_to_ordate('911008'), dstr_to_ordate('920115'))
+
+    A single date without '<' or '>' is treated as a starting date. Returns None if
+    the dates can't be read; NounPhrase.check_date() never uses such an entry.
+    """
+    try:
+        if not dates:
+            return (None, None)
+        if len(dates) == 1:
+            if dates[0][0] == '<':
+                return (None, dstr_to_ordate(dates[0][1:]))
+            elif dates[0][0] == '>':
+                return (dstr_to_ordate(dates[0][1:]), None)
+            return (dstr_to_ordate(dates[0]), None)
+        return (dstr_to_ordate(dates[0]), dstr_to_ordate(dates[1]))
+    except (DateError, IndexError):
+        return None
+
+
 def read_actor_dictionary(actorfile):
     """ This is a simple dictionary of dictionaries indexed on the words in the actor string. The final node has the
         key '#' and contains codes with their date restrictions and, optionally, the root phrase in the case
-        of synonyms. 
+        of synonyms. The date restrictions are converted to ordinal date intervals by make_date_interval() so
+        that they only need to be read once.
 
         Example: 
 
@@ -1794,7 +1901,7 @@ def read_actor_dictionary(actorfile):
         
         the actor above is stored as:
 
-        {u'UFFE': {u'ELLEMANN': {u'JENSEN': {u'#': [(u'IGOEUREEC', [u'820701', u'821231']), (u'IGOEUREEC', [u'870701', u'871231'])]}}}}
+        {u'UFFE': {u'ELLEMANN': {u'JENSEN': {u'#': [(u'IGOEUREEC', (139339, 139522)), (u'IGOEUREEC', (141165, 141348))]}}}}
 
         """
 
@@ -1819,7 +1926,7 @@ def read_actor_dictionary(actorfile):
                         dates = [datetemp]
                 except:
                     dates = []
-            datelist.append((code, dates))
+            datelist.append((code, make_date_interval(dates)))
         else:
             if line[0] == '+':  # Synonym
                 actor = line[1:].replace("_", ' ').split()
@@ -1885,7 +1992,7 @@ def read_actor_dictionary(actorfile):
                     except:
                         dates = []
 
-                    datelist.append((code, dates))
+                    datelist.append((code, make_date_interval(dates)))
 
                 actor = actortemp.replace("_", ' ').split()
 
@@ -2098,6 +2205,120 @@ def read_agent_dictionary(agent_path):
 
     close_FIN()
 
+
+# ================== DICTIONARY SNAPSHOTS ================== #
+
+# Bump this whenever the in-memory layout of any of the SnapshotGlobals changes
+SnapshotVersion = 6
+
+# PETRglobals attributes that make up the fully loaded dictionaries
+SnapshotGlobals = ['VerbDict', 'ActorDict', 'AgentDict', 'DiscardList',
+                   'DiscardAutomaton', 'IssueList', 'IssueCodes',
+                   'IssueAutomaton', 'VerbPatterns']
+
+
+def dictionary_fingerprint(dictionary_paths):
+    """
+    Computes the key that a dictionary snapshot is valid for: the snapshot
+    version, the configuration options that change how the dictionaries are
+    stored, and the names and contents of the source files.
+
+    Parameters
+    ----------
+
+    dictionary_paths: List.
+                      Paths of the dictionary files, in the order they are read.
+
+    Returns
+    -------
+
+    fingerprint: String.
+                 Hex digest identifying this combination of files and options.
+    """
+    digest = hashlib.sha1()
+    digest.update('{}|{}'.format(SnapshotVersion,
+                                 PETRglobals.WriteActorRoot).encode('utf-8'))
+    for path in dictionary_paths:
+        digest.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as fin:
+            digest.update(hashlib.sha1(fin.read()).digest())
+    return digest.hexdigest()
+
+
+def write_dictionary_snapshot(snapshot_path, fingerprint):
+    """
+    Serializes the loaded dictionaries -- the PETRglobals listed in
+    SnapshotGlobals -- to snapshot_path. The file starts with a small header
+    pickle holding the version, the fingerprint and the size of each
+    dictionary, so freshness can be checked without loading the dictionaries
+    and individual dictionaries can be skipped. The pickled dictionaries
+    follow in SnapshotGlobals order. The file is written to a temporary name
+    and then moved into place so a concurrently starting worker never sees a
+    partial snapshot.
+    """
+    logger = logging.getLogger('petr_log')
+    payloads = [pickle.dumps(getattr(PETRglobals, name),
+                             pickle.HIGHEST_PROTOCOL)
+                for name in SnapshotGlobals]
+    header = {'version': SnapshotVersion, 'fingerprint': fingerprint,
+              'sizes': [len(payload) for payload in payloads]}
+
+    temp_path = '{}.{}.tmp'.format(snapshot_path, os.getpid())
+    with open(temp_path, 'wb') as fout:
+        pickle.dump(header, fout, pickle.HIGHEST_PROTOCOL)
+        for payload in payloads:
+            fout.write(payload)
+    if os.path.exists(snapshot_path) and sys.platform.startswith('win'):
+        os.remove(snapshot_path)
+    os.rename(temp_path, snapshot_path)
+    logger.info('Wrote dictionary snapshot ' + snapshot_path)
+
+
+def read_dictionary_snapshot(snapshot_path, fingerprint, skip=()):
+    """
+    Loads the dictionaries from snapshot_path into PETRglobals if the snapshot
+    exists and was built with the same fingerprint. Returns True if the
+    snapshot was used, False if the caller needs to read the source files.
+    The SnapshotGlobals named in skip are left as they are, e.g. when the
+    actor and agent dictionaries come from a mapped trie instead.
+    """
+    logger = logging.getLogger('petr_log')
+    if not os.path.exists(snapshot_path):
+        return False
+
+    with open(snapshot_path, 'rb') as fin:
+        try:
+            header = pickle.load(fin)
+        except Exception:
+            logger.warning('Unreadable dictionary snapshot ' + snapshot_path)
+            return False
+        if (not isinstance(header, dict) or
+                header.get('version') != SnapshotVersion or
+                header.get('fingerprint') != fingerprint):
+            logger.info('Dictionary snapshot {} is stale'.format(snapshot_path))
+            return False
+
+        # the snapshot is a few hundred thousand small dicts: the cyclic
+        # garbage collector adds nothing but time while they are created
+        payload = {}
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for name, size in zip(SnapshotGlobals, header['sizes']):
+                if name in skip:
+                    fin.seek(size, os.SEEK_CUR)
+                else:
+                    payload[name] = pickle.loads(fin.read(size))
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    for name in payload:
+        setattr(PETRglobals, name, payload[name])
+    PETRglobals.VerbTransforms = {}
+    logger.info('Read dictionary snapshot ' + snapshot_path)
+    return True
+
 # ==== Input format reading
 
 
@@ -2129,65 +2350,252 @@ def read_xml_input(filepaths, parsed=False):
                 the format of this dictionary.
     """
     holding = {}
+    for entry_id, content_dict in iter_xml_input(filepaths, parsed):
+        if entry_id not in holding:
+            holding[entry_id] = content_dict
+        else:
+            holding[entry_id]['sents'].update(content_dict['sents'])
 
-    for path in filepaths:
-        tree = ET.iterparse(path)
-
-        for event, elem in tree:
-            if event == "end" and elem.tag == "Sentence":
-                story = elem
-
-                # Check to make sure all the proper XML attributes are included
-                attribute_check = [key in story.attrib for key in
-                                   ['date', 'id', 'sentence', 'source']]
-                if not attribute_check:
-                    print('Need to properly format your XML...')
-                    break
-
-                # If the XML contains StanfordNLP parsed data, pull that out
-                # TODO: what to do about parsed content at the story level,
-                # i.e., multiple parsed sentences within the XML entry?
-                if parsed:
-                    parsed_content = story.find('Parse').text
-                    parsed_content = utilities._format_parsed_str(
-                        parsed_content)
-                else:
-                    parsed_content = ''
-
-                # Get the sentence information
-                if story.attrib['sentence'] == 'True':
-                    entry_id, sent_id = story.attrib['id'].split('_')
-
-                    text = story.find('Text').text
-                    text = text.replace('\n', ' ').replace('  ', ' ')
-                    sent_dict = {'content': text, 'parsed': parsed_content}
-                    meta_content = {'date': story.attrib['date'],
-                                    'source': story.attrib['source']}
-                    content_dict = {'sents': {sent_id: sent_dict},
-                                    'meta': meta_content}
-                else:
-                    entry_id = story.attrib['id']
-
-                    text = story.find('Text').text
-                    text = text.replace('\n', ' ').replace('  ', ' ')
-                    split_sents = _sentence_segmenter(text)
-                    # TODO Make the number of sents a setting
-                    sent_dict = {}
-                    for i, sent in enumerate(split_sents[:7]):
-                        sent_dict[i] = {'content': sent, 'parsed':
-                                        parsed_content}
-
-                    meta_content = {'date': story.attrib['date']}
-                    content_dict = {'sents': sent_dict, 'meta': meta_content}
-
-                if entry_id not in holding:
-                    holding[entry_id] = content_dict
+    return holding
+
+
+def _iter_xml_file(path, parsed=False):
+    # the sentence entries of one XML input file as (entry_id, content_dict);
+    # each entry is removed from the tree once it is read, so memory stays
+    # constant however large the file
+    if etree is ET:
+        tree = ET.iterparse(path, events=('start', 'end'))
+    else:
+        tree = etree.iterparse(path, events=('start', 'end'),
+                               resolve_entities=False, huge_tree=True)
+    parents = []    # the elements opened and not yet closed
+
+    for event, elem in tree:
+        if event == "start":
+            parents.append(elem)
+            continue
+        parents.pop()
+        if elem.tag == "Sentence":
+            story = elem
+
+            # Check to make sure all the proper XML attributes are included
+            attribute_check = [key in story.attrib for key in
+                               ['date', 'id', 'sentence', 'source']]
+            if not attribute_check:
+                print('Need to properly format your XML...')
+                return
+
+            # If the XML contains StanfordNLP parsed data, pull that out
+            # TODO: what to do about parsed content at the story level,
+            # i.e., multiple parsed sentences within the XML entry?
+            if parsed:
+                parsed_content = story.find('Parse').text
+                parsed_content = utilities._format_parsed_str(parsed_content)
+            else:
+                parsed_content = ''
+
+            # Get the sentence information
+            if story.attrib['sentence'] == 'True':
+                entry_id, sent_id = story.attrib['id'].split('_')
+
+                text = story.find('Text').text
+                text = text.replace('\n', ' ').replace('  ', ' ')
+                sent_dict = {'content': text, 'parsed': parsed_content}
+                meta_content = {'date': story.attrib['date'],
+                                'source': story.attrib['source']}
+                content_dict = {'sents': {sent_id: sent_dict},
+                                'meta': meta_content}
+            else:
+                entry_id = story.attrib['id']
+
+                text = story.find('Text').text
+                text = text.replace('\n', ' ').replace('  ', ' ')
+                # TODO Make the number of sents a setting
+                sent_dict = {}
+                for i, sent in enumerate(itertools.islice(
+                        iter_sentences(text), 7)):
+                    sent_dict[i] = {'content': sent, 'parsed':
+                                    parsed_content}
+
+                meta_content = {'date': story.attrib['date']}
+                content_dict = {'sents': sent_dict, 'meta': meta_content}
+
+            # clearing the entry leaves an empty element behind in its
+            # parent, whether the root or a wrapper below it, so the entries
+            # read so far are dropped from that parent
+            elem.clear()
+            if parents:
+                if hasattr(elem, 'getprevious'):    # lxml
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
                 else:
-                    holding[entry_id]['sents'][sent_id] = sent_dict
+                    del parents[-1][:]
 
-                elem.clear()
+            yield entry_id, content_dict
 
-    return holding
+
+class _FileReader(threading.Thread):
+    """
+    Thread that reads the entries of an XML input file into a queue of at
+    most size entries, from which they are taken by iterating over the
+    reader. An error in reading the file is raised by the iteration.
+    """
+
+    def __init__(self, path, parsed, size, stop):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.parsed = parsed
+        self.stop = stop
+        self.queue = Queue.Queue(max(1, size))
+
+    def run(self):
+        try:
+            for entry in _iter_xml_file(self.path, self.parsed):
+                if not self._put((entry, None)):
+                    return
+            self._put((None, None))
+        except Exception:
+            self._put((None, sys.exc_info()))
+
+    def _put(self, item):
+        # waits for room in the queue unless the reading is abandoned
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        while True:
+            entry, error = self.queue.get()
+            if error is not None:
+                raise error[0], error[1], error[2]
+            if entry is None:
+                return
+            yield entry
+
+
+def _read_xml_files(filepaths, parsed=False, readers=1, size=256):
+    # (path, entries of the file) in the order of filepaths; with more than
+    # one reader, that many files are read ahead in threads while the
+    # entries of the first of them are taken
+    if readers <= 1:
+        for path in filepaths:
+            yield path, _iter_xml_file(path, parsed)
+        return
+
+    stop = threading.Event()
+    paths = iter(filepaths)
+    pending = collections.deque()
+    try:
+        while True:
+            for path in itertools.islice(paths, readers - len(pending)):
+                reader = _FileReader(path, parsed, size, stop)
+                reader.start()
+                pending.append(reader)
+            if not pending:
+                return
+            reader = pending.popleft()
+            yield reader.path, reader
+    finally:
+        # the caller stopped early: the readers still running give up
+        stop.set()
+
+
+def iter_xml_input(filepaths, parsed=False, journal=None, readers=1,
+                   queue_size=256):
+    """
+    Reads input in the PETRARCH XML-input format one story at a time. This is
+    the streaming counterpart of read_xml_input(): only the story being read is
+    held in memory. Consecutive sentence entries with the same StoryID are
+    collected into one story; a StoryID that appears again later in the input
+    is yielded again with just its new sentences.
+
+    The XML is parsed with lxml when it is installed, and with ElementTree
+    otherwise; the stories are the same either way.
+
+    Parameters
+    ----------
+
+    filepaths: List.
+                List of XML files to process.
+
+
+    parsed: Boolean.
+            Whether the input files contain parse trees as generated by
+            StanfordNLP.
+
+
+    journal: PETRwriter.EventJournal.
+             Input files and stories completed by an earlier run are
+             skipped, and the journal is told of each story yielded and of
+             each input file once all of its stories have been yielded.
+
+
+    readers: Integer.
+             Number of input files read at the same time, each in a thread
+             of its own, so that parsing the next files overlaps with coding
+             the stories already read. The stories are yielded in the same
+             order as with a single reader.
+
+
+    queue_size: Integer.
+                Most sentence entries each reader thread holds before they
+                are taken.
+
+    Yields
+    ------
+
+    (entry_id, content_dict): Tuple.
+                StoryID and the story-level dictionary, in the same format as
+                the entries of the read_xml_input() holding dictionary.
+    """
+    current_id = None
+    current = None
+    places = []  # (input file, number of the story in it) of current
+    finished = []  # input files read to the end, up to current
+    if journal is not None:
+        filepaths = [path for path in filepaths if not journal.file_done(path)]
+    for path, entries in _read_xml_files(filepaths, parsed, readers,
+                                         queue_size):
+        number = 0
+
+        for entry_id, content_dict in entries:
+            if entry_id == current_id:
+                current['sents'].update(content_dict['sents'])
+                if places[-1][0] != path:
+                    places.append((path, number))
+                    number += 1
+                continue
+            if current is not None:
+                if journal is None:
+                    yield current_id, current
+                elif not journal.story_done(places, current_id):
+                    journal.reading(places, current_id)
+                    for done in finished:
+                        journal.file_read(done)
+                    finished = []
+                    yield current_id, current
+            current_id, current = entry_id, content_dict
+            places = [(path, number)]
+            number += 1
+        finished.append(path)
+
+    if current is not None:
+        if journal is None:
+            yield current_id, current
+        elif not journal.story_done(places, current_id):
+            journal.reading(places, current_id)
+            for done in finished:
+                journal.file_read(done)
+            finished = []
+            yield current_id, current
+    if journal is not None:
+        for done in finished:
+            journal.file_read(done)
 
 
 def read_pipeline_input(pipeline_list):
@@ -2230,10 +2638,10 @@ def read_pipeline_input(pipeline_list):
             corefs = entry['corefs']
             meta_content.update({'corefs': corefs})
 
-        split_sents = _sentence_segmenter(entry['content'])
         # TODO Make the number of sents a setting
         sent_dict = {}
-        for i, sent in enumerate(split_sents[:7]):
+        for i, sent in enumerate(itertools.islice(
+                iter_sentences(entry['content']), 7)):
             if parsetrees:
                 try:
                     tree = utilities._format_parsed_str(parsetrees[i])
@@ -2249,20 +2657,49 @@ def read_pipeline_input(pipeline_list):
     return holding
 
 
-def _sentence_segmenter(paragr):
+# sentences shorter than this are left out: this is relatively high because we
+# are only looking for sentences that will have subject and object
+_MIN_SENTLENGTH = 100
+_MAX_SENTLENGTH = 512
+
+# sentence termination pattern used by iter_sentences()
+_SENTENCE_END = re.compile('[\.\?!]\s+[A-Z\"]')
+
+# source: LbjNerTagger1.11.release/Data/KnownLists/known_title.lst from
+# University of Illinois with editing
+_ABBREVIATIONS = frozenset(['mrs.', 'ms.', 'mr.', 'dr.', 'gov.', 'sr.', 'rev.', 'r.n.',
+                           'pres.', 'treas.', 'sect.', 'maj.', 'ph.d.', 'ed. psy.',
+                           'proc.', 'fr.', 'asst.', 'p.f.c.', 'prof.', 'admr.',
+                           'engr.', 'mgr.', 'supt.', 'admin.', 'assoc.', 'voc.',
+                           'hon.', 'm.d.', 'dpty.', 'sec.', 'capt.', 'c.e.o.',
+                           'c.f.o.', 'c.i.o.', 'c.o.o.', 'c.p.a.', 'c.n.a.', 'acct.',
+                           'llc.', 'inc.', 'dir.', 'esq.', 'lt.', 'd.d.', 'ed.',
+                           'revd.', 'psy.d.', 'v.p.', 'senr.', 'gen.', 'prov.',
+                           'cmdr.', 'sgt.', 'sen.', 'col.', 'lieut.', 'cpl.', 'pfc.',
+                           'k.p.h.', 'cent.', 'deg.', 'doz.', 'Fahr.', 'Cel.', 'F.',
+                           'C.', 'K.', 'ft.', 'fur.', 'gal.', 'gr.', 'in.', 'kg.',
+                           'km.', 'kw.', 'l.', 'lat.', 'lb.', 'lb per sq in.', 'long.',
+                           'mg.', 'mm.,, m.p.g.', 'm.p.h.', 'cc.', 'qr.', 'qt.', 'sq.',
+                           't.', 'vol.', 'w.', 'wt.'])
+
+
+def iter_sentences(paragr):
     """
-    Function to break a string 'paragraph' into a list of sentences based on
-    the following rules:
+    Breaks a string 'paragraph' into sentences based on the following rules:
 
     1. Look for terminal [.,?,!] followed by a space and [A-Z]
-    2. If ., check against abbreviation list ABBREV_LIST: Get the string
+    2. If ., check against the abbreviations in _ABBREVIATIONS: Get the string
     between the . and the previous blank, lower-case it, and see if it is in
-    the list. Also check for single-letter initials. If true, continue search
+    the set. Also check for single-letter initials. If true, continue search
     for terminal punctuation
     3. Extend selection to balance (...) and "...". Reapply termination rules
-    4. Add to sentlist if the length of the string is between MIN_SENTLENGTH
-    and MAX_SENTLENGTH
-    5. Returns sentlist
+    4. Yield the sentence if its length is between _MIN_SENTLENGTH and
+    _MAX_SENTLENGTH
+
+    The text is read once: the bracket and quote balances of the current
+    sentence are kept as the search moves forward, rather than counted again
+    from its start at every candidate terminator, so the time is linear in
+    the length of the paragraph.
 
     Parameters
     ----------
@@ -2270,73 +2707,59 @@ def _sentence_segmenter(paragr):
     paragr: String.
             Content that will be split into constituent sentences.
 
-    Returns
-    -------
-
-    sentlist: List.
-                List of sentences.
+    Yields
+    ------
 
+    sentence: String.
+              The sentences in order, each with its terminal punctuation and
+              the space after it.
     """
-    # this is relatively high because we are only looking for sentences that
-    # will have subject and object
-    MIN_SENTLENGTH = 100
-    MAX_SENTLENGTH = 512
-
-    # sentence termination pattern used in sentence_segmenter(paragr)
-    terpat = re.compile('[\.\?!]\s+[A-Z\"]')
-
-    # source: LbjNerTagger1.11.release/Data/KnownLists/known_title.lst from
-    # University of Illinois with editing
-    ABBREV_LIST = ['mrs.', 'ms.', 'mr.', 'dr.', 'gov.', 'sr.', 'rev.', 'r.n.',
-                   'pres.', 'treas.', 'sect.', 'maj.', 'ph.d.', 'ed. psy.',
-                   'proc.', 'fr.', 'asst.', 'p.f.c.', 'prof.', 'admr.',
-                   'engr.', 'mgr.', 'supt.', 'admin.', 'assoc.', 'voc.',
-                   'hon.', 'm.d.', 'dpty.', 'sec.', 'capt.', 'c.e.o.',
-                   'c.f.o.', 'c.i.o.', 'c.o.o.', 'c.p.a.', 'c.n.a.', 'acct.',
-                   'llc.', 'inc.', 'dir.', 'esq.', 'lt.', 'd.d.', 'ed.',
-                   'revd.', 'psy.d.', 'v.p.', 'senr.', 'gen.', 'prov.',
-                   'cmdr.', 'sgt.', 'sen.', 'col.', 'lieut.', 'cpl.', 'pfc.',
-                   'k.p.h.', 'cent.', 'deg.', 'doz.', 'Fahr.', 'Cel.', 'F.',
-                   'C.', 'K.', 'ft.', 'fur.', 'gal.', 'gr.', 'in.', 'kg.',
-                   'km.', 'kw.', 'l.', 'lat.', 'lb.', 'lb per sq in.', 'long.',
-                   'mg.', 'mm.,, m.p.g.', 'm.p.h.', 'cc.', 'qr.', 'qt.', 'sq.',
-                   't.', 'vol.', 'w.', 'wt.']
-
-    sentlist = []
-    # controls skipping over non-terminal conditions
-    searchstart = 0
-    terloc = terpat.search(paragr)
+    # a str searched for a unicode string is decoded whole first, so the
+    # characters searched for are of the type of paragr
+    if isinstance(paragr, bytes):
+        left, right, quote, space = b'(', b')', b'"', b' '
+    else:
+        left, right, quote, space = '(', ')', '"', ' '
+    start = 0       # start of the current sentence
+    scanned = 0     # the balances below cover paragr[start:scanned]
+    opened = closed = quotes = 0
+    terloc = _SENTENCE_END.search(paragr)
     while terloc:
-        isok = True
-        if paragr[terloc.start()] == '.':
-            if (paragr[terloc.start() - 1].isupper() and
-                    paragr[terloc.start() - 2] == ' '):
+        end = terloc.start()
+        opened += paragr.count(left, scanned, end)
+        closed += paragr.count(right, scanned, end)
+        quotes += paragr.count(quote, scanned, end)
+        scanned = end
+
+        isok = opened == closed and quotes % 2 == 0
+        if isok and paragr[end] == '.':
+            # a terminator at the very start of the text looks at its end,
+            # as the original slicing did
+            before = paragr[end - 1] if end - start >= 1 else paragr[-1]
+            before2 = paragr[end - 2] if end - start >= 2 else \
+                paragr[end - start - 2]
+            if before.isupper() and before2 == ' ':
                 isok = False      # single initials
-            else:
+            elif end - start >= 1:
                 # check abbreviations
-                loc = paragr.rfind(' ', 0, terloc.start() - 1)
-                if loc > 0:
-                    if paragr[
-                            loc + 1:terloc.start() + 1].lower() in ABBREV_LIST:
-                        isok = False
-        if paragr[:terloc.start()].count(
-                '(') != paragr[:terloc.start()].count(')'):
-            isok = False
-        if paragr[:terloc.start()].count('"') % 2 != 0:
-            isok = False
+                loc = paragr.rfind(space, start, end - 1)
+                if loc > start and \
+                        paragr[loc + 1:end + 1].lower() in _ABBREVIATIONS:
+                    isok = False
         if isok:
-            if (len(paragr[:terloc.start()]) > MIN_SENTLENGTH and
-                    len(paragr[:terloc.start()]) < MAX_SENTLENGTH):
-                sentlist.append(paragr[:terloc.start() + 2])
-            paragr = paragr[terloc.end() - 1:]
-            searchstart = 0
+            if _MIN_SENTLENGTH < end - start < _MAX_SENTLENGTH:
+                yield paragr[start:end + 2]
+            start = scanned = terloc.end() - 1
+            opened = closed = quotes = 0
+            terloc = _SENTENCE_END.search(paragr, start)
         else:
-            searchstart = terloc.start() + 2
+            terloc = _SENTENCE_END.search(paragr, end + 2)
 
-        terloc = terpat.search(paragr, searchstart)
+    # final sentence
+    if _MIN_SENTLENGTH < len(paragr) - start < _MAX_SENTLENGTH:
+        yield paragr[start:]
 
-    # add final sentence
-    if (len(paragr) > MIN_SENTLENGTH and len(paragr) < MAX_SENTLENGTH):
-        sentlist.append(paragr)
 
-    return sentlist
+def _sentence_segmenter(paragr):
+    """ The sentences of iter_sentences() as a list """
+    return list(iter_sentences(paragr))
@@ -0,0 +1,221 @@
+##	PETRserver.py [module]
+##
+# Long-running local coding server
+#
+# Reading the config and the dictionaries takes seconds, far longer than coding
+# a story, so a pipeline that calls petrarch2.run_pipeline() for every story
+# spends most of its time starting up. The server reads them once and then
+# codes the stories POSTed to it as JSON, in the format of run_pipeline().
+#
+# Requests that arrive together are coded together: a MicroBatcher thread
+# collects the waiting requests into one batch, up to a number of stories or
+# until a few milliseconds after the first of them arrived, and hands it to the
+# coding function, which can spread it over worker processes. The HTTP server
+# runs a thread per connection and these threads only wait for their batch, so
+# all of the coding happens in the batcher thread and its worker processes.
+#
+#   POST /code     body: a list of stories, or {"stories": [...]}
+#                  reply: the PETRwriter.pipe_output() dictionary
+#   GET  /metrics  reply: request counts, queue depth, request latency and
+#                  the coding statistics of utilities.coding_stats()
+#
+# This code is covered under the MIT license
+# ------------------------------------------------------------------------
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import time
+import Queue
+import logging
+import threading
+import SocketServer
+import BaseHTTPServer
+
+import utilities
+
+
+class MicroBatcher(object):
+    """
+    Collects the requests submitted from any number of threads into batches
+    that code_batch() codes in a single thread.
+
+    Parameters
+    ----------
+
+    code_batch: Function.
+                code_batch(holdings, counts) codes a list of requests, each a
+                holding dictionary of stories, and returns the list of their
+                results. The coding counts are added to counts.
+
+    batch_stories: Integer.
+                   Most stories in a batch; a larger request is a batch of its
+                   own.
+
+    batch_wait: Float.
+                Seconds that the first request of a batch waits for others.
+    """
+
+    def __init__(self, code_batch, batch_stories=64, batch_wait=0.01):
+        self.code_batch = code_batch
+        self.batch_stories = batch_stories
+        self.batch_wait = batch_wait
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._counts = {}           # coding counts of all of the batches
+        self._requests = {}         # request counts and latency histogram
+        self._max_depth = 0
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, holding):
+        """
+        Codes a holding dictionary of stories along with whatever else is
+        waiting and returns the result of code_batch() for it. Raises the
+        exception that coding the batch raised, if any.
+        """
+        start = time.time()
+        done = threading.Event()
+        slot = {}
+        self._queue.put((holding, done, slot))
+        with self._lock:
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+        done.wait()
+        with self._lock:
+            utilities.add_latency(self._requests, time.time() - start)
+            if 'error' in slot:
+                self._requests['errors'] = self._requests.get('errors', 0) + 1
+        if 'error' in slot:
+            raise slot['error']
+        return slot['result']
+
+    def _run(self):
+        logger = logging.getLogger('petr_log')
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.time() + self.batch_wait
+            while size < self.batch_stories:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=wait)
+                except Queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            counts = {}
+            try:
+                results = self.code_batch([item[0] for item in batch], counts)
+            except Exception as err:
+                logger.exception('Coding a batch of {} requests failed'.format(
+                    len(batch)))
+                results = None
+                error = err
+            with self._lock:
+                utilities.merge_counts(self._counts, counts)
+                utilities.merge_counts(self._requests,
+                                       {'requests': len(batch),
+                                        'stories': size, 'batches': 1})
+            for index, (_, done, slot) in enumerate(batch):
+                if results is None:
+                    slot['error'] = error
+                else:
+                    slot['result'] = results[index]
+                done.set()
+
+    def metrics(self):
+        """
+        Returns a JSON-serializable dictionary: the number of requests,
+        stories and batches coded, the mean number of stories per batch, the
+        number of requests waiting for a batch now and at most, the mean,
+        p50, p95 and p99 request latency in seconds (from submission to the
+        result, waiting included) and utilities.coding_stats() of the coding.
+        """
+        with self._lock:
+            requests = dict(self._requests)
+            histogram = dict(requests.get('latency', {}))
+            stats = utilities.coding_stats(self._counts)
+            max_depth = self._max_depth
+        answered = sum(histogram.values())
+        latency = {'mean': requests.get('latency_total', 0.0) / answered
+                   if answered else 0.0}
+        for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            latency[name] = utilities.latency_percentile(histogram, fraction)
+        batches = requests.get('batches', 0)
+        return {'requests': requests.get('requests', 0),
+                'stories': requests.get('stories', 0),
+                'batches': batches,
+                'errors': requests.get('errors', 0),
+                'batch_stories': (float(requests.get('stories', 0)) / batches
+                                  if batches else 0.0),
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': max_depth,
+                'latency': latency,
+                'coding': stats}
+
+
+class CodingRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Handles the /code and /metrics requests of a CodingServer """
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/code':
+            self._reply(404, {'error': 'unknown path ' + self.path})
+            return
+        try:
+            length = int(self.headers.getheader('content-length') or 0)
+            stories = json.loads(self.rfile.read(length).decode('utf-8'))
+            if isinstance(stories, dict):
+                stories = stories['stories']
+            if not isinstance(stories, list):
+                raise ValueError('expected a list of stories')
+            # a malformed story fails this request only, not its batch
+            holding = self.server.read_stories(stories)
+        except (ValueError, KeyError, TypeError) as err:
+            self._reply(400, {'error': 'bad request: {}: {}'.format(
+                type(err).__name__, err)})
+            return
+        try:
+            result = self.server.batcher.submit(holding)
+        except Exception as err:
+            self._reply(500, {'error': '{}: {}'.format(type(err).__name__,
+                                                       err)})
+            return
+        self._reply(200, result)
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self._reply(404, {'error': 'unknown path ' + self.path})
+            return
+        self._reply(200, self.server.batcher.metrics())
+
+    def _reply(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger('petr_log').info('{} {}'.format(
+            self.address_string(), format % args))
+
+
+class CodingServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    HTTP server with a thread per connection. read_stories() turns the
+    stories of a request into a holding dictionary, e.g.
+    PETRreader.read_pipeline_input(), which is coded through batcher.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, batcher, read_stories):
+        BaseHTTPServer.HTTPServer.__init__(self, address, CodingRequestHandler)
+        self.batcher = batcher
+        self.read_stories = read_stories
@@ -8,6 +8,7 @@ import PETRglobals
 import PETRreader
 import time
 import utilities
+import PETRcodes
 import types
 import logging
 
@@ -36,13 +37,21 @@ import logging
 # pas 16.04.22: print() statements commented-out with '# --' were used in
 # the debugging and can probably be removed
 
-class Phrase:
+class Phrase(object):
     """
     This is a general class for all Phrase instances, which make up the nodes in the syntactic tree.
     The three subtypes are below.
 
+    A sentence creates hundreds of these, so the attributes are declared in __slots__ rather than
+    kept in a per-instance __dict__. Results that are computed once per node are memoized with the
+    *_done flags, e.g. head_done for get_head().
+
     """
 
+    __slots__ = ('label', 'children', 'phrasetype', 'annotation', 'text', 'parent', 'meaning',
+                 'verbclass', 'date', 'index', 'head', 'head_phrase', 'color', 'sentence',
+                 'head_done', 'meaning_done')
+
     def __init__(self, label, date, sentence):
         """
         Initialization for Phrase classes.
@@ -73,6 +82,8 @@ class Phrase:
         self.head_phrase = None
         self.color = False
         self.sentence = sentence
+        self.head_done = False
+        self.meaning_done = False
 
     def get_meaning(self):
         """
@@ -232,9 +243,6 @@ class Phrase:
                     codes.add(code)
         return list(codes)
 
-    def return_head(self):
-        return self.head, self.head_phrase
-
     def get_head(self):
         """
         Method for finding the head of a phrase. The head of a phrase is the rightmost
@@ -253,7 +261,9 @@ class Phrase:
 
 
         """
-        self.get_head = self.return_head
+        if self.head_done:
+            return self.head, self.head_phrase
+        self.head_done = True
         try:
             if self.label == 'S':
                 self.head, self.head_phrase = map(
@@ -304,12 +314,11 @@ class NounPhrase(Phrase):
 
     """
 
+    __slots__ = ()
+
     def __init__(self, label, date, sentence):
         Phrase.__init__(self, label, date, sentence)
 
-    def return_meaning(self):
-        return self.meaning
-
     def get_text(self):
         """
         Noun-specific get text method
@@ -340,7 +349,9 @@ class NounPhrase(Phrase):
         Parameters
         -----------
         match: list
-               Dates and codes from the dictionary
+               Codes and their ordinal date intervals from the dictionary, as stored by
+               PETRreader.make_date_interval(). The first code whose interval contains
+               the sentence date is used.
 
         Returns
         -------
@@ -404,68 +415,78 @@ class NounPhrase(Phrase):
         """
 
         code = None
-        try:
+        curdate = self.date
+        for entry in match:
+            if not isinstance(entry, tuple):
+                break   # root phrase stored with PETRglobals.WriteActorRoot
+            interval = entry[1]
+            if interval is None:  # the dictionary dates could not be read
+                return ""
+            code = ""
+            if ((interval[0] is None or curdate >= interval[0]) and
+                    (interval[1] is None or curdate < interval[1])):
+                return entry[0]
 
-            for j in match:
-                dates = j[1]
-                date = []
-                code = ""
-                for d in dates:
-                    if d[0] in '<>':
-                        date.append(d[0] +
-                                    str(PETRreader.dstr_to_ordate(d[1:])))
-                    else:
-                        date.append(str(PETRreader.dstr_to_ordate(d)))
-                curdate = self.date
-                if not date:
-                    code = j[0]
-                elif len(date) == 1:
-                    if date[0][0] == '<':
-                        if curdate < int(date[0][1:]):
-                            code = j[0]
-                    else:
-                        if curdate >= int(date[0][1:]):
-                            code = j[0]
-                else:
-                    if curdate < int(date[1]):
-                        if curdate >= int(date[0]):
-                            code = j[0]
+        return code
 
-                if code:
-                    return code
-        except Exception as e:
-            # print(e)
-            return code
+    def match_dictionaries(self, words, start):
+        """
+        Matches the longest actor starting at words[start] or, if there is
+        none, the longest agent. Each dictionary is walked along the words by
+        their index, without copying them, and its '#' entries are read once
+        the walk is over, from the longest match back.
 
-        return code
+        Parameters
+        -----------
+        words: list
+               The words of the noun phrase
 
-    def get_meaning(self):
+        start: int
+               Index of the first word of the match
+
+        Returns
+        -------
+        match: tuple
+               (codes, matched text, number of words matched, roots), where
+               the root of an agent is ['~'], or None if nothing matches
+        """
+        # the nodes are nested dicts or PETRtrie.TrieNodes, so only get() is
+        # used: it costs one lookup in either storage
+        end = len(words)
+        for trie, is_agent in ((PETRglobals.ActorDict, False),
+                               (PETRglobals.AgentDict, True)):
+            nodes = [trie]      # the nodes along words[start:], by length
+            node = trie
+            index = start
+            while index < end and words[index] != '#':
+                node = node.get(words[index])
+                if node is None:
+                    break
+                nodes.append(node)
+                index += 1
 
-        def recurse(path, words, length, so_far=""):
-
-            # --            print('NPgm-rec-lev:',len(getouterframes(currentframe(1))))  # --
-
-            if words and words[0] in path:
-                match = recurse(
-                    path[
-                        words[0]], words[
-                        1:], length + 1, so_far + " " + words[0])
-                if match:
-                    return match
-            if '#' in path:
-                if isinstance(path["#"], list):
-                    code = self.check_date(path['#'])
-                    if not code is None:
-                        # --                         print('NPgm-rec-1:',code)  # --
-                        # --                         print('NPgm-rec-1.1:',path['#'][-1])
-                        # 16.04.25 this branch always resolves to an actor;
-                        # path['#'][-1] is the root string
-                        return [code], so_far, length, [path['#'][-1]]
+            while nodes:
+                entry = nodes.pop().get('#')
+                if entry is None:
+                    continue
+                length = len(nodes)
+                if isinstance(entry, list):
+                    code = self.check_date(entry)
+                    if code is None:
+                        continue
+                    # entry[-1] is the root string
+                    codes, root = [code], entry[-1]
                 else:
-                    # --                    print('NPgm-rec-2:',path['#'])
-                    # 16.04.25 this branch always resolves to an agent
-                    return [path['#']], so_far, length
-            return False
+                    codes, root = [entry], ['~']
+                text = ''.join(' ' + word
+                               for word in words[start:start + length])
+                return codes, text, length, [['~'] if is_agent else root]
+        return None
+
+    def get_meaning(self):
+
+        if self.meaning_done:
+            return self.meaning
 
         text_children = []
         PPcodes = []
@@ -540,11 +561,13 @@ class NounPhrase(Phrase):
                     level = level.parent
 
         # check whether there are codes in the noun Phrase
+        first_words = PETRglobals.FirstWords
         index = 0
         while index < len(text_children):
-            match = recurse(
-                PETRglobals.ActorDict, text_children[
-                    index:], 0)  # checking for actors
+            if text_children[index] not in first_words:
+                index += 1   # no actor or agent starts with this word
+                continue
+            match = self.match_dictionaries(text_children, index)
             if match:
                 # --                print('NPgm-m-1:',match)
                 codes += match[0]
@@ -553,19 +576,6 @@ class NounPhrase(Phrase):
                 matched_txt += [match[1]]
 # --                print('NPgm-1:',matched_txt)
                 continue
-
-            match = recurse(
-                PETRglobals.AgentDict, text_children[
-                    index:], 0)  # checking for agents
-            if match:
-                # --                print('NPgm-2.0:',roots)
-                codes += match[0]
-                roots += [['~']]
-                index += match[2]
-                matched_txt += [match[1]]
-                """print('NPgm-2:',matched_txt) # --
-                print('NPgm-2.1:',roots)"""
-                continue
             index += 1
 
         """print('NPgm-m-codes:',codes)
@@ -606,7 +616,7 @@ class NounPhrase(Phrase):
             print('NPgm-m-roots     :',roots)"""
 
         self.meaning = self.mix_codes(agentcodes, actorcodes)
-        self.get_meaning = self.return_meaning
+        self.meaning_done = True
         """print('NPgm-3:',self.meaning)
         print('NPgm-4:',matched_txt)"""
         if matched_txt:
@@ -638,6 +648,8 @@ class NounPhrase(Phrase):
 
 class PrepPhrase(Phrase):
 
+    __slots__ = ('prep',)
+
     def __init__(self, label, date, sentence):
         Phrase.__init__(self, label, date, sentence)
         self.meaning = ""
@@ -691,6 +703,9 @@ class VerbPhrase(Phrase):
 
     """
 
+    __slots__ = ('upper', 'lower', 'passive', 'code', 'valid', 'S', 'passive_done', 'S_done',
+                 'upper_done')
+
     def __init__(self, label, date, sentence):
         Phrase.__init__(self, label, date, sentence)
         self.meaning = ""    # "meaning" for the verb, i.e. the events coded by the vp
@@ -700,8 +715,11 @@ class VerbPhrase(Phrase):
         self.lower = ""      # contains the meaning of the subtree c-commanded by the verb
         self.passive = False
         self.code = 0
-        self.valid = self.is_valid()
         self.S = None
+        self.passive_done = False
+        self.S_done = False
+        self.upper_done = False
+        self.valid = self.is_valid()
 
     def is_valid(self):
         """
@@ -748,9 +766,6 @@ class VerbPhrase(Phrase):
             return m[0][0]
         return [m[0][1]]
 
-    def return_meaning(self):
-        return self.meaning
-
     def get_meaning(self):
         """
         This determines the event coding of the subtree rooted in this verb phrase.
@@ -793,8 +808,10 @@ class VerbPhrase(Phrase):
 
         """
 
+        if self.meaning_done:
+            return self.meaning
+        self.meaning_done = True
         time1 = time.time()
-        self.get_meaning = self.return_meaning
 
         c, passive, meta = self.get_code()
         """print('VP-gm-0:',self.get_text())
@@ -836,7 +853,7 @@ class VerbPhrase(Phrase):
                         returns.append(e2)
             elif event[1] == 'passive':
                 first = event[0]
-                third = utilities.combine_code(c, event[2])
+                third = PETRcodes.combine_code(c, event[2])
                 if up:
                     returns = []
                     for source in up:
@@ -850,7 +867,7 @@ class VerbPhrase(Phrase):
                 third = c
             else:
                 second = event[1]
-                third = utilities.combine_code(c, event[2])
+                third = PETRcodes.combine_code(c, event[2])
             e = (first, second, third)
             self.sentence.metadata[id(e)] = [event, c, meta, 2]
             return returns + [e]
@@ -940,12 +957,6 @@ class VerbPhrase(Phrase):
         self.meaning = maps
         return maps
 
-    def return_upper(self):
-        return self.upper
-
-    def return_passive(self):
-        return self.passive
-
     def check_passive(self):
         """
         Check if the verb is passive under these conditions:
@@ -962,7 +973,9 @@ class VerbPhrase(Phrase):
                       Whether or not it is passive
         """
 # --          print('cp-entry')
-        self.check_passive = self.return_passive
+        if self.passive_done:
+            return self.passive
+        self.passive_done = True
         if True:
             if self.children[0].label in ["VBD", "VBN"]:
                 level = self.parent
@@ -984,10 +997,6 @@ class VerbPhrase(Phrase):
         self.passive = False
         return False
 
-    def return_S(self):
-        # --          print('rS-entry')
-        return self.S
-
     def get_S(self):
         """
         Navigate up the tree following a VP path to find the closest s-level phrase.
@@ -1005,7 +1014,9 @@ class VerbPhrase(Phrase):
                Lowest non-TO S-level phrase object above the verb
         """
 # --          print('gS-entry')
-        self.get_S = self.return_S
+        if self.S_done:
+            return self.S
+        self.S_done = True
         not_found = True
         level = self
         while not_found and not level.parent is None:
@@ -1034,7 +1045,9 @@ class VerbPhrase(Phrase):
         self.upper: List
                     Actor codes of spec-VP
         """
-        self.get_upper = self.return_upper
+        if self.upper_done:
+            return self.upper
+        self.upper_done = True
         for child in self.parent.children:
             if isinstance(child, NounPhrase) and not child.get_meaning() == [
                     "~"]:
@@ -1190,7 +1203,7 @@ class VerbPhrase(Phrase):
 
                         self.verbclass = meaning if not meaning == "" else verb
                         if not code == '':
-                            active, passive = utilities.convert_code(code)
+                            active, passive = PETRcodes.convert_code(code)
                             self.code = active
                     except:
                         self.code = (0, 0, [])
@@ -1207,7 +1220,7 @@ class VerbPhrase(Phrase):
                         meaning = path['#']['#']['meaning']
                         self.verbclass = meaning if not meaning == "" else verb
                         if not code == '':
-                            active, passive = utilities.convert_code(code)
+                            active, passive = PETRcodes.convert_code(code)
                             self.code = active
                     except:
                         pass
@@ -1220,10 +1233,12 @@ class VerbPhrase(Phrase):
             # --              print('++3',match['line'])
             meta.append(match['line'])
 # --              print(match)
-            active, passive = utilities.convert_code(match['code'])
+            active, passive = PETRcodes.convert_code(match['code'])
             self.code = active
         if passive and not active:
-            self.check_passive = lambda: True
+            # an inherently passive verb: check_passive() is True from now on
+            self.passive_done = True
+            self.passive = True
             self.code = passive
         return self.code, passive, meta
 
@@ -1241,6 +1256,11 @@ class VerbPhrase(Phrase):
 
         Otherwise, return the event as-is.
 
+        Which transformation applies depends only on the codes of the event
+        and on which of its actors are present or the same, so the outcome of
+        the dictionary walk is kept in PETRglobals.VerbTransforms under that
+        signature and found with one lookup the next time.
+
         Parameters
         -----------
         e: tuple
@@ -1252,72 +1272,49 @@ class VerbPhrase(Phrase):
            List of modified events, since multiple events can come from one single event
         """
 
-        def recurse(pdict, event, a2v={}, v2a={}):
-            path = pdict
-            if isinstance(pdict, list):
-                line = pdict[1]
-                path = pdict[0]
-                verb = utilities.convert_code(path[2])[0] if not path[
-                    2] == "Q" else v2a["Q"]
-                if isinstance(v2a[path[1]], tuple):
-                    results = []
-                    for item in v2a[path[1]]:
-                        results.append((list(v2a[path[0]]), item, verb))
-                    return results, line
-                return [(list(v2a[path[0]]), v2a[path[1]], verb)], line
-
-            if isinstance(event, tuple):
-                actor = None if not event[0] else tuple(event[0])
-                masks = filter(lambda a: a in pdict, [event[2], event[2] - event[2] % 0x10,
-                                                      event[2] - event[2] % 0x100, event[2] - event[2] % 0x1000])
-                if masks:
-                    path = pdict[masks[0]]
-                elif -1 in pdict:
-                    v2a["Q"] = event[2]
-                    path = pdict[-1]
-                else:
-                    return False
-            else:
-                actor = event
-            if actor in a2v:
-                actor = a2v[actor]
-            if not actor:
-                actor = "_"
-            if actor in path:
-                return recurse(path[actor], event[1], a2v, v2a)
-            elif not actor == '_':
-                for var in sorted(path.keys())[::-1]:
-                    if var in v2a:
-                        continue
-                    if not var == '.':
-                        v2a[var] = actor
-                        a2v[actor] = var
-                    return recurse(path[var], event[1], a2v, v2a)
-            return False
-
-        try:
-            t = recurse(PETRglobals.VerbDict['transformations'], e)
-            if t:
-                return t
+        transforms = PETRglobals.VerbDict['transformations']
+        if not isinstance(e, tuple):
+            return [e]
+        code = e[2]
+        if (isinstance(code, (int, long)) and code not in transforms and
+                code - code % 0x10 not in transforms and
+                code - code % 0x100 not in transforms and
+                code - code % 0x1000 not in transforms and
+                -1 not in transforms):
+            found = None    # the usual case: no rule for this verb at all
+        else:
+            signature = _transform_signature(e)
+            if signature in PETRglobals.VerbTransforms:
+                found = PETRglobals.VerbTransforms[signature]
             else:
-
-                if e[0] and e[2] and isinstance(e[1], tuple) and e[1][
-                        0] and not e[1][2] / (16 ** 3):
-                    if isinstance(e[1][0], list):
-                        results = []
-                        for item in e[1][0]:
-                            event = (
-                                e[0], item, utilities.combine_code(
-                                    e[1][2], e[2]))
-                            results.append(event)
-                        return results
+                found = _walk_transform(transforms, signature, 0, {}, {})
+                PETRglobals.VerbTransforms[signature] = found
+
+        if found and found is not _KEEP_EVENT:
+            transform_counts['hits'] += 1
+            template, line = found
+            values = _transform_values(e)
+            source, target, verb = [_transform_value(token, values)
+                                    for token in template]
+            if isinstance(target, tuple):
+                return [(list(source), item, verb) for item in target], line
+            return [(list(source), target, verb)], line
+
+        transform_counts['misses'] += 1
+        if found is None and e[0] and e[2] and isinstance(e[1], tuple) and e[
+                1][0] and isinstance(e[1][2], (int, long)) and not e[1][2] / (16 ** 3):
+            if isinstance(e[1][0], list):
+                results = []
+                for item in e[1][0]:
                     event = (
-                        e[0], e[1][0], utilities.combine_code(
-                            e[2], e[1][2]))
-                    return [event]
-
-        except Exception as ex:
-            pass  # print(ex)
+                        e[0], item, PETRcodes.combine_code(
+                            e[1][2], e[2]))
+                    results.append(event)
+                return results
+            event = (
+                e[0], e[1][0], PETRcodes.combine_code(
+                    e[2], e[1][2]))
+            return [event]
         return [e]
 
     def match_pattern(self):
@@ -1335,136 +1332,342 @@ class VerbPhrase(Phrase):
         False if no match, dict of match if present.
 
         """
+        # The patterns of the verb's meaning are tried depth first and the
+        # first one whose end is reached wins, see _search_patterns()
         meaning = self.verbclass
-        code = self.code
-
-        def match_phrase(path, phrase):
-            # Having matched the head of the phrase, this matches the full noun
-            # phrase, if specified
-            if not phrase:
-                return False
-            for item in filter(lambda b: b.text in path, phrase.children):
-                subpath = path[item.text]
-                match = reroute(
-                    subpath, lambda a: match_phrase(
-                        a, item.head_phrase))
-                if match:
-                    item.color = True
-                    return match
-            return reroute(path, lambda a: match_phrase(a, phrase.head_phrase))
-
-        def match_noun(path, phrase=self if not self.check_passive()
-                       else self.get_S(), preplimit=0):
+        passive = self.check_passive()
+        default_noun = self if not passive else self.get_S()
+
+        automaton = PETRglobals.VerbPatterns
+        if meaning not in automaton[0]:
+            return False
+        if passive:
+            first = (_MATCH_AGENT, automaton[0][meaning], self, None, None)
+        else:
+            first = (_MATCH_NOUN, automaton[0][meaning], self.get_S(), None,
+                     None)
+        return _search_patterns(automaton, first, (_MATCH_NOUN, default_noun),
+                                (_MATCH_PREP, self))
+
+
+# Events that a transformation of the verb dictionary was applied to, and
+# events checked without one applying, see match_transform()
+transform_counts = {'hits': 0, 'misses': 0}
+
+_KEEP_EVENT = 'keep'    # the event is returned as it is
+_TARGET_TOKEN = ('target',)
+_FIRST_SOURCE = ('source', 0)
+_ACTOR_TARGET = ('actor', 'actor', _TARGET_TOKEN, None)
+
+
+def _code_masks(code):
+    # the code with its last one, two and three digits zeroed, in the order
+    # the transformations are looked up
+    return (code, code - code % 0x10, code - code % 0x100,
+            code - code % 0x1000)
+
+
+def _transform_signature(event):
+    """
+    Reduces an event to what decides which transformation applies to it, so
+    the outcome of the dictionary walk can be looked up in
+    PETRglobals.VerbTransforms.
+
+    The signature is ('event', code, source, following) for each level of
+    nesting, down to ('actor', kind, target, char) for the innermost target. A
+    source is ('source', n), the nth distinct source actor, or None, and
+    codes that are not integers are None. kind tells how the target takes part
+    in the walk, and char is the second character of a target that the walk
+    can continue with if it could be a variable name, or None.
+    """
+    target = event[1]
+    if (isinstance(target, basestring) and len(target) > 1 and
+            (target[1].isupper() or target[1].isdigit())):
+        # the usual event: the source and an actor code as the target
+        code = event[2]
+        return ('event', code if isinstance(code, (int, long)) else None,
+                _FIRST_SOURCE if event[0] else None, _ACTOR_TARGET)
+
+    sources = []
+    levels = []
+    while isinstance(event, tuple):
+        source = event[0]
+        if source:
+            source = tuple(source)
+            if source not in sources:
+                sources.append(source)
+            source = ('source', sources.index(source))
+        else:
+            source = None
+        code = event[2]
+        levels.append((code if isinstance(code, (int, long)) else None,
+                       source))
+        event = event[1]
+
+    # the innermost target is a token, except where its value can equal a
+    # variable name of the rules: then the value itself is used
+    following = None
+    if isinstance(event, list):
+        kind = 'list'       # can not be looked up
+        target = None
+    elif not event:
+        kind = 'empty'      # matched as '_'
+        target = None
+    elif isinstance(event, basestring) and len(event) > 1:
+        kind = 'actor'
+        target = _TARGET_TOKEN
+        if not (event[1].isupper() or event[1].isdigit()):
+            following = event[1]
+    else:
+        kind = 'short'      # has no second character to continue with
+        target = event if isinstance(event, basestring) else _TARGET_TOKEN
+    signature = ('actor', kind, target, following)
+    for code, source in reversed(levels):
+        signature = ('event', code, source, signature)
+    return signature
+
+
+def _transform_values(event):
+    # the (sources, codes, target) that the ('source', n), ('code', level)
+    # and ('target',) tokens of a _transform_signature() stand for
+    sources = []
+    codes = []
+    while isinstance(event, tuple):
+        if event[0] and tuple(event[0]) not in sources:
+            sources.append(tuple(event[0]))
+        codes.append(event[2])
+        event = event[1]
+    return sources, codes, event
+
+
+def _walk_transform(path, event, level, a2v, v2a):
+    # Walks VerbDict['transformations'] for an event signature. The actors
+    # are bound to the variables of the rules, a2v mapping an actor to its
+    # variable and v2a the other way, as the walk goes down. Returns the
+    # (template, line) of the matching rule, where template holds the tokens
+    # (or variable names and verb code) of the source, target and code of the
+    # new event, None if no rule applies, or _KEEP_EVENT if the event is left
+    # as it is.
+    if isinstance(path, list):
+        answer, line = path
+        if answer[2] == "Q":
+            if "Q" not in v2a:
+                return _KEEP_EVENT
+            verb = v2a["Q"]
+        else:
+            verb = PETRcodes.convert_code(answer[2])[0]
+        if answer[0] not in v2a or answer[1] not in v2a:
+            return _KEEP_EVENT
+        return (v2a[answer[0]], v2a[answer[1]], verb), line
+
+    if event[0] == 'event':
+        code, actor, following = event[1:]
+        if code is None:
+            return _KEEP_EVENT
+        masks = [mask for mask in _code_masks(code) if mask in path]
+        if masks:
+            path = path[masks[0]]
+        elif -1 in path:
+            v2a["Q"] = ('code', level)
+            path = path[-1]
+        else:
+            return None
+    else:
+        kind, actor, char = event[1:]
+        if kind == 'list':
+            return _KEEP_EVENT
+        following = None
+        if kind == 'actor':
+            following = ('actor', 'short', char or ('char', actor), None)
+
+    if actor in a2v:
+        actor = a2v[actor]
+    if not actor:
+        actor = '_'
+    if actor not in path:
+        if actor == '_':
+            return None
+        for var in sorted(path.keys())[::-1]:
+            if var in v2a:
+                continue
+            if not var == '.':
+                v2a[var] = actor
+                a2v[actor] = var
+            actor = var
+            break
+        else:
+            return None
+    if following is None:
+        return _KEEP_EVENT
+    return _walk_transform(path[actor], following, level + 1, a2v, v2a)
+
+
+def _transform_value(token, values):
+    # the actor or code a token of _walk_transform() stands for
+    if not isinstance(token, tuple):
+        return token
+    if token[0] == 'source':
+        return values[0][token[1]]
+    if token[0] == 'code':
+        return values[1][token[1]]
+    if token[0] == 'target':
+        return values[2]
+    return _transform_value(token[1], values)[1]     # 'char'
+
+
+# Kinds of pattern matching task, see _search_patterns()
+_PATTERN_END = 0
+_MATCH_HEAD_PHRASE = 1  # the rest of the head phrase of a phrase
+_MATCH_NOUN = 2         # a noun phrase below the phrase, or the phrase itself
+_MATCH_AGENT = 3        # the object of a BY or FROM in a passive phrase
+_MATCH_HEAD = 4         # the head of one noun phrase found by _MATCH_NOUN
+_MATCH_CARET = 5        # a '^' pattern: the rest of the phrase itself
+_MATCH_PREP = 6         # a prepositional phrase below the phrase
+_MATCH_PREP_ITEM = 7    # one prepositional phrase found by _MATCH_PREP
+
+
+def _reroute(tasks, controls, end, follow, color, parent):
+    # Adds the ways to continue from a state to tasks, in the order they are
+    # tried: follow holds the (kind, phrase) to continue with after each of
+    # '-', ',', '|' and '*', or False to not take that transition, and end is
+    # the pattern ending at the state, if it may end there.
+    for slot, state in controls:
+        if follow[slot]:
+            tasks.append((follow[slot][0], state, follow[slot][1], color,
+                          parent))
+    if end is not None:
+        tasks.append((_PATTERN_END, end, None, color, parent))
+
+
+def _search_patterns(automaton, first, match_noun, match_prep):
+    """
+    Depth-first search of the pattern states of a verb for the first pattern
+    that the tree matches, without recursion.
+
+    Parameters
+    ----------
+
+    automaton: Tuple.
+               PETRglobals.VerbPatterns, from utilities.build_verb_automaton().
+
+    first: Tuple.
+           The task to start from. A task is (kind, state, phrase, color,
+           parent): match phrase against the transitions out of state, color
+           being the phrase to color if the search succeeds through this task
+           -- a Phrase, or (phrase,) for its last child -- and parent the task
+           that added it.
+
+    match_noun, match_prep: Tuples.
+                            (kind, phrase) of the default noun and
+                            preposition matches that patterns continue with.
+
+    Returns
+    -------
+
+    The '#' entry of the matched pattern, or False. The phrases the matched
+    pattern went through are colored.
+    """
+    roots, goto, control, caret, result = automaton
+    stack = [first]
+    while stack:
+        task = stack.pop()
+        kind, state, phrase = task[:3]
+        if kind == _PATTERN_END:
+            while task:
+                color = task[3]
+                if isinstance(color, tuple):
+                    color[0].children[-1].color = True
+                elif color is not None:
+                    color.color = True
+                task = task[4]
+            return state
+
+        tasks = []
+        if kind == _MATCH_NOUN or kind == _MATCH_AGENT:
             # Matches a noun or head of noun phrase
-            # --              print('mn-entry')
-            noun_phrases = []
-            if not phrase:
-                return False
-            if preplimit:
-                for sib in phrase.children:
-                    if isinstance(sib, PrepPhrase) and len(
-                            sib.children) > 1 and sib.get_prep() in ["BY", "FROM"]:
-                        noun_phrases.append(sib.children[1])
-            else:
-                for child in phrase.children:
-                    if child.label in ("NP", "ADVP"):
-                        noun_phrases.append(child)
+            if phrase:
+                words = goto[state]
+                if kind == _MATCH_AGENT:
+                    items = [sib.children[1] for sib in phrase.children
+                             if isinstance(sib, PrepPhrase) and len(sib.children) > 1 and
+                             sib.get_prep() in ["BY", "FROM"]]
+                else:
+                    items = [child for child in phrase.children
+                             if child.label in ("NP", "ADVP")]
+                    if isinstance(phrase, NounPhrase):
+                        items.append(phrase)
+                for item in items:
+                    # heads are found lazily, as finding one sets the
+                    # head_phrase that other patterns look at, but the phrases
+                    # whose head is known and not in the patterns are skipped
+                    if not item.head_done or (item.head and item.head in words):
+                        tasks.append((_MATCH_HEAD, state, item, None, task))
+                if state in caret:
+                    tasks.append((_MATCH_CARET, caret[state], phrase, None,
+                                  task))
+                else:
+                    _reroute(tasks, control[state], result[state],
+                             ((_MATCH_HEAD_PHRASE, phrase), match_noun,
+                              match_prep, match_noun), None, task)
+
+        elif kind == _MATCH_HEAD:
+            head, headphrase = phrase.get_head()
+            words = goto[state]
+            if head and head in words:
+                substate = words[head]
+                # First check within the NP for PP's, then the other siblings
+                _reroute(tasks, control[substate], None,
+                         (False, False, (_MATCH_PREP, phrase), False),
+                         (headphrase,), task)
                 if isinstance(phrase, NounPhrase):
-                    noun_phrases.append(phrase)
-
-            for item in noun_phrases:
-                head, headphrase = item.get_head()
-
-                if head and head in path:
-                    subpath = path[head]
-
-                    # First check within the NP for PP's
-                    skip = lambda a: False
-                    match = reroute(
-                        subpath, skip, skip, lambda a: match_prep(
-                            a, item), skip, 0)
-                    if match:
-                        headphrase.children[-1].color = True
-                        return match
-
-                    # Then check the other siblings
-                    match = reroute(subpath, (lambda a: match_phrase(a, item.head_phrase))
-                                    if isinstance(item, NounPhrase) else None)  # pas 16.04.21: Trapped None by having reroute return False
-                    if match:
-                        headphrase.children[-1].color = True
-                        return match
-            if '^' in path:
-                phrase.color = True
-# --                  print('mn-reroute1')
-                return reroute(path['^'], lambda a: match_phrase(
-                    a, phrase.head_phrase))
-# --              print('mn-reroute2')
-            return reroute(path, lambda a: match_phrase(a, phrase.head_phrase))
-
-        def match_prep(path, phrase=self):
-            # Matches preposition
-            # --              print('mp-entry')
-            for item in filter(lambda b: isinstance(
-                    b, PrepPhrase), phrase.children):
-                prep = item.children[0].text
-                if prep in path:
-                    subpath = path[prep]
-# --                      print('mp-reroute1')
-                    match = reroute(subpath,
-                                    lambda a: match_noun(
-                                        a, item.children[1])if len(
-                                        item.children) > 1 else False,
-                                    match_prep)
-                    if match:
-                        # --                        print('mp-False')
-                        return match
-# --              print('mp-reroute2')
-            return reroute(path, o2=match_prep)
-
-        def reroute(subpath, o1=match_noun, o2=match_noun,
-                    o3=match_prep, o4=match_noun, exit=1):
-            # --                  print('rr-entry:') # ,subpath
-            if not o1:  # match_noun() can call reroute() with o1 == None; guessing returning False is the appropriate response pas 16.04.21
-                return False
-            if '-' in subpath:
-                match = o1(subpath['-'])
-                if match:
-                    # --                          print('rr-- match')
-                    return match
-
-            if ',' in subpath:
-                # --                      print('rr-,')
-                match = o2(subpath[','])
-                if match:
-                    return match
-
-            if '|' in subpath:
-                # --                      print('rr-|')
-                match = o3(subpath['|'])
-                if match:
-                    return match
-
-            if '*' in subpath:
-                # --                      print('rr-*')
-                match = o4(subpath['*'])
-                if match:
-                    return match
-
-            if '#' in subpath and exit:
-                # --                      print('rr-#')
-                return subpath['#']
-
-# --                  print('rr-False')
-            return False
+                    _reroute(tasks, control[substate], result[substate],
+                             ((_MATCH_HEAD_PHRASE, phrase), match_noun,
+                              match_prep, match_noun), (headphrase,), task)
 
-        # Match pattern
-        if meaning in PETRglobals.VerbDict['phrases']:
-            path = PETRglobals.VerbDict['phrases'][meaning]
-            if self.check_passive():
-                return match_noun(path, self, 1)
-            else:
-                return match_noun(path, self.get_S())
-        return False
+        elif kind == _MATCH_PREP:
+            # Matches preposition
+            for item in phrase.children:
+                if isinstance(item, PrepPhrase):
+                    tasks.append((_MATCH_PREP_ITEM, state, item, None, task))
+            _reroute(tasks, control[state], result[state],
+                     (match_noun, match_prep, match_prep, match_noun), None,
+                     task)
+
+        elif kind == _MATCH_PREP_ITEM:
+            prep = phrase.children[0].text
+            words = goto[state]
+            if prep in words:
+                substate = words[prep]
+                _reroute(tasks, control[substate], result[substate],
+                         ((_MATCH_NOUN, phrase.children[1])
+                          if len(phrase.children) > 1 else False,
+                          match_prep, match_prep, match_noun), None, task)
+
+        elif kind == _MATCH_HEAD_PHRASE:
+            # Having matched the head of the phrase, this matches the full
+            # noun phrase, if specified
+            phrase = phrase.head_phrase
+            if phrase:
+                words = goto[state]
+                for item in [b for b in phrase.children if b.text in words]:
+                    substate = words[item.text]
+                    _reroute(tasks, control[substate], result[substate],
+                             ((_MATCH_HEAD_PHRASE, item), match_noun,
+                              match_prep, match_noun), item, task)
+                _reroute(tasks, control[state], result[state],
+                         ((_MATCH_HEAD_PHRASE, phrase), match_noun,
+                          match_prep, match_noun), None, task)
+
+        elif kind == _MATCH_CARET:
+            phrase.color = True
+            _reroute(tasks, control[state], result[state],
+                     ((_MATCH_HEAD_PHRASE, phrase), match_noun, match_prep,
+                      match_noun), None, task)
+
+        if tasks:
+            tasks.reverse()
+            stack.extend(tasks)
+    return False
 
 
 class Sentence:
@@ -1523,7 +1726,6 @@ class Sentence:
     """
 
     def __init__(self, parse, text, date):
-        self.treestr = parse.replace(')', ' )')
         self.parse = parse
         self.agent = ""
         self.ID = -1
@@ -1535,6 +1737,7 @@ class Sentence:
         self.tree = self.str_to_tree(parse.strip())
         self.verb_analysis = {}
         self.events = []
+        self.events_done = False
         self.metadata = {'nouns': []}
         if PETRglobals.NullVerbs or PETRglobals.NullActors:
             #            self.metadata['nulls'] = [] # is this still needed?
@@ -1549,7 +1752,7 @@ class Sentence:
         Parameters
         -----------
         str: string
-             Pre-processed CoreNLP parse, needs to be formated by utilities.format_parsed_str
+             Pre-processed CoreNLP parse, needs to be formated by utilities._format_parsed_str
              before being passed.
 
         Returns
@@ -1557,38 +1760,44 @@ class Sentence:
         root: Phrase object
               Top level of the tree that represents the sentence
         """
-        segs = str.split()
-        root = Phrase(segs[0][1:], self.date, self)
+        tokens = utilities.tokenize_parse(str)
+        date = self.date
+        root = Phrase(tokens[0][1:], date, self)
         level_stack = [root]
         existentials = []
+        words = []
 
-        for element in segs[1:]:
-            if element.startswith("("):
+        for element in tokens[1:]:
+            if element == ")":
+                try:
+                    level_stack.pop()
+                except IndexError:
+                    break
+            elif element[0] == "(":
                 lab = element[1:]
                 if lab == "NP":
-                    new = NounPhrase(lab, self.date, self)
+                    new = NounPhrase(lab, date, self)
                 elif lab == "VP":
-                    new = VerbPhrase(lab, self.date, self)
+                    new = VerbPhrase(lab, date, self)
                     self.verbs.append(new)
                 elif lab == "PP":
-                    new = PrepPhrase(lab, self.date, self)
+                    new = PrepPhrase(lab, date, self)
                 else:
-                    new = Phrase(lab, self.date, self)
+                    new = Phrase(lab, date, self)
                     if lab == "EX":
                         existentials.append(new)
 
-                new.parent = level_stack[-1]
-                new.index = len(level_stack[-1].children)
-                level_stack[-1].children.append(new)
+                parent = level_stack[-1]
+                new.parent = parent
+                new.index = len(parent.children)
+                parent.children.append(new)
                 level_stack.append(new)
-            elif element.endswith(")"):
-                try:
-                    level_stack.pop()
-                except:
-                    break
             else:
                 level_stack[-1].text = element
-                self.txt += " " + element
+                words.append(element)
+
+        if words:
+            self.txt += " " + " ".join(words)
 
         for element in existentials:
             try:
@@ -1619,9 +1828,6 @@ class Sentence:
             next = store[0]
         return map(lambda a: a[-2] if len(a) > 1 else a[0], meta_total[::-1])
 
-    def return_events(self):
-        return self.events
-
     def get_events(self, require_dyad=1):
         """
         Take the coding of the highest verb phrase and return that, given:
@@ -1642,6 +1848,9 @@ class Sentence:
 
         """
 
+        if self.events_done:
+            return self.events
+
         """for ch in self.verbs:
             print('==',ch.label, ch.get_text())
         for ch in self.tree.children:
@@ -1672,7 +1881,7 @@ class Sentence:
                     if isinstance(event, tuple) and isinstance(
                             event[1], basestring):
 
-                        code = utilities.convert_code(event[2], 0)
+                        code = PETRcodes.convert_code(event[2], 0)
                         print('checking event', event, hex(event[2]))
                         if event[0] and event[1] and code:
                             for source in event[0]:
@@ -1717,7 +1926,7 @@ class Sentence:
                                         # aren't going into 'meta'
 
             self.events = list(set(valid))
-            self.get_events = self.return_events
+            self.events_done = True
 #--            print('GF3',valid,'\nGF4',meta) # --
             return valid, meta
         except Exception as e:  # 16.06.27 pas: need to log this, and also figure out where it comes from
@@ -0,0 +1,322 @@
+##	PETRtrie.py [module]
+##
+# Read-only, memory-mapped storage for the actor and agent dictionaries
+#
+# The nested-dict tries in PETRglobals.ActorDict and PETRglobals.AgentDict are
+# flattened into a single file that every coding process maps with mmap. The
+# operating system keeps one copy of the file in the page cache however many
+# processes are coding, instead of each process building its own dicts.
+#
+# File layout (all integers are little-endian uint32):
+#
+#   header        magic, version, fingerprint and the section offsets below
+#   word index    (start, end) byte offsets of each word in the word blob
+#   word slots    open-addressed hash table: word id + 1, or 0 for empty
+#   edge slots    open-addressed hash table of (parent + 1, word id, child)
+#   payload index (start, end) byte offsets of each node's '#' entry
+#   blobs         the UTF-8 words, then the marshalled '#' entries
+#
+# Node 0 is the root of the actor trie and node 1 is the root of the agent
+# trie. A mapped node supports the 'in', [] and get() operations that
+# NounPhrase.get_meaning() uses on the nested dicts, so the lookup code is
+# the same for either storage.
+#
+# This code is covered under the MIT license
+# ------------------------------------------------------------------------
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import sys
+import mmap
+import zlib
+import struct
+import marshal
+import logging
+from array import array
+
+TrieVersion = 1
+
+_MAGIC = b'PETRTRIE'
+_HEADER = struct.Struct(str('<8sI40s11I'))
+_PAIR = struct.Struct(str('<II'))
+_SLOT = struct.Struct(str('<I'))
+_EDGE = struct.Struct(str('<III'))
+
+
+
+def _table_size(count):
+    """ Power-of-two hash table size that keeps the load factor under 1/2 """
+    size = 8
+    while size < 2 * count:
+        size *= 2
+    return size
+
+
+def _word_hash(word_bytes):
+    return zlib.crc32(word_bytes) & 0xffffffff
+
+
+def _edge_hash(node, word_id):
+    # node and word ids are small consecutive integers: mix the bits so that
+    # the low bits used as the slot number do not cluster
+    key = (node * 0x9e3779b1 ^ word_id * 0x85ebca77) & 0xffffffff
+    key ^= key >> 15
+    key = (key * 0x2c1b3c6d) & 0xffffffff
+    return key ^ (key >> 12)
+
+
+def _as_bytes(uints):
+    values = array(str('I'), uints)
+    if values.itemsize != 4:
+        values = array(str('L'), uints)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tostring()
+
+
+def write_trie(trie_path, roots, fingerprint):
+    """
+    Flattens nested-dict tries into a mapped trie file.
+
+    Parameters
+    ----------
+
+    trie_path: String.
+               File to write. It is written to a temporary name and then
+               moved into place, so processes never map a partial file.
+
+    roots: List.
+           The nested dicts to store, e.g. [ActorDict, AgentDict]; root i is
+           node i of the file.
+
+    fingerprint: String.
+                 Hex digest of the source dictionaries, checked by open_trie().
+    """
+    logger = logging.getLogger('petr_log')
+
+    # number the nodes breadth-first so that the roots come first
+    words = {}
+    edges = []
+    payloads = []
+    queue = list(roots)
+    node = 0
+    while node < len(queue):
+        branch = queue[node]
+        payloads.append(branch.get('#'))
+        for word in sorted(key for key in branch if key != '#'):
+            if word not in words:
+                words[word] = len(words)
+            edges.append((node, words[word], len(queue)))
+            queue.append(branch[word])
+        node += 1
+
+    vocab = [word.encode('utf-8') for word in sorted(words, key=words.get)]
+    word_index = []
+    offset = 0
+    for data in vocab:
+        word_index.extend((offset, offset + len(data)))
+        offset += len(data)
+    word_blob = b''.join(vocab)
+
+    word_mask = _table_size(len(vocab)) - 1
+    word_slots = [0] * (word_mask + 1)
+    for word_id, data in enumerate(vocab):
+        slot = _word_hash(data) & word_mask
+        while word_slots[slot]:
+            slot = (slot + 1) & word_mask
+        word_slots[slot] = word_id + 1
+
+    edge_mask = _table_size(len(edges)) - 1
+    edge_slots = [0] * (3 * (edge_mask + 1))
+    for parent, word_id, child in edges:
+        slot = _edge_hash(parent, word_id) & edge_mask
+        while edge_slots[3 * slot]:
+            slot = (slot + 1) & edge_mask
+        edge_slots[3 * slot:3 * slot + 3] = [parent + 1, word_id, child]
+
+    payload_blob = []
+    payload_index = []
+    offset = len(word_blob)
+    for entry in payloads:
+        if entry is None:
+            payload_index.extend((0, 0))
+            continue
+        data = marshal.dumps(entry, 2)
+        payload_blob.append(data)
+        payload_index.extend((offset, offset + len(data)))
+        offset += len(data)
+
+    sections = [_as_bytes(word_index), _as_bytes(word_slots),
+                _as_bytes(edge_slots), _as_bytes(payload_index)]
+    offsets = []
+    offset = _HEADER.size
+    for section in sections:
+        offsets.append(offset)
+        offset += len(section)
+    blob_offset = offset
+
+    # the blob offsets in the indexes are relative to the start of the blobs
+    header = _HEADER.pack(_MAGIC, TrieVersion, fingerprint.encode('ascii'),
+                          len(roots), len(vocab), word_mask, len(queue),
+                          edge_mask, offsets[0], offsets[1], offsets[2],
+                          offsets[3], blob_offset, 0)
+
+    temp_path = '{}.{}.tmp'.format(trie_path, os.getpid())
+    with open(temp_path, 'wb') as fout:
+        fout.write(header)
+        for section in sections:
+            fout.write(section)
+        fout.write(word_blob)
+        for data in payload_blob:
+            fout.write(data)
+    if os.path.exists(trie_path) and sys.platform.startswith('win'):
+        os.remove(trie_path)
+    os.rename(temp_path, trie_path)
+    logger.info('Wrote mapped dictionary trie ' + trie_path)
+
+
+def open_trie(trie_path, fingerprint):
+    """
+    Maps trie_path if it exists and was built from dictionaries with the
+    given fingerprint. Returns a MappedTrie, or None if the caller needs to
+    use the in-memory dictionaries.
+    """
+    logger = logging.getLogger('petr_log')
+    if not os.path.exists(trie_path):
+        return None
+    try:
+        trie = MappedTrie(trie_path)
+    except (IOError, ValueError, struct.error) as err:
+        logger.warning('Unreadable dictionary trie {}: {}'.format(trie_path,
+                                                                  err))
+        return None
+    if trie.fingerprint != fingerprint:
+        logger.info('Dictionary trie {} is stale'.format(trie_path))
+        trie.close()
+        return None
+    return trie
+
+
+class MappedTrie(object):
+    """
+    A trie file mapped read-only into memory. root(i) returns the TrieNode for
+    the i-th dictionary passed to write_trie().
+    """
+
+    def __init__(self, trie_path):
+        with open(trie_path, 'rb') as fin:
+            self._map = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size:
+            self.close()
+            raise ValueError('file is too short')
+        (magic, version, fingerprint, self.root_count, self.word_count,
+         self._word_mask, self.node_count, self._edge_mask,
+         self._word_index, self._word_slots, self._edge_slots,
+         self._payload_index, self._blobs, _) = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC or version != TrieVersion:
+            self.close()
+            raise ValueError('not a version {} dictionary trie'.format(
+                TrieVersion))
+        self.fingerprint = fingerprint.rstrip(b'\0').decode('ascii')
+
+    def close(self):
+        self._map.close()
+
+    def root(self, index):
+        if not 0 <= index < self.root_count:
+            raise IndexError(index)
+        return TrieNode(self, index)
+
+    def word_id(self, word):
+        """ Id of word in the trie vocabulary, or None if it does not occur """
+        try:
+            data = word.encode('utf-8')
+        except AttributeError:
+            return None
+        mm = self._map
+        mask = self._word_mask
+        slot = _word_hash(data) & mask
+        while True:
+            entry = _SLOT.unpack_from(mm, self._word_slots + 4 * slot)[0]
+            if not entry:
+                return None
+            start, end = _PAIR.unpack_from(mm, self._word_index +
+                                           8 * (entry - 1))
+            if mm[self._blobs + start:self._blobs + end] == data:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def words(self):
+        """ Generates the words of the trie vocabulary, in id order """
+        mm = self._map
+        for word_id in range(self.word_count):
+            start, end = _PAIR.unpack_from(mm, self._word_index + 8 * word_id)
+            yield mm[self._blobs + start:self._blobs + end].decode('utf-8')
+
+    def child(self, node, word):
+        """ Node reached from node along word, or None """
+        word_id = self.word_id(word)
+        if word_id is None:
+            return None
+        mm = self._map
+        mask = self._edge_mask
+        slot = _edge_hash(node, word_id) & mask
+        while True:
+            parent, edge_word, child = _EDGE.unpack_from(
+                mm, self._edge_slots + 12 * slot)
+            if not parent:
+                return None
+            if parent == node + 1 and edge_word == word_id:
+                return child
+            slot = (slot + 1) & mask
+
+    def payload(self, node):
+        """ The '#' entry stored at node, or None """
+        start, end = _PAIR.unpack_from(self._map, self._payload_index +
+                                       8 * node)
+        if start == end:
+            return None
+        return marshal.loads(self._map[self._blobs + start:self._blobs + end])
+
+    def payloads(self):
+        """ Generates the '#' entries of all of the nodes """
+        for node in range(self.node_count):
+            entry = self.payload(node)
+            if entry is not None:
+                yield entry
+
+
+class TrieNode(object):
+    """
+    Dict-like view of one node of a MappedTrie: node[word] is the child node
+    and node['#'] is the code entry, exactly as in the nested dicts.
+    """
+
+    __slots__ = ('trie', 'node')
+
+    def __init__(self, trie, node):
+        self.trie = trie
+        self.node = node
+
+    def get(self, key, default=None):
+        if key == '#':
+            entry = self.trie.payload(self.node)
+            return default if entry is None else entry
+        child = self.trie.child(self.node, key)
+        return default if child is None else TrieNode(self.trie, child)
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        if key == '#':
+            start, end = _PAIR.unpack_from(self.trie._map,
+                                           self.trie._payload_index +
+                                           8 * self.node)
+            return start != end
+        return self.trie.child(self.node, key) is not None
@@ -28,8 +28,17 @@ from __future__ import unicode_literals
 
 import PETRglobals  # global variables
 import utilities
+import os
+import zlib
+import datetime
 import codecs
 import json
+from collections import deque, OrderedDict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 def get_actor_text(meta_strg):
@@ -50,101 +59,623 @@ def write_events(event_dict, output_file):
 
 
     output_file: String.
-                    Filepath to which events should be written.
+                    Filepath to which events should be written. Names ending
+                    in .gz or .zst are compressed; see EventWriter.
     """
-    global StorySource
-    global NEvents
-    global StoryIssues
+    if not output_file:
+        for key in event_dict:
+            format_story_events(key, event_dict[key])
+        return
+    with EventWriter(output_file) as writer:
+        for key in event_dict:
+            writer.write_story(key, event_dict[key])
 
-    event_output = []
-    for key in event_dict:
-        story_dict = event_dict[key]
-        if not story_dict['sents']:
-            continue    # skip cases eliminated by story-level discard
-#        print('WE1',story_dict)
-        story_output = []
-        filtered_events = utilities.story_filter(story_dict, key)
-#        print('WE2',filtered_events)
-        if 'source' in story_dict['meta']:
-            StorySource = story_dict['meta']['source']
+
+def write_events_stream(stories, output_file, journal=None):
+    """
+    Formats and writes the coded event data story by story, as the stories
+    arrive, in the same format as write_events(). The file is flushed every
+    PETRglobals.FlushStories stories, so events are available while the rest
+    of the input is still being coded.
+
+    Parameters
+    ----------
+
+    stories: Iterable.
+             (StoryID, story dictionary) pairs, e.g. from
+             petrarch2.code_story_stream().
+
+
+    output_file: String.
+                    Filepath to which events should be written. Names ending
+                    in .gz or .zst are compressed; see EventWriter.
+
+
+    journal: EventJournal.
+             Records the progress of the run so that it can be resumed. The
+             stories must have been read with the same journal. When it was
+             resumed, writing continues after its last checkpoint.
+    """
+    if journal is None:
+        writer = EventWriter(output_file)
+    else:
+        writer = journal.open_output(output_file)
+    try:
+        for key, story_dict in stories:
+            writer.write_story(key, story_dict)
+            if journal is not None:
+                journal.written(writer)
+        if journal is not None:
+            journal.finish(writer)
+    finally:
+        writer.close()
+        if journal is not None:
+            journal.close()
+
+
+# formats of EventWriter output by the ending of the file name, after any
+# .gz or .zst; other names are written as tab-delimited text
+OutputFormats = (('.jsonl', 'jsonl'), ('.columns', 'columns'),
+                 ('.arrow', 'arrow'), ('.parquet', 'parquet'))
+
+# most events in a batch of columns
+_COLUMN_BATCH = 65536
+
+
+def output_format(output_file):
+    """ (format, compression) of EventWriter output by the name output_file """
+    compression = ''
+    if output_file.endswith('.gz'):
+        compression = 'gzip'
+        output_file = output_file[:-3]
+    elif output_file.endswith('.zst'):
+        compression = 'zstd'
+        output_file = output_file[:-4]
+    for ending, event_format in OutputFormats:
+        if output_file.endswith(ending):
+            return event_format, compression
+    return 'tsv', compression
+
+
+def _json_values(record):
+    """ The fields of an event record with the date as YYYY-MM-DD """
+    values = list(record)
+    if values[1] is not None:
+        values[1] = values[1].isoformat()
+    return values
+
+
+class EventWriter(object):
+    """
+    Writes event records story by story through a buffered file. Nothing is
+    held back between stories except the file buffer, which is flushed every
+    `flush_stories` stories and on close().
+
+    Compressed output is written as a series of gzip members or zstd frames,
+    one per flush, so the file on disk can always be read up to the last
+    flush, and output appended after a flush (see EventJournal) stays valid.
+
+    Besides the tab-delimited text of format_story_events() the events can
+    be written as the typed records of story_event_records(), for loading
+    without parsing the joined fields:
+
+    jsonl:   one JSON object per event.
+    columns: one JSON object per batch of up to 65536 events, holding a list
+             of values for each field. Needs nothing beyond the standard
+             library.
+    arrow:   an Arrow IPC file with one record batch per batch of events.
+    parquet: a Parquet file with one row group per batch of events.
+
+    In Arrow and Parquet the issues are two lists, issues and issue_counts,
+    as the pyarrow releases for Python 2 cannot write maps to Parquet.
+
+    Arrow and Parquet output need the pyarrow package, can't be compressed
+    with `compression` and can't be continued from an offset.
+
+    Parameters
+    ----------
+
+    output_file: String.
+                 Filepath to which events should be written.
+
+    compression: String.
+                 "gzip", "zstd" or "" for none. Defaults to gzip for names
+                 ending in .gz and zstd for names ending in .zst; zstd needs
+                 the zstandard package.
+
+    flush_stories: Integer.
+                   Stories written between flushes. Defaults to
+                   PETRglobals.FlushStories; 0 only flushes on close(). Column
+                   formats are written a batch at a time instead.
+
+    offset: Integer.
+            Append to the existing file from this length on, dropping what
+            follows it, rather than starting a new file.
+
+    event_format: String.
+                  "tsv", "jsonl", "columns", "arrow" or "parquet". Defaults
+                  to the format for the name (see OutputFormats).
+    """
+
+    def __init__(self, output_file, compression=None, flush_stories=None,
+                 offset=None, event_format=None):
+        name_format, name_compression = output_format(output_file)
+        if compression is None:
+            compression = name_compression
+        if event_format is None:
+            event_format = name_format
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('zstd output needs the zstandard package')
+        if compression not in ('', None, 'gzip', 'zstd'):
+            raise ValueError('Unknown compression: ' + compression)
+        if event_format not in ('tsv', 'jsonl', 'columns', 'arrow',
+                                'parquet'):
+            raise ValueError('Unknown event format: ' + event_format)
+        self.compression = compression
+        self.event_format = event_format
+        # Arrow and Parquet files end with a footer written on close()
+        self.resumable = event_format not in ('arrow', 'parquet')
+        if flush_stories is None:
+            flush_stories = PETRglobals.FlushStories
+        self.flush_stories = flush_stories
+        self.events = 0
+        self._stories = 0  # since the last flush
+        self._compressor = None
+        self._rows = []  # events of the batch being collected
+        self._table = None  # pyarrow writer
+        if not self.resumable:
+            if compression or offset is not None:
+                raise ValueError(event_format + ' output cannot be compressed '
+                                 'or continued')
+            self._open_table(output_file)
+            self._file = None
+        elif offset is None:
+            self._file = open(output_file, 'wb', 1 << 16)
         else:
-            StorySource = 'NULL'
-        if 'url' in story_dict['meta']:
-            url = story_dict['meta']['url']
+            self._file = open(output_file, 'r+b', 1 << 16)
+            self._file.truncate(offset)
+            self._file.seek(offset)
+
+    def _open_table(self, output_file):
+        # pyarrow takes a while to import, so only when it is used
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError(self.event_format + ' output needs the pyarrow '
+                              'package; *.jsonl and *.columns files are '
+                              'written without it')
+        self._pyarrow = pyarrow
+        self._schema = pyarrow.schema([
+            ('story_id', pyarrow.string()), ('date', pyarrow.date32()),
+            ('source', pyarrow.string()), ('target', pyarrow.string()),
+            ('code', pyarrow.string()),
+            ('issues', pyarrow.list_(pyarrow.string())),
+            ('issue_counts', pyarrow.list_(pyarrow.int64())),
+            ('ids', pyarrow.list_(pyarrow.string())),
+            ('url', pyarrow.string()), ('story_source', pyarrow.string()),
+            ('source_text', pyarrow.string()),
+            ('target_text', pyarrow.string()),
+            ('event_text', pyarrow.string()),
+            ('source_root', pyarrow.string()),
+            ('target_root', pyarrow.string())])
+        if self.event_format == 'parquet':
+            self._table = pyarrow.parquet.ParquetWriter(output_file,
+                                                        self._schema)
         else:
-            url = ''
-        for event in filtered_events:
-            story_date = event[0]
-            source = event[1]
-            target = event[2]
-            code = filter(lambda a: not a == '\n', event[3])
+            self._sink = pyarrow.OSFile(output_file, 'wb')
+            self._table = pyarrow.RecordBatchFileWriter(self._sink,
+                                                        self._schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, text):
+        """ Writes text to the file as UTF-8 """
+        data = text.encode('utf-8')
+        if self.compression:
+            if self._compressor is None:
+                if self.compression == 'gzip':
+                    self._compressor = zlib.compressobj(
+                        6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                else:
+                    self._compressor = zstandard.ZstdCompressor().compressobj()
+            data = self._compressor.compress(data)
+        self._file.write(data)
+
+    def write_story(self, key, story_dict):
+        """ Formats and writes the events of a story; returns their number """
+        if self.event_format == 'tsv':
+            story_output = format_story_events(key, story_dict)
+        else:
+            story_output = story_event_records(key, story_dict)
+        if story_output:
+            if self.event_format == 'tsv':
+                self.write('\n'.join(story_output) + '\n')
+            elif self.event_format == 'jsonl':
+                self.write(''.join(
+                    json.dumps(OrderedDict(zip(EventFields,
+                                               _json_values(record)))) + '\n'
+                    for record in story_output))
+            else:
+                self._rows.extend(story_output)
+                if len(self._rows) >= _COLUMN_BATCH:
+                    self._write_batch()
+            self.events += len(story_output)
+        self._stories += 1
+        if (self.flush_stories and self._stories >= self.flush_stories and
+                self.event_format in ('tsv', 'jsonl')):
+            self.flush()
+        return len(story_output)
+
+    def _write_batch(self):
+        rows, self._rows = self._rows, []
+        if not rows:
+            return
+        if self.event_format == 'columns':
+            values = zip(*[_json_values(record) for record in rows])
+            self.write(json.dumps(OrderedDict(zip(EventFields,
+                                                  values))) + '\n')
+            return
+        columns = zip(*rows)
+        issues = columns[5]
+        columns[5:6] = [[list(item) for item in issues],
+                        [list(item.values()) for item in issues]]
+        arrays = [self._pyarrow.array(column, type=field.type)
+                  for column, field in zip(columns, self._schema)]
+        batch = self._pyarrow.RecordBatch.from_arrays(arrays,
+                                                      self._schema.names)
+        if self.event_format == 'parquet':
+            self._table.write_table(
+                self._pyarrow.Table.from_batches([batch]))
+        else:
+            self._table.write_batch(batch)
+
+    def flush(self):
+        """
+        Writes the batch of columns collected so far, ends the current gzip
+        member or zstd frame and flushes the file
+        """
+        self._write_batch()
+        if self._file is None:
+            return
+        if self._compressor is not None:
+            self._file.write(self._compressor.flush())
+            self._compressor = None
+        self._file.flush()
+        self._stories = 0
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def tell(self):
+        """ Position in the file; after flush() this is its length """
+        return self._file.tell()
+
+    def close(self):
+        if self._table is not None:
+            self._write_batch()
+            self._table.close()
+            self._table = None
+            if self.event_format == 'arrow':
+                self._sink.close()
+        elif self._file is not None and not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+class EventJournal(object):
+    """
+    Append-only record of the progress of a streamed batch run, so that a run
+    that stops part way through can be resumed where it left off.
+
+    Every `every` stories, and as soon as the last story of an input file has
+    been written, the output file is synced to disk and a checkpoint is
+    appended to the journal: the stories and input files completed since the
+    previous checkpoint and the length of the output file. On resume the
+    output is cut back to that length, completed input files are not read
+    again and completed stories are not coded again, so no story is written
+    twice and at most `every` stories are redone. A story is known by its
+    place in the input: the file it starts in and how many stories come
+    before it there, since a StoryID can occur more than once.
+
+    Each line of the journal is a JSON list: ["story", [[input file, number
+    in file], ...], StoryID], ["file", input file] or ["checkpoint", output
+    length]. Lines after the last checkpoint are ignored.
 
-            ids = ';'.join(filtered_events[event]['ids'])
+    Parameters
+    ----------
 
-            if 'issues' in filtered_events[event]:
-                iss = filtered_events[event]['issues']
-                issues = ['{},{}'.format(k, v) for k, v in iss.items()]
-                joined_issues = ';'.join(issues)
-            else:
-                joined_issues = []
+    path: String.
+          Journal file, by convention the output file name + ".journal".
+
+    resume: Boolean.
+            Continue from the last checkpoint of the journal already at path
+            rather than starting a new one.
+
+    every: Integer.
+           Most stories written between checkpoints.
+    """
+
+    def __init__(self, path, resume=False, every=1000):
+        self.path = path
+        self.every = max(1, every)
+        self.offset = 0  # length of the output file at the last checkpoint
+        self.files = set()  # input files completed
+        self.stories = set()  # (input file, number in file, StoryID) completed
+        self.resumed = 0  # stories completed by earlier runs
+        self._queue = deque()  # read but not yet written, in input order
+        self._entries = []  # completed since the last checkpoint
+        end = 0
+        if resume and os.path.exists(path):
+            end = self._load()
+        self._file = open(path, 'r+b' if end else 'wb')
+        self._file.truncate(end)
+        self._file.seek(end)
+
+    def _load(self):
+        """ Reads the journal up to its last checkpoint; returns its length """
+        end = length = 0
+        stories, files = [], []
+        with open(self.path, 'rb') as fin:
+            for line in fin:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+                length += len(line)
+                if entry[0] == 'story':
+                    stories.append(entry)
+                elif entry[0] == 'file':
+                    files.append(entry[1])
+                elif entry[0] == 'checkpoint':
+                    for _, places, key in stories:
+                        self.stories.update((path, number, key)
+                                            for path, number in places)
+                    self.resumed += len(stories)
+                    self.files.update(files)
+                    self.offset = entry[1]
+                    stories, files = [], []
+                    end = length
+        # only the stories of unfinished files are looked up
+        self.stories = set(item for item in self.stories
+                           if item[0] not in self.files)
+        return end
+
+    def file_done(self, path):
+        """ Whether path was completed by an earlier run """
+        return os.path.abspath(path) in self.files
+
+    def story_done(self, places, key):
+        """
+        Whether the story key was written earlier; places lists the (input
+        file, number in file) pairs it was read from.
+        """
+        path, number = places[0]
+        return (os.path.abspath(path), number, key) in self.stories
+
+    def reading(self, places, key):
+        """ Notes that the story key, read from places, is the next one out """
+        self._queue.append(['story', [[os.path.abspath(path), number]
+                                      for path, number in places], key])
+
+    def file_read(self, path):
+        """ Notes that every story of path has been passed to reading() """
+        self._queue.append(['file', os.path.abspath(path)])
+
+    def _file_ends(self):
+        queue = self._queue
+        found = False
+        while queue and queue[0][0] == 'file':
+            self._entries.append(queue.popleft())
+            found = True
+        return found
+
+    def written(self, output):
+        """ Notes that the next story has been written to output """
+        ended = self._file_ends()
+        self._entries.append(self._queue.popleft())
+        ended = self._file_ends() or ended
+        if ended or len(self._entries) >= self.every:
+            self.checkpoint(output)
+
+    def checkpoint(self, output):
+        """ Syncs output and journals everything written to it so far """
+        output.flush()
+        os.fsync(output.fileno())
+        self.offset = output.tell()
+        self._entries.append(['checkpoint', self.offset])
+        lines = [json.dumps(entry) + '\n' for entry in self._entries]
+        self._file.write(''.join(lines).encode('utf-8'))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._entries = []
+
+    def open_output(self, output_file):
+        """ EventWriter for output_file from the last checkpoint on """
+        if not self.offset:
+            return EventWriter(output_file)
+        if (not os.path.exists(output_file) or
+                os.path.getsize(output_file) < self.offset):
+            raise IOError('{} is shorter than recorded in {}; the run cannot '
+                          'be resumed'.format(output_file, self.path))
+        return EventWriter(output_file, offset=self.offset)
+
+    def finish(self, output):
+        """ Checkpoints the end of the run and removes the journal """
+        self._file_ends()
+        self.checkpoint(output)
+        self.close()
+        os.remove(self.path)
+
+    def close(self):
+        self._file.close()
+
+
+def _story_events(key, story_dict):
+    """
+    Yields (event, details, story source, url) for each coded event of a
+    story, where event is the (date, source, target, code) tuple and details
+    its dictionary from utilities.story_filter(), and prints the event unless
+    PETRglobals.PrintEvents is off.
+    """
+    global StorySource
 
-            print('Event: {}\t{}\t{}\t{}\t{}\t{}'.format(story_date, source,
-                                                         target, code, ids,
+    if not story_dict['sents']:
+        return    # skip cases eliminated by story-level discard
+#    print('WE1',story_dict)
+    filtered_events = utilities.story_filter(story_dict, key)
+#    print('WE2',filtered_events)
+    if 'source' in story_dict['meta']:
+        StorySource = story_dict['meta']['source']
+    else:
+        StorySource = 'NULL'
+    if 'url' in story_dict['meta']:
+        url = story_dict['meta']['url']
+    else:
+        url = ''
+    for event in filtered_events:
+        if PETRglobals.PrintEvents:
+            code = filter(lambda a: not a == '\n', event[3])
+            ids = ';'.join(filtered_events[event]['ids'])
+            print('Event: {}\t{}\t{}\t{}\t{}\t{}'.format(event[0], event[1],
+                                                         event[2], code, ids,
                                                          StorySource))
-#            event_str = '{}\t{}\t{}\t{}'.format(story_date,source,target,code)
-            # 15.04.30: a very crude hack around an error involving multi-word
-            # verbs
-            if not isinstance(event[3], basestring):
-                event_str = '\t'.join(
-                    event[:3]) + '\t010\t' + '\t'.join(event[4:])
+        yield event, filtered_events[event], StorySource, url
+
+
+def format_story_events(key, story_dict):
+    """
+    Formats the coded events of a single story.
+
+    Parameters
+    ----------
+
+    key: String.
+         StoryID of the story.
+
+
+    story_dict: Dictionary.
+                Story-level dictionary from the main event-holding dictionary.
+
+    Returns
+    -------
+
+    story_output: List.
+                  The tab-delimited event records of the story, without line
+                  endings; empty for stories without events.
+    """
+    story_output = []
+    for event, details, story_source, url in _story_events(key, story_dict):
+        ids = ';'.join(details['ids'])
+
+        if 'issues' in details:
+            iss = details['issues']
+            issues = ['{},{}'.format(k, v) for k, v in iss.items()]
+            joined_issues = ';'.join(issues)
+        else:
+            joined_issues = []
+
+#        event_str = '{}\t{}\t{}\t{}'.format(story_date,source,target,code)
+        # 15.04.30: a very crude hack around an error involving multi-word
+        # verbs
+        if not isinstance(event[3], basestring):
+            event_str = '\t'.join(
+                event[:3]) + '\t010\t' + '\t'.join(event[4:])
+        else:
+            event_str = '\t'.join(event)
+        # print(event_str)
+        if joined_issues:
+            event_str += '\t{}'.format(joined_issues)
+        else:
+            event_str += '\t'
+
+        if url:
+            event_str += '\t{}\t{}\t{}'.format(ids, url, story_source)
+        else:
+            event_str += '\t{}\t{}'.format(ids, story_source)
+
+        if PETRglobals.WriteActorText:
+            if 'actortext' in details:
+                event_str += '\t{}\t{}'.format(details['actortext'][0],
+                                               details['actortext'][1])
             else:
-                event_str = '\t'.join(event)
-            # print(event_str)
-            if joined_issues:
-                event_str += '\t{}'.format(joined_issues)
+                event_str += '\t---\t---'
+        if PETRglobals.WriteEventText:
+            if 'eventtext' in details:
+                event_str += '\t{}'.format(details['eventtext'])
             else:
-                event_str += '\t'
-
-            if url:
-                event_str += '\t{}\t{}\t{}'.format(ids, url, StorySource)
+                event_str += '\t---'
+        if PETRglobals.WriteActorRoot:
+            if 'actorroot' in details:
+                event_str += '\t{}\t{}'.format(details['actorroot'][0],
+                                               details['actorroot'][1])
             else:
-                event_str += '\t{}\t{}'.format(ids, StorySource)
+                event_str += '\t---\t---'
 
-            if PETRglobals.WriteActorText:
-                if 'actortext' in filtered_events[event]:
-                    event_str += '\t{}\t{}'.format(
-                        filtered_events[event]['actortext'][0],
-                        filtered_events[event]['actortext'][1])
-                else:
-                    event_str += '\t---\t---'
-            if PETRglobals.WriteEventText:
-                if 'eventtext' in filtered_events[event]:
-                    event_str += '\t{}'.format(
-                        filtered_events[event]['eventtext'])
-                else:
-                    event_str += '\t---'
-            if PETRglobals.WriteActorRoot:
-                if 'actorroot' in filtered_events[event]:
-                    event_str += '\t{}\t{}'.format(
-                        filtered_events[event]['actorroot'][0],
-                        filtered_events[event]['actorroot'][1])
-                else:
-                    event_str += '\t---\t---'
+        story_output.append(event_str)
 
-            story_output.append(event_str)
+    return story_output
 
-        story_events = '\n'.join(story_output)
-        event_output.append(story_events)
 
-    # Filter out blank lines
-    event_output = [event for event in event_output if event]
-    if output_file:
-        f = codecs.open(output_file, encoding='utf-8', mode='w')
-        for str in event_output:
-            #             field = str.split('\t')  # debugging
-            #            f.write(field[5] + '\n')
-            f.write(str + '\n')
-        f.close()
+# fields of the records from story_event_records(), in column order
+EventFields = ('story_id', 'date', 'source', 'target', 'code', 'issues', 'ids',
+               'url', 'story_source', 'source_text', 'target_text',
+               'event_text', 'source_root', 'target_root')
+
+
+def _event_date(date):
+    """ datetime.date of a YYYYMMDD date string, or None """
+    try:
+        return datetime.date(int(date[:4]), int(date[4:6]), int(date[6:8]))
+    except (TypeError, ValueError):
+        return None
+
+
+def story_event_records(key, story_dict):
+    """
+    The coded events of a single story as typed records, the counterpart of
+    format_story_events() for output that is loaded rather than read.
+
+    Parameters
+    ----------
+
+    key: String.
+         StoryID of the story.
+
+
+    story_dict: Dictionary.
+                Story-level dictionary from the main event-holding dictionary.
+
+    Returns
+    -------
+
+    records: List.
+             One tuple per event with the fields of EventFields: the date is a
+             datetime.date, issues a dictionary of ISSUE: COUNT and ids a list
+             of sentence IDs. The text and root fields are None unless the
+             matching write_actor_text, write_event_text and write_actor_root
+             options are on; url is None for stories without one.
+    """
+    records = []
+    for event, details, story_source, url in _story_events(key, story_dict):
+        if isinstance(event[3], basestring):
+            code = event[3]
+        else:
+            code = '010'   # as in format_story_events()
+        actor_text = details.get('actortext', (None, None))
+        actor_root = details.get('actorroot', (None, None))
+        records.append((key, _event_date(event[0]), event[1], event[2], code,
+                        dict(details.get('issues', {})), list(details['ids']),
+                        url or None, story_source, actor_text[0],
+                        actor_text[1], details.get('eventtext'),
+                        actor_root[0], actor_root[1]))
+    return records
 
 
 def write_nullverbs(event_dict, output_file):
@@ -6,9 +6,13 @@ from __future__ import unicode_literals
 import os
 import sys
 import glob
+import json
 import time
 import logging
 import argparse
+import itertools
+import collections
+import multiprocessing
 
 # petrarch.py
 ##
@@ -53,6 +57,9 @@ import PETRreader  # input routines
 import PETRwriter
 import utilities
 import PETRtree
+import PETRtrie
+import PETRcache
+import PETRserver
 
 
 # ========================== VALIDATION FUNCTIONS ========================== #
@@ -112,29 +119,23 @@ def check_discards(SentenceText):
        0 : no matches
        1 : simple match
        2 : story match [+ prefix]
+
+    All of the phrases are found in one pass over the words with the automaton
+    that PETRreader.read_discard_list() builds from the discard list.
     """
+    if not PETRglobals.DiscardAutomaton:
+        return [0, '']
     sent = SentenceText.upper().split()  # case insensitive matching
-    #size = len(sent)
-    level = PETRglobals.DiscardList
-    depart_index = [0]
-    discardPhrase = ""
-
-    for i in range(len(sent)):
-
-        if '+' in level:
-            return [2, '+ ' + discardPhrase]
-        elif '$' in level:
-            return [1, ' ' + discardPhrase]
-        elif sent[i] in level:
-            # print(sent[i],SentenceText.upper(),level[sent[i]])
-            depart_index.append(i)
-            level = level[sent[i]]
-            discardPhrase += " " + sent[i]
-        else:
-            if len(depart_index) == 0:
-                continue
-            i = depart_index[0]
-            level = PETRglobals.DiscardList
+    match = None
+    for end, length, marker, _ in utilities.scan_phrases(
+            PETRglobals.DiscardAutomaton, sent):
+        if marker == '+':
+            return [2, '+ ' + ''.join(' ' + word
+                                      for word in sent[end - length:end])]
+        if not match:
+            match = sent[end - length:end]
+    if match:
+        return [1, ' ' + ''.join(' ' + word for word in match)]
     return [0, '']
 
 
@@ -145,45 +146,404 @@ def get_issues(SentenceText):
     <14.02.28> stops coding and sets the issues to zero if it finds *any*
     ignore phrase
 
+    All of the issue phrases are found in one pass over the words with the
+    automaton that PETRreader.read_issue_list() builds. Where phrases overlap,
+    the leftmost one is counted, and of the phrases starting at the same word
+    the longest.
     """
-    def recurse(words, path, length):
-        if '#' in path:  # <16.06.06 pas> Swapped the ordering if these checks since otherwise it crashes when '#' is a "word" in the text
-            return path['#'], length
-        elif words and words[0] in path:
-            return recurse(words[1:], path[words[0]], length + 1)
-        return False
-
+    if not PETRglobals.IssueAutomaton:
+        return []
     sent = SentenceText.upper().split()  # case insensitive matching
-    issues = []
 
+    longest = {}  # start of a match: (length, code index) of the longest
+    for end, length, _, codeindex in utilities.scan_phrases(
+            PETRglobals.IssueAutomaton, sent):
+        if PETRglobals.IssueCodes[codeindex][0] == '~':  # ignore code, so bail
+            return []
+        start = end - length
+        if start not in longest or length > longest[start][0]:
+            longest[start] = (length, codeindex)
+
+    issues = []
+    counts = {}
     index = 0
-    while index < len(sent):
-        match = recurse(sent[index:], PETRglobals.IssueList, 0)
-        if match:
-            index += match[1]
-            code = PETRglobals.IssueCodes[match[0]]
-            if code[0] == '~':  # ignore code, so bail
-                return []
-            ka = 0
-            #gotcode = False
-            while ka < len(issues):
-                if code == issues[ka][0]:
-                    issues[ka][1] += 1
-                    break
-                ka += 1
-            if ka == len(issues):  # didn't find the code, so add it
-                issues.append([code, 1])
+    for start in sorted(longest):
+        if start < index:
+            continue    # overlaps the previous match
+        length, codeindex = longest[start]
+        index = start + length
+        code = PETRglobals.IssueCodes[codeindex]
+        if code in counts:
+            counts[code][1] += 1
         else:
-            index += 1
+            counts[code] = [code, 1]
+            issues.append(counts[code])
     return issues
 
 
-def do_coding(event_dict):
+def do_coding(event_dict, workers=1, counts=None):
     """
     Main coding loop Note that entering any character other than 'Enter' at the
     prompt will stop the program: this is deliberate.
     <14.02.28>: Bug: PETRglobals.PauseByStory actually pauses after the first
                 sentence of the *next* story
+
+    Parameters
+    ----------
+
+    event_dict: Dictionary.
+                Global holding dictionary; the coded events are added to it.
+
+    workers: Integer.
+             Number of processes to code with. With more than one, the stories
+             are split into shards of consecutive story IDs that are coded in
+             a process pool; the results are merged back in story order, so
+             the output is the same as that of a serial run.
+
+    counts: Dictionary.
+            If given, the coding counters, stage times and sentence latencies
+            are added to it; utilities.coding_stats() summarizes them.
+
+    Returns
+    -------
+
+    event_dict: Dictionary.
+                The same holding dictionary, with the events added.
+    """
+    keys = sorted(event_dict)
+    if len(keys) > 1 and use_pool(workers):
+        coded = code_stories_in_pool(event_dict, keys, workers)
+    else:
+        coded = code_stories(event_dict, keys, {})
+    print_coding_summary(coded)
+    if counts is not None:
+        utilities.merge_counts(counts, coded)
+    return event_dict
+
+
+def code_story_stream(stories, counts, workers=1, window=256):
+    """
+    Streaming counterpart of do_coding(): codes the stories as they are read
+    and yields them in the same order, so that only the stories in flight are
+    held in memory.
+
+    Parameters
+    ----------
+
+    stories: Iterable.
+             (StoryID, story dictionary) pairs, e.g. from
+             PETRreader.iter_xml_input().
+
+    counts: Dictionary.
+            The coding summary counts, stage times and sentence latencies are
+            added to this as stories are coded.
+
+    workers: Integer.
+             Number of processes to code with. With more than one, up to
+             window stories at a time are sent to a process pool.
+
+    window: Integer.
+            Number of stories coded by the pool before they are yielded.
+
+    Yields
+    ------
+
+    (key, story_dict): Tuple.
+                       StoryID and the coded story dictionary.
+    """
+    if not use_pool(workers):
+        for key, story in stories:
+            utilities.merge_counts(counts, code_stories({key: story}, [key]))
+            yield key, story
+        return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        batch = []
+        for item in itertools.chain(stories, [None]):
+            if item is not None:
+                batch.append(item)
+                if len(batch) < window:
+                    continue
+            for key, story, story_counts in pool.map(_code_story, batch):
+                utilities.merge_counts(counts, story_counts)
+                yield key, story
+            batch = []
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _code_story(item):
+    key, story = item
+    return key, story, code_stories({key: story}, [key])
+
+
+def fold_duplicate_stories(stories, counts, window=None, distance=None):
+    """
+    Pre-coding stage that finds near-duplicate stories, such as a syndicated
+    story that arrives from several outlets with trivial edits. Each story is
+    compared with the window stories before it by the SimHash of its text; a
+    near-duplicate has its sentences removed, so it is neither parsed nor
+    coded, and meta['duplicate_of'] names the story it duplicates.
+
+    Parameters
+    ----------
+
+    stories: Iterable.
+             (StoryID, story dictionary) pairs, e.g. from
+             PETRreader.iter_xml_input().
+
+    counts: Dictionary.
+            The number of folded stories is added to counts['NFolded'].
+
+    window: Integer.
+            Number of previous stories compared. Defaults to
+            PETRglobals.DedupeWindow; with 0 the stories are passed through.
+
+    distance: Integer.
+              Most bits in which the fingerprints of near-duplicates differ.
+              Defaults to PETRglobals.DedupeDistance.
+
+    Yields
+    ------
+
+    (key, story_dict): Tuple.
+                       Every story, in the order they arrive.
+    """
+    if window is None:
+        window = PETRglobals.DedupeWindow
+    if distance is None:
+        distance = PETRglobals.DedupeDistance
+    if window <= 0:
+        for item in stories:
+            yield item
+        return
+
+    # two fingerprints that differ in at most distance bits agree exactly on at
+    # least one of distance + 1 bands, so only stories that share a band with
+    # the new one need to be compared
+    width = 64 // (distance + 1)
+    bands = [(shift, (1 << width) - 1)
+             for shift in range(0, width * (distance + 1), width)]
+    index = [collections.defaultdict(list) for _ in bands]
+    recent = collections.deque()
+    counts.setdefault('NFolded', 0)
+    for key, story in stories:
+        t1 = time.time()
+        sents = story['sents'] or {}
+        fingerprint = utilities.story_simhash(
+            [sents[sent]['content'] for sent in sorted(sents)])
+        original = None
+        if fingerprint is not None:
+            for (shift, mask), table in zip(bands, index):
+                for other, other_print in table.get(
+                        (fingerprint >> shift) & mask, ()):
+                    if bin(fingerprint ^ other_print).count('1') <= distance:
+                        original = other
+                        break
+                if original is not None:
+                    break
+
+        if original is not None:
+            counts['NFolded'] += 1
+            story['sents'] = {}
+            story['meta']['duplicate_of'] = original
+        elif fingerprint is not None:
+            recent.append((key, fingerprint))
+            for (shift, mask), table in zip(bands, index):
+                table[(fingerprint >> shift) & mask].append((key, fingerprint))
+            if len(recent) > window:
+                old = recent.popleft()
+                for (shift, mask), table in zip(bands, index):
+                    band = (old[1] >> shift) & mask
+                    table[band].remove(old)
+                    if not table[band]:
+                        del table[band]
+        utilities.add_stage_time(counts, 'dedupe', time.time() - t1)
+        yield key, story
+
+
+def fold_duplicates(event_dict, counts):
+    """ fold_duplicate_stories() on a holding dictionary, in story ID order """
+    for _ in fold_duplicate_stories(((key, event_dict[key])
+                                     for key in sorted(event_dict)), counts):
+        pass
+
+
+def use_pool(workers):
+    """ Whether coding can be spread over workers > 1 processes """
+    logger = logging.getLogger('petr_log')
+    if workers <= 1:
+        return False
+    if not hasattr(os, 'fork'):
+        logger.warning('Multiprocess coding needs fork(); coding serially')
+        return False
+    if PETRglobals.PauseBySentence or PETRglobals.PauseByStory:
+        logger.warning('Pausing needs a terminal; coding serially')
+        return False
+    return True
+
+
+# holding dictionary inherited by the pool processes through fork()
+_pool_events = None
+
+
+def _code_shard(keys):
+    counts = code_stories(_pool_events, keys)
+    return [(key, _pool_events[key]) for key in keys], counts
+
+
+def code_stories_in_pool(event_dict, keys, workers):
+    """
+    Codes the stories listed in keys with a pool of worker processes. The
+    workers are forked after the dictionaries have been read, so they share
+    them with this process, and only the story IDs and the coded stories are
+    passed between processes. Returns the summed coding counts.
+    """
+    global _pool_events
+
+    # several shards per worker keeps the pool busy when story lengths vary
+    size = max(1, len(keys) // (4 * workers))
+    shards = [keys[ka:ka + size] for ka in range(0, len(keys), size)]
+
+    totals = {}
+    _pool_events = event_dict
+    pool = multiprocessing.Pool(workers)
+    try:
+        interned = {}
+        for coded, counts in pool.imap(_code_shard, shards):
+            for key, story in coded:
+                utilities.intern_story(story, interned)
+                event_dict[key] = story
+            utilities.merge_counts(totals, counts)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _pool_events = None
+    return totals
+
+
+def code_holdings(holdings, counts, pool=None):
+    """
+    Codes a batch of holding dictionaries, e.g. the requests collected by the
+    coding server, and returns the PETRwriter.pipe_output() of each.
+
+    Parameters
+    ----------
+
+    holdings: List.
+              Holding dictionaries from PETRreader.read_pipeline_input(). The
+              story IDs of different holdings may be the same.
+
+    counts: Dictionary.
+            The coding counts are added to this.
+
+    pool: multiprocessing.Pool.
+          If given, the stories of all of the holdings are coded together
+          in its worker processes, which need to have been forked after the
+          dictionaries were read.
+
+    Returns
+    -------
+
+    output: List.
+            PETRwriter.pipe_output() of each holding, in order.
+    """
+    for event_dict in holdings:
+        fold_duplicates(event_dict, counts)
+    interned = {}   # shared by the stories of this batch only
+    if pool is None:
+        for event_dict in holdings:
+            utilities.merge_counts(counts, code_stories(
+                event_dict, sorted(event_dict), interned))
+    else:
+        owners = [event_dict for event_dict in holdings
+                  for key in sorted(event_dict)]
+        items = [(key, event_dict[key]) for event_dict in holdings
+                 for key in sorted(event_dict)]
+        for event_dict, (key, story, story_counts) in zip(
+                owners, pool.map(_code_story, items)):
+            utilities.intern_story(story, interned)
+            event_dict[key] = story
+            utilities.merge_counts(counts, story_counts)
+    t1 = time.time()
+    output = [PETRwriter.pipe_output(event_dict) for event_dict in holdings]
+    utilities.add_stage_time(counts, 'write', time.time() - t1)
+    return output
+
+
+# sentence cache of this process; see get_sentence_cache()
+_sentence_cache = None
+
+
+def get_sentence_cache():
+    """
+    Returns the cache of coded sentences configured by cache_size and
+    cache_name, opening it on first use in each process, or None when the
+    cache is off. The null coding modes are never cached.
+    """
+    global _sentence_cache
+    if not (PETRglobals.CacheSize or PETRglobals.CacheFileName):
+        return None
+    if PETRglobals.NullVerbs or PETRglobals.NullActors:
+        return None
+    if _sentence_cache is None or _sentence_cache.pid != os.getpid():
+        # a cache inherited through fork() is left alone: its sqlite
+        # connection belongs to the parent process
+        fingerprint = PETRreader.dictionary_fingerprint(get_dictionary_paths())
+        bounds = PETRcache.actor_date_bounds(PETRglobals.ActorDict)
+        path = PETRglobals.CacheFileName
+        if path:
+            path = os.path.abspath(path)
+        _sentence_cache = PETRcache.SentenceCache(PETRglobals.CacheSize, path,
+                                                  fingerprint, bounds)
+    return _sentence_cache
+
+
+def print_coding_summary(counts):
+    print("\nSummary:")
+    print(
+        "Stories read:",
+        counts.get('NStory', 0),
+        "   Sentences coded:",
+        counts.get('NSent', 0),
+        "  Events generated:",
+        counts.get('NEvents', 0))
+    print(
+        "Discards:  Sentence",
+        counts.get('NDiscardSent', 0),
+        "  Story",
+        counts.get('NDiscardStory', 0),
+        "  Sentences without events:",
+        counts.get('NEmpty', 0))
+    sents = counts.get('sents', 0)
+    print("Average Coding time = ",
+          counts.get('times', 0) / sents if sents else 0)
+    if counts.get('NFolded'):
+        print("Near-duplicate stories folded:", counts['NFolded'])
+    if 'NCacheHit' in counts:
+        print("Sentence cache:  hits", counts['NCacheHit'],
+              "  misses", counts['NCacheMiss'])
+    if counts.get('NTransformHit') or counts.get('NTransformMiss'):
+        print("Verb transformations:  applied", counts['NTransformHit'],
+              "  not applied", counts['NTransformMiss'])
+
+
+def code_stories(event_dict, keys, interned=None):
+    """
+    Codes the stories in event_dict listed in keys, in that order, and returns
+    a dictionary of the counts reported in the coding summary, together with
+    the time spent in each stage of coding and a histogram of the sentence
+    latencies (see utilities.coding_stats()). With an interned dictionary, the
+    coded events are shared through it by utilities.intern_events(); the
+    stories that are written and dropped one at a time are not interned.
     """
 
     treestr = ""
@@ -198,7 +558,16 @@ def do_coding(event_dict):
     logger = logging.getLogger('petr_log')
     times = 0
     sents = 0
-    for key, val in sorted(event_dict.items()):
+    counts = {}
+    cache = get_sentence_cache()
+    if cache:
+        hits, misses = cache.hits, cache.misses
+    transforms = dict(PETRtree.transform_counts)
+    # the null modes write from the coding metadata
+    keep_meta = (PETRglobals.KeepCodingMeta or PETRglobals.NullVerbs or
+                 PETRglobals.NullActors)
+    for key in keys:
+        val = event_dict[key]
         NStory += 1
         prev_code = []
 
@@ -219,10 +588,17 @@ def do_coding(event_dict):
                 Date = PETRreader.dstr_to_ordate(SentenceDate)
 
                 print("\n", SentenceID)
-                parsed = event_dict[key]['sents'][sent]['parsed']
+                if keep_meta:
+                    parsed = event_dict[key]['sents'][sent]['parsed']
+                else:
+                    parsed = event_dict[key]['sents'][sent].pop('parsed')
                 treestr = parsed
+                t0 = time.time()
                 disc = check_discards(SentenceText)
+                t1 = time.time()
+                utilities.add_stage_time(counts, 'discards', t1 - t0)
                 if disc[0] > 0:
+                    utilities.add_latency(counts, t1 - t0)
                     if disc[0] == 1:
                         print("Discard sentence:", disc[1])
                         logger.info('\tSentence discard. {}'.format(disc[1]))
@@ -235,42 +611,76 @@ def do_coding(event_dict):
                         NDiscardStory += 1
                         break
 
-                t1 = time.time()
-                sentence = PETRtree.Sentence(treestr, SentenceText, Date)
-                print(sentence.txt)
-                # this is the entry point into the processing in PETRtree
-                coded_events, meta = sentence.get_events()
-                code_time = time.time() - t1
-                if PETRglobals.NullVerbs or PETRglobals.NullActors:
-                    event_dict[key]['meta'] = meta
-                    event_dict[key]['text'] = sentence.txt
-                elif PETRglobals.NullActors:
-                    event_dict[key]['events'] = coded_events
-                    coded_events = None   # skips additional processing
-                    event_dict[key]['text'] = sentence.txt
+                cached = None
+                if cache:
+                    cache_key = cache.key(treestr, Date)
+                    cached = cache.get(cache_key)
+                if cached:
+                    coded_events, meta = cached
+                    t3 = time.time()
+                    utilities.add_stage_time(counts, 'cache', t3 - t1)
+                    code_time = t3 - t1
+                    if keep_meta:
+                        event_dict[key]['meta']['verbs'] = meta
                 else:
-                    # 16.04.30 pas: we're using the key value 'meta' at two
-                    # very different
-                    event_dict[key]['meta']['verbs'] = meta
-                    # levels of event_dict -- see the code about ten lines below -- and
-                    # this is potentially confusing, so it probably would be useful to
-                    # change one of those
-
-                del(sentence)
+                    sentence = PETRtree.Sentence(treestr, SentenceText, Date)
+                    t2 = time.time()
+                    utilities.add_stage_time(counts, 'tree', t2 - t1)
+                    print(sentence.txt)
+                    # this is the entry point into the processing in PETRtree;
+                    # a sentence whose coding failed is coded without events
+                    coded_events, meta = sentence.get_events()
+                    if coded_events is None:
+                        logger.warning('\tCoding failed, no events coded. '
+                                       '{}'.format(SentenceID))
+                        coded_events, meta = [], {}
+                    t3 = time.time()
+                    utilities.add_stage_time(counts, 'events', t3 - t2)
+                    code_time = t3 - t1
+                    if cache:
+                        cache.put(cache_key, (coded_events, meta))
+                    if PETRglobals.NullVerbs or PETRglobals.NullActors:
+                        event_dict[key]['meta'] = meta
+                        event_dict[key]['text'] = sentence.txt
+                    elif PETRglobals.NullActors:
+                        event_dict[key]['events'] = coded_events
+                        coded_events = None   # skips additional processing
+                        event_dict[key]['text'] = sentence.txt
+                    elif keep_meta:
+                        # 16.04.30 pas: we're using the key value 'meta' at two
+                        # very different
+                        event_dict[key]['meta']['verbs'] = meta
+                        # levels of event_dict -- see the code about ten lines below -- and
+                        # this is potentially confusing, so it probably would be useful to
+                        # change one of those
+
+                    del(sentence)
                 times += code_time
                 sents += 1
                 # print('\t\t',code_time)
 
                 if coded_events:
+                    if interned is not None:
+                        coded_events = utilities.intern_events(coded_events,
+                                                               interned)
                     event_dict[key]['sents'][sent]['events'] = coded_events
-                    event_dict[key]['sents'][sent]['meta'] = meta
+                    if keep_meta:
+                        event_dict[key]['sents'][sent]['meta'] = meta
                     #print('DC-events:', coded_events) # --
                     #print('DC-meta:', meta) # --
                     #print('+++',event_dict[key]['sents'][sent])  # --
                     if PETRglobals.WriteActorText or PETRglobals.WriteEventText or PETRglobals.WriteActorRoot:
-                        text_dict = utilities.extract_phrases(event_dict[key]['sents'][sent], SentenceID)
+                        t4 = time.time()
+                        text_dict = utilities.extract_phrases(
+                            {'content': SentenceText, 'meta': meta}, SentenceID)
+                        utilities.add_stage_time(counts, 'phrases',
+                                                 time.time() - t4)
 # --                        print('DC-td1:',text_dict) # --
                         if text_dict:
+                            event_dict[key]['sents'][sent]['phrases'] = dict(
+                                (evt, utilities.EventPhrases(*text_dict[evt]))
+                                for evt in coded_events if evt in text_dict)
+                        if text_dict and keep_meta:
                             event_dict[key]['sents'][sent][
                                 'meta']['actortext'] = {}
                             event_dict[key]['sents'][sent][
@@ -287,10 +697,14 @@ def do_coding(event_dict):
                                     event_dict[key]['sents'][sent]['meta'][
                                         'actorroot'][evt] = text_dict[evt][3:5]
 
-                if coded_events and PETRglobals.IssueFileName != "":
+                if PETRglobals.IssueFileName != "":
+                    t4 = time.time()
                     event_issues = get_issues(SentenceText)
+                    utilities.add_stage_time(counts, 'issues',
+                                             time.time() - t4)
                     if event_issues:
                         event_dict[key]['sents'][sent]['issues'] = event_issues
+                utilities.add_latency(counts, time.time() - t0)
 
                 if PETRglobals.PauseBySentence:
                     if len(input("Press Enter to continue...")) > 0:
@@ -307,24 +721,20 @@ def do_coding(event_dict):
         if SkipStory:
             event_dict[key]['sents'] = None
 
-    print("\nSummary:")
-    print(
-        "Stories read:",
-        NStory,
-        "   Sentences coded:",
-        NSent,
-        "  Events generated:",
-        NEvents)
-    print(
-        "Discards:  Sentence",
-        NDiscardSent,
-        "  Story",
-        NDiscardStory,
-        "  Sentences without events:",
-        NEmpty)
-    print("Average Coding time = ", times / sents if sents else 0)
 # --    print('DC-exit:',event_dict)
-    return event_dict
+    if cache:
+        cache.flush()
+        counts['NCacheHit'] = cache.hits - hits
+        counts['NCacheMiss'] = cache.misses - misses
+    counts['NTransformHit'] = (PETRtree.transform_counts['hits'] -
+                               transforms['hits'])
+    counts['NTransformMiss'] = (PETRtree.transform_counts['misses'] -
+                                transforms['misses'])
+    counts.update({'NStory': NStory, 'NSent': NSent, 'NEvents': NEvents,
+                   'NEmpty': NEmpty, 'NDiscardSent': NDiscardSent,
+                   'NDiscardStory': NDiscardStory, 'times': times,
+                   'sents': sents})
+    return counts
 
 
 def parse_cli_args():
@@ -379,6 +789,85 @@ PETRARCH2
                                data/text/Gigaword.sample.PETR.xml""",
                                required=False)
 
+    batch_command.add_argument('-w', '--workers', type=int, default=1,
+                               help="""Number of processes to code the stories
+                               with. Defaults to 1""",
+                               required=False)
+
+    batch_command.add_argument('-s', '--stats',
+                               help="""Filepath for a JSON report of the
+                               coding counts, the time spent in each stage
+                               and the sentence latency percentiles.""",
+                               required=False)
+
+    batch_command.add_argument('-q', '--quiet', action='store_true',
+                               default=False, help="""Do not print each
+                               event to the console as it is coded.""",
+                               required=False)
+
+    batch_command.add_argument('-r', '--resume', action='store_true',
+                               default=False, help="""Continue an interrupted
+                               run with the same inputs and output from its
+                               last checkpoint, rather than starting over.""",
+                               required=False)
+
+    server_command = sub_parse.add_parser('server', help="""Command to run a
+                                          local HTTP server that reads the
+                                          dictionaries once and codes parsed
+                                          stories POSTed to it as JSON.""",
+                                          description="""Command to run a
+                                          local HTTP server that reads the
+                                          dictionaries once and codes parsed
+                                          stories POSTed to it as JSON.""")
+    server_command.add_argument('-c', '--config',
+                                help="""Filepath for the PETRARCH configuration
+                                file. Defaults to PETR_config.ini""",
+                                required=False)
+    server_command.add_argument('-H', '--host', default='127.0.0.1',
+                                help="""Address to listen on. Defaults to
+                                127.0.0.1""",
+                                required=False)
+    server_command.add_argument('-p', '--port', type=int, default=8080,
+                                help="""Port to listen on. Defaults to
+                                8080""",
+                                required=False)
+    server_command.add_argument('-w', '--workers', type=int, default=1,
+                                help="""Number of processes to code the stories
+                                with. Defaults to 1""",
+                                required=False)
+    server_command.add_argument('-b', '--batch', type=int, default=64,
+                                help="""Most stories coded in one batch of
+                                requests. Defaults to 64""",
+                                required=False)
+    server_command.add_argument('--batch-wait', type=float, default=10,
+                                help="""Milliseconds that a request waits for
+                                others to batch with. Defaults to 10""",
+                                required=False)
+
+    compile_command = sub_parse.add_parser('compile', help="""Command to write a
+                                           snapshot of the dictionaries specified
+                                           by an optional config file, which
+                                           makes later runs start faster.""",
+                                           description="""Command to write a
+                                           snapshot of the dictionaries specified
+                                           by an optional config file, which
+                                           makes later runs start faster.""")
+    compile_command.add_argument('-c', '--config',
+                                 help="""Filepath for the PETRARCH configuration
+                                 file. Defaults to PETR_config.ini""",
+                                 required=False)
+    compile_command.add_argument('-o', '--output',
+                                 help="""Filepath for the snapshot. Defaults to
+                                 the snapshot_name in the config file, or
+                                 PETR.dictionaries.snapshot""",
+                                 required=False)
+    compile_command.add_argument('-t', '--trie',
+                                 help="""Filepath for the memory-mapped actor
+                                 and agent dictionaries. Defaults to the
+                                 trie_name in the config file; if neither is
+                                 given no trie is written.""",
+                                 required=False)
+
     nulloptions = aparse.add_mutually_exclusive_group()
 
     nulloptions.add_argument(
@@ -432,7 +921,29 @@ def main():
         PETRglobals.NullActors = True
         PETRglobals.NewActorLength = int(cli_args.nullactors)
 
+    if cli_args.command_name == 'batch' and cli_args.quiet:
+        PETRglobals.PrintEvents = False
+
+    if cli_args.command_name == 'compile':
+        if cli_args.output:
+            snapshot_name = os.path.abspath(cli_args.output)
+        else:
+            snapshot_name = (PETRglobals.SnapshotFileName or
+                             'PETR.dictionaries.snapshot')
+        if cli_args.trie:
+            trie_name = os.path.abspath(cli_args.trie)
+        else:
+            trie_name = PETRglobals.TrieFileName
+        compile_dictionaries(snapshot_name, trie_name)
+        print("Finished")
+        return
+
     read_dictionaries()
+    if cli_args.command_name == 'server':
+        serve(cli_args.host, cli_args.port, cli_args.workers, cli_args.batch,
+              cli_args.batch_wait / 1000.0)
+        return
+
     start_time = time.time()
     print('\n\n')
 
@@ -457,33 +968,91 @@ def main():
         out = cli_args.outputs
 
     if cli_args.command_name == 'parse':
-        run(paths, out, cli_args.parsed)
+        counts = run(paths, out, cli_args.parsed)
 
     else:
-        run(paths, out, True)  # <===
+        counts = run(paths, out, True, cli_args.workers,
+                     cli_args.resume)  # <===
 
     print("Coding time:", time.time() - start_time)
+    if cli_args.command_name == 'batch' and cli_args.stats:
+        with open(cli_args.stats, 'w') as fout:
+            json.dump(utilities.coding_stats(counts), fout, indent=2,
+                      sort_keys=True)
+        print('Coding statistics:', cli_args.stats)
 
     print("Finished")
 
 
+def get_dictionary_paths():
+    """ Returns the paths of the dictionary files named in the config, in the order
+        read_dictionaries() reads them. """
+    paths = [utilities._get_data('data/dictionaries', PETRglobals.VerbFileName)]
+    for actdict in PETRglobals.ActorFileList:
+        paths.append(utilities._get_data('data/dictionaries', actdict))
+    paths.append(utilities._get_data('data/dictionaries',
+                                     PETRglobals.AgentFileName))
+    paths.append(utilities._get_data('data/dictionaries',
+                                     PETRglobals.DiscardFileName))
+    if PETRglobals.IssueFileName != "":
+        paths.append(utilities._get_data('data/dictionaries',
+                                         PETRglobals.IssueFileName))
+    return paths
+
+
+def get_snapshot_path(snapshot_name=""):
+    """ Resolves a snapshot file name the same way as the dictionary names """
+    if not snapshot_name:
+        snapshot_name = PETRglobals.SnapshotFileName
+    return utilities._get_data('data/dictionaries', snapshot_name)
+
+
 def read_dictionaries(validation=False):
 
+    fingerprint = None
+    mapped = []
+    if PETRglobals.TrieFileName:
+        trie_path = utilities._get_data('data/dictionaries',
+                                        PETRglobals.TrieFileName)
+        fingerprint = PETRreader.dictionary_fingerprint(get_dictionary_paths())
+        trie = PETRtrie.open_trie(trie_path, fingerprint)
+        if trie:
+            print('Mapped actor and agent dictionaries:', trie_path)
+            PETRglobals.ActorDict = trie.root(0)
+            PETRglobals.AgentDict = trie.root(1)
+            mapped = ['ActorDict', 'AgentDict']
+        else:
+            print('Dictionary trie is missing or stale; '
+                  'reading the actor and agent dictionaries')
+
+    if PETRglobals.SnapshotFileName:
+        snapshot_path = get_snapshot_path()
+        if fingerprint is None:
+            fingerprint = PETRreader.dictionary_fingerprint(
+                get_dictionary_paths())
+        if PETRreader.read_dictionary_snapshot(snapshot_path, fingerprint,
+                                               skip=mapped):
+            print('Dictionary snapshot:', snapshot_path)
+            PETRglobals.FirstWords = utilities.build_first_words()
+            return
+        print('Dictionary snapshot is missing or stale; reading the dictionaries')
+
     print('Verb dictionary:', PETRglobals.VerbFileName)
     verb_path = utilities._get_data(
         'data/dictionaries',
         PETRglobals.VerbFileName)
     PETRreader.read_verb_dictionary(verb_path)
 
-    print('Actor dictionaries:', PETRglobals.ActorFileList)
-    for actdict in PETRglobals.ActorFileList:
-        actor_path = utilities._get_data('data/dictionaries', actdict)
-        PETRreader.read_actor_dictionary(actor_path)
+    if not mapped:
+        print('Actor dictionaries:', PETRglobals.ActorFileList)
+        for actdict in PETRglobals.ActorFileList:
+            actor_path = utilities._get_data('data/dictionaries', actdict)
+            PETRreader.read_actor_dictionary(actor_path)
 
-    print('Agent dictionary:', PETRglobals.AgentFileName)
-    agent_path = utilities._get_data('data/dictionaries',
-                                     PETRglobals.AgentFileName)
-    PETRreader.read_agent_dictionary(agent_path)
+        print('Agent dictionary:', PETRglobals.AgentFileName)
+        agent_path = utilities._get_data('data/dictionaries',
+                                         PETRglobals.AgentFileName)
+        PETRreader.read_agent_dictionary(agent_path)
 
     print('Discard dictionary:', PETRglobals.DiscardFileName)
     discard_path = utilities._get_data('data/dictionaries',
@@ -496,24 +1065,88 @@ def read_dictionaries(validation=False):
                                          PETRglobals.IssueFileName)
         PETRreader.read_issue_list(issue_path)
 
+    PETRglobals.FirstWords = utilities.build_first_words()
+
 
-def run(filepaths, out_file, s_parsed):
-    # this is the routine called from main()
+def compile_dictionaries(snapshot_name="", trie_name=""):
+    """
+    Reads the dictionaries from their source files and writes the snapshot that
+    read_dictionaries() will use on later runs until one of the files or the
+    relevant config options change. If trie_name is given, the actor and agent
+    dictionaries are also written as a memory-mapped trie. This is called from
+    the 'compile' command.
+    """
+    snapshot_path = get_snapshot_path(snapshot_name)
+    PETRglobals.SnapshotFileName = ""   # always rebuild from the source files
+    PETRglobals.TrieFileName = ""
+    read_dictionaries()
+    fingerprint = PETRreader.dictionary_fingerprint(get_dictionary_paths())
+    PETRreader.write_dictionary_snapshot(snapshot_path, fingerprint)
+    print('Wrote dictionary snapshot:', snapshot_path)
+    if trie_name:
+        trie_path = utilities._get_data('data/dictionaries', trie_name)
+        PETRtrie.write_trie(trie_path, [PETRglobals.ActorDict,
+                                        PETRglobals.AgentDict], fingerprint)
+        print('Wrote dictionary trie:', trie_path)
+
+
+def run(filepaths, out_file, s_parsed, workers=1, resume=False):
+    # this is the routine called from main(); returns the coding counts
+    counts = {}
+    if s_parsed and not (PETRglobals.NullVerbs or PETRglobals.NullActors):
+        # stories are read, coded and written one at a time, so the time
+        # spent writing is what is left once reading and coding are taken out
+        waited = {}
+        journal = None
+        if PETRwriter.output_format(out_file)[0] in ('arrow', 'parquet'):
+            if resume:
+                print('Arrow and Parquet output cannot be resumed; the run '
+                      'starts over')
+        else:
+            journal = PETRwriter.EventJournal(
+                'evts.' + out_file + '.journal', resume,
+                PETRglobals.CheckpointStories)
+            if journal.resumed:
+                print('Resuming: {} stories and {} input files already '
+                      'coded'.format(journal.resumed, len(journal.files)))
+        stories = utilities.timed_iter(
+            PETRreader.iter_xml_input(filepaths, s_parsed, journal,
+                                      PETRglobals.XMLReaders,
+                                      PETRglobals.ReadQueue), counts, 'read')
+        stories = fold_duplicate_stories(stories, counts)
+        coded = utilities.timed_iter(
+            code_story_stream(stories, counts, workers), waited, 'coded')
+        t1 = time.time()
+        PETRwriter.write_events_stream(coded, 'evts.' + out_file, journal)
+        utilities.add_stage_time(counts, 'write', time.time() - t1 -
+                                 waited['stages']['coded'])
+        print_coding_summary(counts)
+        return counts
+
+    t1 = time.time()
     events = PETRreader.read_xml_input(filepaths, s_parsed)
+    utilities.add_stage_time(counts, 'read', time.time() - t1)
+    fold_duplicates(events, counts)
     if not s_parsed:
+        t1 = time.time()
         events = utilities.stanford_parse(events)
-    updated_events = do_coding(events)
+        utilities.add_stage_time(counts, 'parse', time.time() - t1)
+    updated_events = do_coding(events, workers, counts)
+    t1 = time.time()
     if PETRglobals.NullVerbs:
         PETRwriter.write_nullverbs(updated_events, 'nullverbs.' + out_file)
     elif PETRglobals.NullActors:
         PETRwriter.write_nullactors(updated_events, 'nullactors.' + out_file)
     else:
         PETRwriter.write_events(updated_events, 'evts.' + out_file)
+    utilities.add_stage_time(counts, 'write', time.time() - t1)
+    return counts
 
 
 def run_pipeline(data, out_file=None, config=None, write_output=True,
-                 parsed=False):
-    # this is called externally
+                 parsed=False, workers=1, return_stats=False):
+    # this is called externally; with return_stats, the result is returned
+    # as a (result, stats) pair, where stats is utilities.coding_stats()
     utilities.init_logger('PETRARCH.log')
     logger = logging.getLogger('petr_log')
     if config:
@@ -532,23 +1165,62 @@ def run_pipeline(data, out_file=None, config=None, write_output=True,
 
     read_dictionaries()
 
+    counts = {}
     logger.info('Hitting read events...')
+    t1 = time.time()
     events = PETRreader.read_pipeline_input(data)
+    utilities.add_stage_time(counts, 'read', time.time() - t1)
+    fold_duplicates(events, counts)
     if parsed:
         logger.info('Hitting do_coding')
-        updated_events = do_coding(events)
+        updated_events = do_coding(events, workers, counts)
     else:
+        t1 = time.time()
         events = utilities.stanford_parse(events)
-        updated_events = do_coding(events)
+        utilities.add_stage_time(counts, 'parse', time.time() - t1)
+        updated_events = do_coding(events, workers, counts)
+    output_events = None
+    t1 = time.time()
     if not write_output:
         output_events = PETRwriter.pipe_output(updated_events)
-        return output_events
     elif write_output and not out_file:
         print('Please specify an output file...')
         logger.warning('Need an output file. ¯\_(ツ)_/¯')
         sys.exit()
     elif write_output and out_file:
         PETRwriter.write_events(updated_events, out_file)
+    utilities.add_stage_time(counts, 'write', time.time() - t1)
+    if return_stats:
+        return output_events, utilities.coding_stats(counts)
+    return output_events
+
+
+def serve(host='127.0.0.1', port=8080, workers=1, batch_stories=64,
+          batch_wait=0.01):
+    """
+    Runs the coding server of PETRserver until it is interrupted. The
+    dictionaries need to have been read: they stay loaded, and with more than
+    one worker the pool is forked once, before the server starts.
+    """
+    pool = multiprocessing.Pool(workers) if use_pool(workers) else None
+
+    def code_batch(holdings, counts):
+        return code_holdings(holdings, counts, pool)
+
+    batcher = PETRserver.MicroBatcher(code_batch, batch_stories, batch_wait)
+    server = PETRserver.CodingServer((host, port), batcher,
+                                     PETRreader.read_pipeline_input)
+    print('Coding server listening on http://{}:{}/code'.format(
+        *server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
 
 
 if __name__ == '__main__':
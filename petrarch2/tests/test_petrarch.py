@@ -1,6 +1,11 @@
-from petrarch2 import petrarch2, PETRglobals, PETRreader, utilities
+from petrarch2 import petrarch2, PETRglobals, PETRreader, PETRtrie, utilities
+from petrarch2 import PETRcodes, PETRcache, PETRwriter
 from petrarch2 import PETRtree as ptree
 import sys
+import pytest
+import gzip
+import json
+import datetime
 
 
 config = petrarch2.utilities._get_data('data/config/', 'PETR_config.ini')
@@ -21,12 +26,14 @@ def test_read():
     assert "RUSSIA" in PETRglobals.ActorDict
 
 def test_actorDict_read():
+    ordate = PETRreader.dstr_to_ordate
+
     #actorDict1 is an example that "CROATIA" appears multiple times in the dictionary, we should store all codes
-    actorDict1 = {u'#': [(u'YUGHRV', [u'<910625']), (u'HRVUNR', [u'911008', u'920115']), (u'HRV', [u'>920115']), (u'HRV', [])]}
+    actorDict1 = {u'#': [(u'YUGHRV', (None, ordate(u'910625'))), (u'HRVUNR', (ordate(u'911008'), ordate(u'920115'))), (u'HRV', (ordate(u'920115'), None)), (u'HRV', (None, None))]}
     
     #actorDict2 is an example of multiple codes in one line
     #UFFE_ELLEMANN_JENSEN_ [IGOEUREEC 820701-821231][IGOEUREEC 870701-871231] # president of the CoEU 
-    actorDict2 = {u'ELLEMANN': {u'JENSEN': {u'#': [(u'IGOEUREEC', [u'820701', u'821231']), (u'IGOEUREEC', [u'870701', u'871231'])]}}}
+    actorDict2 = {u'ELLEMANN': {u'JENSEN': {u'#': [(u'IGOEUREEC', (ordate(u'820701'), ordate(u'821231'))), (u'IGOEUREEC', (ordate(u'870701'), ordate(u'871231')))]}}}
     
     #actorDict3 is an example of extra space in the date
     #+EL_SISI_
@@ -34,12 +41,12 @@ def test_actorDict_read():
     #[EGYGOVMIL 120812-140326]
     #[EGYGOV > 140608]
     #[EGYELI]
-    actorDict3 = {u'#': [(u'EGYMIL', [u'770101', u'120812']), (u'EGYGOVMIL', [u'120812', u'140326']), (u'EGYGOV', [u'>140608']), (u'EGYELI', [])]}
+    actorDict3 = {u'#': [(u'EGYMIL', (ordate(u'770101'), ordate(u'120812'))), (u'EGYGOVMIL', (ordate(u'120812'), ordate(u'140326'))), (u'EGYGOV', (ordate(u'140608'), None)), (u'EGYELI', (None, None))]}
 
     #actorDict4-6 are examples that phrase and code is separated by different whitespace characters
-    actorDict4 = {u'HARAM': {u'#': [(u'NGAREB', [])]}} #one space
-    actorDict5 = {u'INC': {u'#': [(u'MNCUSA', [])]}} #two space
-    actorDict6 = {u'#': [(u'KIR', [])]} #one tab
+    actorDict4 = {u'HARAM': {u'#': [(u'NGAREB', (None, None))]}} #one space
+    actorDict5 = {u'INC': {u'#': [(u'MNCUSA', (None, None))]}} #two space
+    actorDict6 = {u'#': [(u'KIR', (None, None))]} #one tab
 
     assert PETRglobals.ActorDict['CROATIA'] == actorDict1
     assert PETRglobals.ActorDict['UFFE'] == actorDict2
@@ -250,3 +257,484 @@ def test_complex1():
 
 
 
+
+
+def test_dictionary_snapshot(tmpdir):
+    fingerprint = PETRreader.dictionary_fingerprint(petrarch2.get_dictionary_paths())
+    snapshot = str(tmpdir.join('PETR.dictionaries.snapshot'))
+    PETRreader.write_dictionary_snapshot(snapshot, fingerprint)
+
+    actors = PETRglobals.ActorDict
+    assert PETRreader.read_dictionary_snapshot(snapshot, fingerprint)
+    assert PETRglobals.ActorDict is not actors
+    assert PETRglobals.ActorDict == actors
+    assert not PETRreader.read_dictionary_snapshot(snapshot, "stale")
+
+
+def test_dictionary_trie(tmpdir):
+    trie_path = str(tmpdir.join('PETR.dictionaries.trie'))
+    PETRtrie.write_trie(trie_path, [PETRglobals.ActorDict,
+                                    PETRglobals.AgentDict], "fingerprint")
+    assert PETRtrie.open_trie(trie_path, "stale") is None
+
+    trie = PETRtrie.open_trie(trie_path, "fingerprint")
+    actors = trie.root(0)
+    assert "RUSSIA" in actors and "NOT_A_WORD" not in actors
+    assert actors["RUSSIA"]["#"] == PETRglobals.ActorDict["RUSSIA"]["#"]
+    assert actors["UNITED"].get("STATES")["#"] == \
+        PETRglobals.ActorDict["UNITED"]["STATES"]["#"]
+    assert "#" not in actors["UNITED"]
+    agents = trie.root(1)
+    assert agents["POLICE"]["#"] == PETRglobals.AgentDict["POLICE"]["#"]
+    words = set(trie.words())
+    assert "RUSSIA" in words and "POLICE" in words and "#" not in words
+    trie.close()
+
+
+def test_do_coding_workers():
+    path = utilities._get_data('data/text', 'GigaWord.sample.PETR.xml')
+    serial = petrarch2.do_coding(PETRreader.read_xml_input([path], True))
+    pooled = petrarch2.do_coding(PETRreader.read_xml_input([path], True),
+                                 workers=2)
+    assert list(pooled) == list(serial)
+    assert pooled == serial
+
+
+def test_code_story_stream():
+    path = utilities._get_data('data/text', 'GigaWord.sample.PETR.xml')
+    holding = petrarch2.do_coding(PETRreader.read_xml_input([path], True))
+    counts = {}
+    stories = petrarch2.code_story_stream(
+        PETRreader.iter_xml_input([path], True), counts)
+    streamed = {}
+    for key, story in stories:
+        for sent, sent_dict in story['sents'].items():
+            streamed[key, sent] = sent_dict.get('events')
+    assert streamed == dict(((key, sent), sent_dict.get('events'))
+                            for key, story in holding.items()
+                            for sent, sent_dict in story['sents'].items())
+    assert counts['NSent'] == len(streamed)
+
+
+def test_failed_coding():
+    parse = ("(S (NP (NNP GRYFFINDOR ) ) (VP (VBD RE-ELECT ) (PP (IN ON ) "
+             "(NP (NNP ANACLETO ) (NNP OLO ) (NNP MIBUY ) ) ) ) (. . ) )")
+    # get_events() traps an error in coding this tree
+    assert ptree.Sentence(parse, "", 734000).get_events() == (None, None)
+    holding = {'S1': {'meta': {'date': '20110519'},
+                      'sents': {'0': {'content': 'Gryffindor re-elect on '
+                                                 'Anacleto Olo Mibuy.',
+                                      'parsed': parse}}}}
+    counts = {}
+    coded = petrarch2.do_coding(holding, counts=counts)
+    assert 'events' not in coded['S1']['sents']['0']
+    assert counts['NSent'] == 1 and counts['NEvents'] == 0
+
+
+def test_tokenize_parse():
+    parse = "(ROOT\n  (S (NP (NNP Germany))\n    (VP (VBD invaded) (NP (NNP France)))))"
+    parsed = utilities._format_parsed_str(parse)
+    assert parsed == "(S (NP (NNP GERMANY ) ) (VP (VBD INVADED ) (NP (NNP FRANCE ) ) ) )"
+    assert utilities.tokenize_parse("(NP (NNP Obama))") == \
+        ["(NP", "(NNP", "Obama", ")", ")"]
+    test = ptree.Sentence(parsed, "Germany invaded France", 0)
+    assert test.txt == " GERMANY INVADED FRANCE"
+    assert test.tree.children[1].children[1].children[0].text == "FRANCE"
+
+
+def test_first_words():
+    first_words = PETRglobals.FirstWords
+    assert "UNITED" in first_words and "POLICE" in first_words
+    assert "FLIBBER" not in first_words and "#" not in first_words
+
+
+def test_match_dictionaries():
+    test = ptree.Sentence("(S (NP (NNP UNITED ) (NNP STATES ) (NN POLICE ) "
+                          "(NN FLIBBER ) ) (VP (VBD FLIBBERED ) ) )",
+                          "United States police flibbered", 730000)
+    noun = test.tree.children[0]
+    words = ["UNITED", "STATES", "POLICE", "FLIBBER"]
+    codes, text, length, _ = noun.match_dictionaries(words, 0)
+    assert (codes, text, length) == (["USA"], " UNITED STATES", 2)
+    # the police are an agent, matched once no actor matches
+    assert noun.match_dictionaries(words, 2) == (["~COP"], " POLICE", 1,
+                                                 [["~"]])
+    assert noun.match_dictionaries(words, 3) is None
+    assert noun.get_meaning() == ["USACOP"]
+
+
+def test_check_discards():
+    assert petrarch2.check_discards("Germany invaded France") == [0, '']
+    assert petrarch2.check_discards("They played baseball") == \
+        [1, '  BASEBALL']
+    # story discards take precedence wherever they are in the sentence
+    assert petrarch2.check_discards(
+        "Baseball fans cheered Manchester United") == \
+        [2, '+  MANCHESTER UNITED']
+
+
+def test_get_issues():
+    assert petrarch2.get_issues("They fear a crop failure") == \
+        [['FOOD_SECURITY', 1]]
+    assert petrarch2.get_issues("The crop grew and crop failing was rare") == \
+        [['AGRICULTURE', 1], ['FOOD_SECURITY', 1]]
+    # any ignore phrase cancels the issues of the whole sentence
+    assert petrarch2.get_issues("The Democratic Party met") == []
+
+
+def test_build_verb_automaton():
+    end = {'code': '043', 'line': 'test'}
+    trie = {'SAY': {'TALK': {'#': {'TALK': {}}, '-': {'WITH': {'#': end}}}}}
+    roots, goto, control, caret, result = utilities.build_verb_automaton(trie)
+    talk = goto[roots['SAY']]['TALK']
+    assert result[talk] == {'TALK': {}}
+    (slot, minus), = control[talk]
+    assert slot == 0 and goto[talk]['-'] == minus
+    assert result[goto[minus]['WITH']] is end
+    assert not caret
+
+
+def test_match_transform():
+    def verb_code(verb):
+        return PETRcodes.convert_code(
+            PETRglobals.VerbDict['verbs'][verb]['#']['#']['code'])[0]
+    vp = ptree.VerbPhrase("VP", "20150101", None)
+    hits = ptree.transform_counts['hits']
+    # ~ a (a b ATTACK) SAY = a b 015
+    said = ([u'ISR'], ([u'ISR'], u'PSE', verb_code('ATTACK')), verb_code('SAY'))
+    events, line = vp.match_transform(said)
+    assert events == [([u'ISR'], u'PSE', PETRcodes.convert_code('015')[0])]
+    assert line.startswith('~ a (a b ATTACK) SAY')
+    assert ptree.transform_counts['hits'] == hits + 1
+    # looked up again, from the index
+    assert vp.match_transform(said) == (events, line)
+    plain = ([u'ISR'], u'PSE', verb_code('SAY'))
+    assert vp.match_transform(plain) == [plain]
+
+
+def test_coding_stats():
+    path = utilities._get_data('data/text', 'GigaWord.sample.PETR.xml')
+    counts = {}
+    petrarch2.do_coding(PETRreader.read_xml_input([path], True), counts=counts)
+    stats = utilities.coding_stats(counts)
+    assert stats['counts']['NSent'] == stats['latency']['sentences'] > 0
+    assert set(['discards', 'tree', 'events']) <= set(stats['stages'])
+    latency = stats['latency']
+    assert 0 < latency['p50'] <= latency['p95'] <= latency['p99']
+
+
+def test_convert_codes():
+    assert PETRcodes.convert_code("043") == (0xB003, 0)
+    assert PETRcodes.convert_code("1951:043") == (0x00A6, 0xB003)
+    assert PETRcodes.convert_code(0xB003, 0) == "043"
+    assert PETRcodes.convert_codes(["043", "1951:043"]) == \
+        [(0xB003, 0), (0x00A6, 0xB003)]
+    assert PETRcodes.convert_codes([0xB003, 0x30a0, 0x7777], 0) == \
+        ["043", "138", 0]
+    assert utilities.convert_code is PETRcodes.convert_code
+
+
+def test_sentence_cache(tmpdir):
+    path = str(tmpdir.join('sentences.cache'))
+    parse = "(S (NP (NNP GERMANY ) ) (VP (VBD INVADED ) (NP (NNP FRANCE ) ) ) )"
+    cache = PETRcache.SentenceCache(1, path, 'abc', [730000, 735000])
+    key = cache.key(parse, 731000)
+    # the key only depends on the tokens and on the date bucket
+    assert cache.key(parse.replace(' )', ')'), 734999) == key
+    assert cache.key(parse, 735000) != key
+    assert cache.get(key) is None
+    cache.put(key, ([('DEU', 'FRA', '190')], {'nouns': []}))
+    cache.get(key)[1]['actortext'] = {}
+    assert cache.get(key) == ([('DEU', 'FRA', '190')], {'nouns': []})
+    cache.put(cache.key(parse, 729999), ([], {}))
+    cache.close()
+    reopened = PETRcache.SentenceCache(10, path, 'abc', [730000, 735000])
+    assert reopened.get(key)[0] == [('DEU', 'FRA', '190')]
+    # other dictionaries, other keys
+    other = PETRcache.SentenceCache(10, path, 'xyz', [730000, 735000])
+    assert other.get(other.key(parse, 731000)) is None
+    # new entries are only written, under the write lock, by flush(), so
+    # another process reads and writes the file meanwhile
+    other.put('k1', ([], {}))
+    assert other.get('k1') == ([], {})
+    reopened.put('k2', ([], {}))
+    reopened.flush()
+    assert reopened.get('k1') is None
+    other.close()
+    assert reopened.get('k1') == ([], {})
+
+
+def test_fold_duplicate_stories():
+    text = ("Syrian President Bashar al-Assad met Turkish Prime Minister "
+            "Recep Tayyip Erdogan in Damascus on Tuesday to discuss the "
+            "security of their shared border, officials said. The talks "
+            "followed weeks of clashes between rebels and government forces "
+            "near the frontier.")
+    other = ("Brazil and Argentina signed a trade agreement in Buenos Aires "
+             "on Monday that cuts tariffs on cars and farm goods, the foreign "
+             "ministries of both countries announced in a joint statement.")
+
+    def story(content):
+        return {'sents': {0: {'content': content}}, 'meta': {}}
+    stories = [('A', story(text)), ('B', story(other)),
+               ('C', story(text.replace('Tuesday', 'Wednesday'))),
+               ('D', story(text))]
+    counts = {}
+    folded = list(petrarch2.fold_duplicate_stories(stories, counts, 10))
+    assert [key for key, _ in folded] == ['A', 'B', 'C', 'D']
+    assert counts['NFolded'] == 2
+    assert folded[2][1]['sents'] == {}
+    assert folded[2][1]['meta']['duplicate_of'] == 'A'
+    assert folded[1][1]['sents']
+    # only the window stories before each one are compared
+    stories = [(key, story(content)) for key, content in
+               [('A', text), ('B', other), ('C', text)]]
+    counts = {}
+    list(petrarch2.fold_duplicate_stories(stories, counts, 1))
+    assert counts['NFolded'] == 0
+
+
+def test_dedupe_distance_checked(tmpdir):
+    bad = tmpdir.join('bad.ini')
+    bad.write(open(config).read().replace('[Options]',
+                                          '[Options]\ndedupe_distance = 64'))
+    try:
+        with pytest.raises(SystemExit):
+            PETRreader.parse_Config(str(bad))
+    finally:
+        PETRreader.parse_Config(config)
+    assert PETRglobals.DedupeDistance == 9
+
+
+def test_xml_readers(tmpdir):
+    sentence = ('<Sentence date = "20150101" id ="{}" source = "AFP" '
+                'sentence = "True"><Text>Text {}</Text></Sentence>')
+    paths = []
+    # S2 goes on from a.xml into b.xml
+    for name, ids in [('a.xml', ['S1_0', 'S2_0']), ('b.xml', ['S2_1', 'S3_0']),
+                      ('c.xml', ['S4_0', 'S4_1', 'S5_0'])]:
+        paths.append(str(tmpdir.join(name)))
+        with open(paths[-1], 'w') as fout:
+            fout.write('<Sentences>' + ''.join(sentence.format(sid, sid)
+                                               for sid in ids) + '</Sentences>')
+    serial = list(PETRreader.iter_xml_input(paths))
+    assert [key for key, _ in serial] == ['S1', 'S2', 'S3', 'S4', 'S5']
+    assert sorted(serial[1][1]['sents']) == ['0', '1']
+    # the readers hold at most one entry each, and the order is the same
+    assert list(PETRreader.iter_xml_input(paths, False, None, 2, 1)) == serial
+    # a reader stopped early is left behind without blocking
+    first = next(PETRreader.iter_xml_input(paths, False, None, 3, 1))
+    assert first == serial[0]
+
+
+def test_xml_wrapped_entries(tmpdir, monkeypatch):
+    sentence = ('<Sentence date = "20150101" id ="{}" source = "AFP" '
+                'sentence = "True"><Text>Text {}</Text></Sentence>')
+    path = str(tmpdir.join('wrapped.xml'))
+    with open(path, 'w') as fout:
+        fout.write('<Sentences><Batch>' +
+                   ''.join(sentence.format(sid, sid) for sid in
+                           ['S1_0', 'S2_0', 'S3_0']) + '</Batch></Sentences>')
+    # the ElementTree fallback also drops the entries from their wrapper
+    monkeypatch.setattr(PETRreader, 'etree', PETRreader.ET)
+    batches = []
+    iterparse = PETRreader.ET.iterparse
+
+    def recording(*args, **kwargs):
+        for event, elem in iterparse(*args, **kwargs):
+            if event == 'start' and elem.tag == 'Batch':
+                batches.append(elem)
+            yield event, elem
+    monkeypatch.setattr(PETRreader.ET, 'iterparse', recording)
+    for entry_id, _ in PETRreader.iter_xml_input([path]):
+        assert len(batches[0]) == 0
+    assert entry_id == 'S3'
+
+
+def test_event_journal(tmpdir):
+    sentence = ('<Sentence date = "20150101" id ="{}" source = "AFP" '
+                'sentence = "True"><Text>Text</Text></Sentence>')
+    paths = []
+    # S1 occurs twice in a.xml and S3 goes on into b.xml
+    for name, ids in [('a.xml', ['S1_0', 'S2_0', 'S1_1', 'S3_0']),
+                      ('b.xml', ['S3_1', 'S4_0'])]:
+        paths.append(str(tmpdir.join(name)))
+        with open(paths[-1], 'w') as fout:
+            fout.write('<Sentences>' + ''.join(sentence.format(sid)
+                                               for sid in ids) + '</Sentences>')
+    journal_path = str(tmpdir.join('evts.journal'))
+    output_path = str(tmpdir.join('evts'))
+
+    def run(stop, resume=True):
+        journal = PETRwriter.EventJournal(journal_path, resume, 2)
+        output = journal.open_output(output_path)
+        keys = []
+        for key, story in PETRreader.iter_xml_input(paths, False, journal):
+            if len(keys) == stop:
+                break
+            keys.append(key)
+            output.write(key + '\n')
+            journal.written(output)
+        else:
+            journal.finish(output)
+        output.close()
+        journal.close()
+        return keys
+
+    assert run(3, False) == ['S1', 'S2', 'S1']
+    # the second S1 came after the last checkpoint
+    assert run(2) == ['S1', 'S3']
+    assert open(output_path).read() == 'S1\nS2\nS1\nS3\n'
+    # a.xml is done, and the rest of S3 in b.xml is not coded again
+    assert run(None) == ['S4']
+    assert open(output_path).read() == 'S1\nS2\nS1\nS3\nS4\n'
+    assert not tmpdir.join('evts.journal').check()
+
+
+def test_event_writer(tmpdir):
+    path = str(tmpdir.join('evts.txt.gz'))
+    writer = PETRwriter.EventWriter(path)
+    assert writer.compression == 'gzip'
+    assert writer.write_story('S1', {'sents': {}, 'meta': {}}) == 0
+    writer.write('a\tb\n')
+    writer.flush()
+    length = writer.tell()
+    writer.write('c\n')
+    writer.close()
+    assert gzip.open(path).read() == b'a\tb\nc\n'
+    # each flush ends a gzip member, so the file can be continued from there
+    with PETRwriter.EventWriter(path, offset=length) as writer:
+        writer.write('d\n')
+    assert gzip.open(path).read() == b'a\tb\nd\n'
+
+
+def test_event_records(tmpdir):
+    story = {'sents': {1: {'events': [('USA', 'CHN', '042')],
+                           'issues': [('TRADE', 2)], 'meta': {}}},
+             'meta': {'date': '20080804', 'source': 'AFP'}}
+    record = ('S', datetime.date(2008, 8, 4), 'USA', 'CHN', '042',
+              {'TRADE': 2}, ['S_1'], None, 'AFP', None, None, None, None,
+              None)
+    assert PETRwriter.story_event_records('S', story) == [record]
+    assert PETRwriter.format_story_events('S', story)[0].startswith(
+        '20080804\tUSA\tCHN\t042\tTRADE,2\tS_1\tAFP')
+
+    assert PETRwriter.output_format('evts.out.jsonl.gz') == ('jsonl', 'gzip')
+    assert PETRwriter.output_format('evts.out.txt') == ('tsv', '')
+    with PETRwriter.EventWriter(str(tmpdir.join('evts.jsonl'))) as writer:
+        writer.write_story('S', story)
+        writer.write_story('T', story)
+    lines = tmpdir.join('evts.jsonl').read().splitlines()
+    assert json.loads(lines[1]) == {
+        'story_id': 'T', 'date': '2008-08-04', 'source': 'USA',
+        'target': 'CHN', 'code': '042', 'issues': {'TRADE': 2},
+        'ids': ['T_1'], 'url': None, 'story_source': 'AFP',
+        'source_text': None, 'target_text': None, 'event_text': None,
+        'source_root': None, 'target_root': None}
+    # the columns of a batch of events
+    with PETRwriter.EventWriter(str(tmpdir.join('evts.columns'))) as writer:
+        writer.write_story('S', story)
+        writer.write_story('T', story)
+    columns = json.loads(tmpdir.join('evts.columns').read())
+    assert set(columns) == set(PETRwriter.EventFields)
+    assert columns['story_id'] == ['S', 'T']
+    assert columns['ids'] == [['S_1'], ['T_1']]
+
+
+def test_coding_meta():
+    text = "Germany invaded France"
+    parse = "(ROOT (S (NP (NNP Germany)) (VP (VBD invaded) (NP (NNP France)))))"
+
+    def story():
+        return {'s1': {'sents': {'0': {'content': text, 'parsed':
+                                       utilities._format_parsed_str(parse)}},
+                       'meta': {'date': '20010101'}}}
+    lean = petrarch2.do_coding(story())['s1']
+    sent = lean['sents']['0']
+    assert sent['events'] == [('DEU', 'FRA', '192')]
+    assert 'parsed' not in sent and 'meta' not in sent
+    assert 'verbs' not in lean['meta']
+    # equal events of the stories coded together share one tuple
+    pair = story()
+    pair['s2'] = story()['s1']
+    pair = petrarch2.do_coding(pair)
+    assert pair['s1']['sents']['0']['events'][0] is \
+        pair['s2']['sents']['0']['events'][0]
+    assert sent['phrases'][('DEU', 'FRA', '192')].source_text == 'Germany'
+
+    PETRglobals.KeepCodingMeta = True
+    try:
+        kept = petrarch2.do_coding(story())['s1']
+    finally:
+        PETRglobals.KeepCodingMeta = False
+    assert 'parsed' in kept['sents']['0'] and 'verbs' in kept['meta']
+    assert kept['sents']['0']['meta']['actortext'][('DEU', 'FRA', '192')] == \
+        ['Germany', 'France']
+
+
+def test_coding_server():
+    import urllib2
+    import threading
+    from petrarch2 import PETRserver
+
+    parse = "(ROOT (S (NP (NNP Germany)) (VP (VBD invaded) (NP (NNP France)))))"
+    stories = [{'_id': 's1', 'date': '20010101', 'date_added': '20010102',
+                'source': 'AFP', 'title': 'War', 'url': 'http://example.com',
+                'content': 'Germany invaded France, officials in both '
+                           'countries told reporters in the two capitals '
+                           'late on Monday evening.',
+                'parsed_sents': [parse]}]
+    expected = PETRwriter.pipe_output(petrarch2.do_coding(
+        PETRreader.read_pipeline_input(stories)))
+    assert expected['s1']
+
+    def code_batch(holdings, counts):
+        return petrarch2.code_holdings(holdings, counts)
+
+    batcher = PETRserver.MicroBatcher(code_batch, batch_wait=0.05)
+    server = PETRserver.CodingServer(('127.0.0.1', 0), batcher,
+                                     PETRreader.read_pipeline_input)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    try:
+        results = []
+
+        def post():
+            request = urllib2.Request(url + '/code', json.dumps(stories),
+                                      {'Content-Type': 'application/json'})
+            results.append(json.loads(urllib2.urlopen(request).read()))
+        clients = [threading.Thread(target=post) for _ in range(3)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        assert results == [json.loads(json.dumps(expected))] * 3
+
+        try:
+            urllib2.urlopen(url + '/code', json.dumps([{'_id': 's2'}]))
+            assert False
+        except urllib2.HTTPError as err:
+            assert err.code == 400
+
+        metrics = json.loads(urllib2.urlopen(url + '/metrics').read())
+        assert metrics['requests'] == 3 and metrics['stories'] == 3
+        assert 1 <= metrics['batches'] <= 3
+        assert metrics['queue_depth'] == 0
+        assert metrics['coding']['counts']['NEvents'] == 3
+        assert metrics['latency']['p99'] > 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_iter_sentences():
+    first = ('Army chief Gen. Smith told reporters that the talks with '
+             'the rebels (who control the north) would resume on Monday. ')
+    second = ('He said "the army will not withdraw. Not now." and added that '
+              'J. R. Doe, the envoy, would arrive in the capital next week.')
+    sentences = list(PETRreader.iter_sentences(first + second))
+    assert sentences == [first, second]
+    # sentences of fewer than 100 characters are left out
+    assert list(PETRreader.iter_sentences('Too short. ' + second)) == [second]
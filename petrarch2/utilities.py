@@ -38,11 +38,17 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import os
+import re
+import math
+import time
+import struct
+import hashlib
 import logging
 #import corenlp
 import dateutil.parser
 import PETRglobals
-from collections import defaultdict, Counter
+from PETRcodes import combine_code, convert_code  # moved to PETRcodes
+from collections import defaultdict, Counter, namedtuple
 
 nulllist = []  # used when PETRglobals.NullVerbs == True
 """ <16.06.27 pas> This might be better placed in PETRtree but I'm leaving it here so that it is clear it is a global.
@@ -268,6 +274,42 @@ def extract_phrases(sent_dict, sent_id):
     return text_dict
 
 
+# text of a coded event, kept in the 'phrases' dictionary of its sentence;
+# the fields not asked for by the write_* options are empty strings
+EventPhrases = namedtuple('EventPhrases', ['source_text', 'target_text',
+                                           'event_text', 'source_root',
+                                           'target_root'])
+
+def intern_events(events, interned):
+    """
+    The list of coded (source, target, code) events, with each tuple and each
+    code string in it replaced by an equal one handed out before from the
+    dictionary interned. A corpus repeats a few thousand actor and CAMEO codes
+    millions of times, and with this each is held once however many of the
+    sentences held together it is coded in. interned belongs to one batch of
+    stories, e.g. a do_coding() call, and is dropped along with it.
+    """
+    shared_events = []
+    for event in events:
+        shared = interned.get(event)
+        if shared is None:
+            shared = tuple(interned.setdefault(code, code) for code in event)
+            interned[shared] = shared
+        shared_events.append(shared)
+    return shared_events
+
+
+def intern_story(story_dict, interned):
+    """ Applies intern_events() to the coded sentences of a story """
+    for sent_dict in (story_dict['sents'] or {}).values():
+        if 'events' in sent_dict:
+            sent_dict['events'] = intern_events(sent_dict['events'], interned)
+        if 'phrases' in sent_dict:
+            sent_dict['phrases'] = dict(
+                zip(intern_events(sent_dict['phrases'], interned),
+                    sent_dict['phrases'].values()))
+
+
 def story_filter(story_dict, story_id):
     """
     One-a-story filter for the events. There can only be only one unique
@@ -326,17 +368,15 @@ def story_filter(story_dict, story_id):
                     filtered[event_tuple]['ids'].append(sent_id)
 # if event_tuple[1:] in text_dict:  # log an error here if we can't find a
 # non-null case?
-                    if 'actortext' in sent_dict['meta'] and event_tuple[1:] in sent_dict['meta'][
-                            'actortext']:  # 16.04.29 this is a revised version of the above test: it catches cases where extract_phrases() returns a null
+                    if 'phrases' in sent_dict and event_tuple[1:] in sent_dict[
+                            'phrases']:  # 16.04.29 this is a revised version of the above test: it catches cases where extract_phrases() returns a null
+                        phrases = sent_dict['phrases'][event_tuple[1:]]
                         if PETRglobals.WriteActorText:
-                            filtered[event_tuple]['actortext'] = sent_dict[
-                                'meta']['actortext'][event_tuple[1:]]
+                            filtered[event_tuple]['actortext'] = phrases[:2]
                         if PETRglobals.WriteEventText:
-                            filtered[event_tuple]['eventtext'] = sent_dict[
-                                'meta']['eventtext'][event_tuple[1:]]
+                            filtered[event_tuple]['eventtext'] = phrases[2]
                         if PETRglobals.WriteActorRoot:
-                            filtered[event_tuple]['actorroot'] = sent_dict[
-                                'meta']['actorroot'][event_tuple[1:]]
+                            filtered[event_tuple]['actorroot'] = phrases[3:5]
 
                 except IndexError:  # 16.04.29 pas it would be helpful to log an error here...
                     pass
@@ -346,17 +386,353 @@ def story_filter(story_dict, story_id):
     return filtered
 
 
+def build_phrase_automaton(phrase_trie, markers):
+    """
+    Builds an Aho-Corasick automaton over the word phrases stored in a nested
+    dictionary trie, such as PETRglobals.DiscardList, so that every occurrence
+    of every phrase can be found in one pass over the words of a sentence.
+
+    Parameters
+    ----------
+
+    phrase_trie: Dictionary.
+                 Word trie: each key is the next word of a phrase, and a
+                 phrase ends at a node that contains one of the markers.
+
+    markers: List.
+             Keys that mark the end of a phrase, e.g. ['+', '$'], in order
+             of precedence for phrases that carry more than one marker.
+
+    Returns
+    -------
+
+    automaton: Tuple.
+               (goto, fail, output) lists indexed by state, for use by
+               scan_phrases(). goto[state] maps a word to the next state,
+               fail[state] is the state for the longest proper suffix, and
+               output[state] lists (length, marker, value) for each phrase
+               ending in that state, longest first, where value is
+               phrase_trie[...][marker].
+    """
+    goto = [{}]
+    fail = [0]
+    output = [[]]
+    queue = [(phrase_trie, 0, 0)]
+    for branch, state, depth in queue:   # breadth first, as in the trie
+        output[state] = [(depth, marker, branch[marker])
+                         for marker in markers if marker in branch]
+        for word in branch:
+            if word in markers:
+                continue
+            goto[state][word] = len(goto)
+            queue.append((branch[word], len(goto), depth + 1))
+            goto.append({})
+            fail.append(0)
+            output.append([])
+
+    # in breadth-first order the fail state of every shallower state is known
+    for state in range(len(goto)):
+        for word, target in goto[state].items():
+            if state:
+                back = fail[state]
+                while back and word not in goto[back]:
+                    back = fail[back]
+                fail[target] = goto[back].get(word, 0)
+            output[target] = output[target] + output[fail[target]]
+    return goto, fail, output
+
+
+def scan_phrases(automaton, words):
+    """
+    Finds the phrases of a build_phrase_automaton() automaton in a list of
+    words, including overlapping ones, in a single pass.
+
+    Yields
+    ------
+
+    (end, length, marker, value): Tuple.
+                                  The match is words[end - length:end];
+                                  matches are generated in order of their
+                                  end position, longest first.
+    """
+    goto, fail, output = automaton
+    root = goto[0]
+    state = 0
+    index = 0
+    for word in words:
+        index += 1
+        if state:
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+        else:
+            state = root.get(word, 0)
+            if not state:   # most words do not start a phrase
+                continue
+        for length, marker, value in output[state]:
+            yield index, length, marker, value
+
+
+_NO_WORDS = {}    # goto entry of the states without word transitions
+
+
+def build_verb_automaton(pattern_tries):
+    """
+    Compiles the verb patterns, PETRglobals.VerbDict['phrases'], into state
+    tables for VerbPhrase.match_pattern(), so that the matcher follows numbered
+    states and reads the transitions on the control keys from a precomputed
+    list instead of testing every node dictionary for each of them.
+
+    Parameters
+    ----------
+
+    pattern_tries: Dictionary.
+                   Maps a verb meaning to its pattern trie, whose keys are
+                   words, the control keys '-', ',', '|', '*' and '^', and '#'
+                   for the pattern that ends there.
+
+    Returns
+    -------
+
+    automaton: Tuple.
+               (roots, goto, control, caret, result). roots maps a meaning to
+               its start state. The other tables are indexed by state:
+               goto[state] maps every key but '#' -- the control keys
+               included, as in the trie -- to the next state, control[state]
+               lists (slot, state) for the '-', ',', '|' and '*' transitions
+               that exist, slot being the position of the key in that list,
+               caret maps the states that have a '^' transition to its target,
+               and result[state] is the '#' entry, or None.
+    """
+    roots = {}
+    goto = []
+    control = []
+    caret = {}
+    result = []
+    queue = []
+    for meaning, trie in pattern_tries.items():
+        roots[meaning] = len(queue)
+        queue.append(trie)
+    for state, branch in enumerate(queue):   # grows as states are numbered
+        words = {}
+        for word in branch:
+            if word != '#':
+                words[word] = len(queue)
+                queue.append(branch[word])
+        goto.append(words or _NO_WORDS)
+        control.append(tuple((slot, words[key])
+                             for slot, key in enumerate('-,|*') if key in words))
+        if '^' in words:
+            caret[state] = words['^']
+        result.append(branch.get('#'))
+    return roots, goto, control, caret, result
+
+
+def build_first_words():
+    """
+    Collects the words that an entry of the actor or agent dictionary starts
+    with: NounPhrase.get_meaning() only looks for a match at the words of a
+    noun phrase that are in this set. Called once the dictionaries are
+    loaded.
+
+    Returns
+    -------
+
+    first_words: Frozenset.
+                 The first words of the actor and agent entries.
+    """
+    words = set()
+    for trie in (PETRglobals.ActorDict, PETRglobals.AgentDict):
+        if isinstance(trie, dict):
+            words.update(word for word in trie if word != '#')
+        else:   # a PETRtrie.TrieNode of the mapped dictionaries
+            words.update(word for word in trie.trie.words()
+                         if trie.get(word) is not None)
+    return frozenset(words)
+
+
+def tokenize_parse(parsed_str):
+    """
+    Splits a bracketed parse tree into its tokens in a single scan. Brackets
+    need not be separated from the words by spaces, so this reads the raw
+    CoreNLP output as well as the output of _format_parsed_str().
+
+    Parameters
+    ----------
+
+    parsed_str: String.
+                Bracketed parse tree, e.g. "(NP (NNP Obama))".
+
+    Returns
+    -------
+
+    tokens: List.
+            The tokens in order: '(' followed by the label for an opening
+            bracket, ')' for a closing bracket, and the words themselves,
+            e.g. ['(NP', '(NNP', 'Obama', ')', ')'].
+    """
+    # every bracket starts a new token: after these two replacements, which
+    # run at C speed, a whitespace split yields exactly the tokens
+    return parsed_str.replace('(', ' (').replace(')', ' ) ').split()
+
+
+# sentence latencies are counted in buckets 2**(1/8) apart, i.e. about 9% wide,
+# so the histogram stays small and the percentiles are within 9%
+_LATENCY_BASE = 2 ** 0.125
+
+
+def add_stage_time(counts, stage, seconds):
+    """ Adds seconds to the cumulative time of stage in a counts dictionary """
+    stages = counts.setdefault('stages', {})
+    stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+def add_latency(counts, seconds):
+    """ Counts one sentence latency in the histogram of a counts dictionary """
+    micro = seconds * 1e6
+    bucket = int(math.log(micro, _LATENCY_BASE)) if micro > 1 else 0
+    histogram = counts.setdefault('latency', {})
+    histogram[bucket] = histogram.get(bucket, 0) + 1
+    counts['latency_total'] = counts.get('latency_total', 0.0) + seconds
+
+
+def merge_counts(totals, counts):
+    """
+    Adds the counters, stage times and latency histogram of one counts
+    dictionary, e.g. from petrarch2.code_stories(), into totals.
+    """
+    for name, value in counts.items():
+        if isinstance(value, dict):
+            total = totals.setdefault(name, {})
+            for key, count in value.items():
+                total[key] = total.get(key, 0) + count
+        else:
+            totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def latency_percentile(histogram, fraction):
+    """
+    Returns the latency in seconds below which the given fraction of the
+    sentences in a latency histogram fall, to the resolution of the buckets.
+    """
+    total = sum(histogram.values())
+    if not total:
+        return 0.0
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= fraction * total:
+            break
+    return _LATENCY_BASE ** (bucket + 1) / 1e6
+
+
+def coding_stats(counts):
+    """
+    Summarizes a counts dictionary for reporting.
+
+    Parameters
+    ----------
+
+    counts: Dictionary.
+            Counts from petrarch2.do_coding() or petrarch2.run().
+
+    Returns
+    -------
+
+    stats: Dictionary.
+           'counts' holds the story, sentence and event counters of the
+           coding summary, 'stages' the cumulative seconds spent in each
+           stage, and 'latency' the number of sentences coded with their
+           mean, p50, p95 and p99 latency in seconds. Everything is JSON
+           serializable.
+    """
+    histogram = counts.get('latency', {})
+    sentences = sum(histogram.values())
+    latency = {'sentences': sentences,
+               'mean': counts.get('latency_total', 0.0) / sentences
+               if sentences else 0.0}
+    for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+        latency[name] = latency_percentile(histogram, fraction)
+    return {'counts': dict((name, counts.get(name, 0)) for name in
+                           ('NStory', 'NSent', 'NEvents', 'NEmpty',
+                            'NDiscardSent', 'NDiscardStory', 'NFolded',
+                            'NCacheHit', 'NCacheMiss', 'NTransformHit',
+                            'NTransformMiss')),
+            'stages': dict(counts.get('stages', {})),
+            'latency': latency}
+
+
+def timed_iter(iterable, counts, stage):
+    """
+    Yields the items of iterable, adding the time spent waiting for each of
+    them to the stage time in counts. This times the producer of a lazy
+    pipeline, e.g. the reading of the input in petrarch2.run().
+    """
+    items = iter(iterable)
+    while True:
+        start = time.time()
+        try:
+            item = next(items)
+        except StopIteration:
+            add_stage_time(counts, stage, time.time() - start)
+            return
+        add_stage_time(counts, stage, time.time() - start)
+        yield item
+
+
+def story_simhash(sentences, shingle=2):
+    """
+    Computes a 64-bit SimHash of the text of a story for finding
+    near-duplicates: stories that differ by a few words have fingerprints that
+    differ in a few bits.
+
+    Parameters
+    ----------
+
+    sentences: List.
+               The sentences of the story, e.g. from
+               PETRreader.iter_sentences().
+
+    shingle: Integer.
+             Number of consecutive words hashed together.
+
+    Returns
+    -------
+
+    fingerprint: Integer.
+                 The SimHash of the lower-cased word shingles, ignoring
+                 punctuation, or None if the story is shorter than a shingle.
+    """
+    words = re.findall(r'\w+', ' '.join(sentences).lower(), re.UNICODE)
+    word_hashes = {}
+    for word in set(words):
+        word_hashes[word] = struct.unpack(
+            str('<Q'), hashlib.md5(word.encode('utf-8')).digest()[:8])[0]
+    values = [word_hashes[word] for word in words]
+    # a shingle hash combines the hashes of its words, FNV style
+    hashes = values[:len(values) - shingle + 1]
+    for ka in range(1, shingle):
+        hashes = [((value * 0x100000001b3) ^ word_hash) & 0xffffffffffffffff
+                  for value, word_hash in zip(hashes, values[ka:])]
+    hashes = set(hashes)
+    if not hashes:
+        return None
+    # each bit is set if it is set in the majority of the shingle hashes; the
+    # bit columns of the joined binary strings are counted at C speed
+    bits = ''.join(format(value, '064b') for value in hashes)
+    half = len(hashes) / 2.0
+    return int(''.join('1' if bits[ka::64].count('1') > half else '0'
+                       for ka in range(64)), 2)
+
+
 def _format_parsed_str(parsed_str):
-    if parsed_str.strip().startswith("(ROOT") and parsed_str.strip().endswith(")"):
-        parsed_str = parsed_str.strip()[5:-1].strip()
-    elif parsed_str.strip()[1:].strip().startswith("("):
-        parsed_str = parsed_str.strip()[1:-1]
-    parsed = parsed_str.split('\n')
-    parsed = [line.strip() + ' ' for line in [line1.strip() for line1 in
-                                              parsed if line1] if line]
-    parsed = [line.replace(')', ' ) ').upper() for line in parsed]
-    treestr = ''.join(parsed)
-    return treestr
+    parsed_str = parsed_str.strip()
+    if parsed_str.startswith("(ROOT") and parsed_str.endswith(")"):
+        parsed_str = parsed_str[5:-1]
+    elif parsed_str[1:].strip().startswith("("):
+        parsed_str = parsed_str[1:-1]
+    return ' '.join(tokenize_parse(parsed_str.upper()))
 
 
 def _format_datestr(date):
@@ -395,32 +771,6 @@ def init_logger(logger_filename):
     logger.info('Running')
 
 
-def combine_code(selfcode, to_add):
-    """
-    Combines two verb codes, part of the verb interaction framework
-
-
-    Parameters
-    ----------
-    selfcode,to_add: ints
-                     Upper and lower verb codes, respectively
-
-    Returns
-    -------
-    combined value
-
-    """
-
-    if to_add < 0:
-        return to_add + selfcode
-    if selfcode >= 0x1000 and to_add >= 0x1000:
-        return to_add  # If both verbs are high-level, take the lower nested one. I think this is what we want?
-    if to_add >= selfcode:
-        return to_add
-
-    return selfcode + to_add
-
-
 def code_to_string(events):
     """
     Converts an event into a string, replacing the integer codes with strings
@@ -449,372 +799,3 @@ def code_to_string(events):
     except Exception as e:
         print(e)
         return str(events)
-
-
-def convert_code(code, forward=1):
-    """
-    Convert a verb code between CAMEO and the Petrarch internal coding ontology.
-
-                New coding scheme:
-
-            0                0          0                       0
-            2 Appeal         1 Reduce   1 Meet                  1 Leadership
-            3 Intend         2 Yield    2 Settle                2 Policy
-            4 Demand                    3 Mediate               3 Rights
-            5 Protest                   4 Aid                   4 Regime
-            6 Threaten	                5 Expel                 5 Econ
-            1 Say                       6 Pol. Change           6 Military
-            7 Disapprove                7 Mat. Coop             7 Humanitarian
-            8 Posture                   8 Dip. Coop             8 Judicial
-            9 Coerce                    9 Assault	            9 Peacekeeping
-            A Investigate               A Fight		        	A Intelligence
-            B Consult  		       		B Mass violence			B Admin. Sanctions
-                                                                                            C Dissent
-                                                                                                D Release
-                                                                                            E Int'l Involvement
-                                                                                                            F D-escalation
-
-    In the first column, higher numbers take priority. i.e. “Say + Intend” is just “Intend” or “Intend + Consult” is just Consult
-
-
-    Parameters
-    ----------
-    code: string or int, depending on forward
-          Code to be converted
-
-    forward: boolean
-             Direction of conversion, True = CAMEO -> PICO
-
-
-    Returns
-    -------
-    Forward mode:
-        active, passive : int
-                          The two parts of the code [XXX:XXX], converted to the new system. The first is an inherent
-                          active meaning, the second is an inherent passive meaning. Both are not always present,
-                          most codes just have the active.
-
-    """
-
-    cat = {"010": 0x1000,  # Make Public Statement
-           "011": 0x1000 - 0xFFFF,
-           "012": 0x100C,
-           "013": 0x1001,
-           "014": 0x1002,
-           "015": 0x10a0,
-           "016": 0x10a0 - 0xFFFF,
-           "017": 0x1003,
-           "018": 0x1004,
-           "019": 0x1005,
-
-
-           "020": 0x2000,  # Appeal
-           "021": 0x2070,
-           "0211": 0x2075,
-           "0212": 0x2076,
-           "0213": 0x2078,
-           "0214": 0x207A,
-           "022": 0x2080,
-           "023": 0x2040,
-           "0231": 0x2045,
-           "0232": 0x2046,
-           "0233": 0x2047,
-           "0234": 0x2049,
-           "024": 0x2060,
-           "0241": 0x2061,
-           "0242": 0x2062,
-           "0243": 0x2063,
-           "0244": 0x2064,
-           "025": 0x2200,
-           "0251": 0x220B,
-           "0252": 0x220C,
-           "0253": 0x220D,
-           "0254": 0x2205,
-           "0255": 0x220E,
-           "0256": 0x220F,
-           "026": 0x2010,
-           "027": 0x2020,
-           "028": 0x2030,
-
-
-           "030": 0x3000,  # Intend
-           "031": 0x3070,
-           "0311": 0x3075,
-           "0312": 0x3076,
-           "0313": 0x3078,
-           "0314": 0x307A,
-           "032": 0x3080,
-           "033": 0x3040,
-           "0331": 0x3045,
-           "0332": 0x3046,
-           "0333": 0x3047,
-           "0334": 0x3049,
-           "034": 0x3060,
-           "0341": 0x3061,
-           "0342": 0x3062,
-           "0343": 0x3063,
-           "0344": 0x3064,
-           "035": 0x3200,
-           "0351": 0x320B,
-           "0352": 0x320C,
-           "0353": 0x320D,
-           "0354": 0x3205,
-           "0355": 0x320E,
-           "0356": 0x320F,
-           "036": 0x3010,
-           "037": 0x3020,
-           "038": 0x3230,
-           "039": 0x3030,
-
-           "040": 0xB000,  # Consult
-           "041": 0xB001,
-           "042": 0xB002,
-           "043": 0xB003,
-           "044": 0xB010,
-           "045": 0xB030,
-           "046": 0xB010,
-
-
-           "050": 0x0080,        # Diplomatic Coop
-           "051": 0x0081,
-           "052": 0x0082,
-           "053": 0x0083,
-           "054": 0x0084,
-           "055": 0x0085,
-           "056": 0x0086,
-           "057": 0x0087,
-
-           "060": 0x0070,        # Material Coop
-           "061": 0x0075,
-           "062": 0x0076,
-           "063": 0x0078,
-           "064": 0x007A,
-
-           "070": 0x0040,        # Provide Aid
-           "071": 0x0045,
-           "072": 0x0046,
-           "073": 0x0047,
-           "074": 0x0049,
-           "075": 0x004E,
-
-           "080": 0x0200,  # Yield
-           "081": 0x020B,
-           "0811": 0x0203,
-           "0812": 0x0201,
-           "0813": 0x0204,
-           "0814": 0x0206,
-           "082": 0x020C,
-           "083": 0x0260,
-           "0831": 0x0261,
-           "0832": 0x0262,
-           "0833": 0x0263,
-           "0834": 0x0264,
-           "084": 0x0250,
-           "0841": 0x020C,
-           "0842": 0x020C,
-           "085": 0x0205,
-           "086": 0x020E,
-           "0861": 0x0209,
-           "0862": 0x020A,
-           "0863": 0x0207,
-           "087": 0x02C0,
-           "0871": 0x02C9,
-           "0872": 0x02C1,
-           "0873": 0x02C6,
-           "0874": 0x02C2,
-           "08": 0x0200,
-
-           "090": 0xA000,  # Investigate
-           "091": 0xA001,
-           "092": 0xA002,
-           "093": 0xA003,
-           "094": 0xA004,
-
-           "100": 0x4000,  # Demand
-           "101": 0x4070,
-           "1011": 0x4075,
-           "1012": 0x4076,
-           "1013": 0x4078,
-           "1014": 0x407A,
-           "102": 0x4080,
-           "103": 0x4040,
-           "1031": 0x4045,
-           "1032": 0x4046,
-           "1033": 0x4047,
-           "1034": 0x4049,
-           "104": 0x4060,
-           "1041": 0x4061,
-           "1042": 0x4062,
-           "1043": 0x4063,
-           "1044": 0x4064,
-           "105": 0x4200,
-           "1051": 0x420B,
-           "1052": 0x420C,
-           "1053": 0x420D,
-           "1054": 0x4205,
-           "1055": 0x420E,
-           "1056": 0x420F,
-           "106": 0x4010,
-           "107": 0x4020,
-           "108": 0x4030,
-
-
-           "110": 0x7000,  # Disapprove
-           "111": 0x7001,
-           "112": 0x70a0,
-           "1121": 0x70a1,
-           "1122": 0x70a2,
-           "1123": 0x70a3,
-           "1124": 0x70a4,
-           "1125": 0x70a5,
-           "113": 0x7002,
-           "114": 0x7003,
-           "115": 0x7008,
-           "116": 0x7005,
-
-
-           "120": -0xFFFF,  # Reject
-           "121": -0xFFFF + 0x0070,
-           "1211": -0xFFFF + 0x0075,
-           "1212": -0xFFFF + 0x0076,
-           "122": -0xFFFF + 0x2040 + 0x300,      # The 0x300 mask makes these not code
-           # from "refuse to request aid", but rather
-           "1221": -0xFFFF + 0x2045 + 0x300,
-           "1222": -0xFFFF + 0x2046 + 0x300,       # be a thing of their own while retaining
-           # the features of the meaning.
-           "1223": -0xFFFF + 0x2047 + 0x300,
-           "1224": -0xFFFF + 0x2049 + 0x300,
-           "123": -0xFFFF + 0x2060 + 0x300,
-           "1231": -0xFFFF + 0x2061 + 0x300,
-           "1232": -0xFFFF + 0x2062 + 0x300,
-           "1233": -0xFFFF + 0x2063 + 0x300,
-           "1234": -0xFFFF + 0x2064 + 0x300,
-           "124": -0xFFFF + 0x0200,
-           "1241": -0xFFFF + 0x020B,
-           "1242": -0xFFFF + 0x020C,
-           "1243": -0xFFFF + 0x020D,
-           "1244": -0xFFFF + 0x0205,
-           "1245": -0xFFFF + 0x020E,
-           "1246": -0xFFFF + 0x02C0,
-           "125": -0xFFFF + 0x0010,
-           "126": -0xFFFF + 0x0030,
-           "127": -0xFFFF + 0x0020,
-           "128": -0xFFFF + 0x0002,
-           "129": -0xFFFF + 0x0001,
-
-           "130": 0x6000,  # Threaten
-           "131": 0x6100,
-           "1311": 0x6140,
-           "1312": 0x6105,
-           "1313": 0x6180,
-           "132": 0x600B,
-           "1321": 0x6003,
-           "1322": 0x6001,
-           "1323": 0x6004,
-           "1324": 0x6006,
-           "133": 0x600C,
-           "134": 0x6010,
-           "135": 0x6030,
-           "136": 0x600E,
-           "137": 0x6004,
-           "138": 0x60A0,
-           "1381": 0x60A1,
-           "1382": 0x60A2,
-           "1383": 0x60A3,
-           "1384": 0x60A4,
-           "1385": 0x60B0,
-           "139": 0x6005,
-
-
-           "140": 0x5000,  # Protest
-           "145": 0x50A0,
-
-           "150": 0x8000,  # Exhibit Force Posture
-           "151": 0x8001,
-           "152": 0x8002,
-           "153": 0x8003,
-           "154": 0x8004,
-
-           "160": 0x0100,  # Reduce Relations
-           "161": 0x0180,
-           "162": 0x0140,
-           "1621": 0x0145,
-           "1622": 0x0146,
-           "1623": 0x0147,
-           "163": 0x000B,
-           "164": 0x0110,
-           "165": 0x0130,
-           "166": 0x0150,
-           "1661": 0x0159,
-           "1662": 0x015A,
-           "1663": 0x015E,
-
-           "170": 0x9000,  # Coerce
-           "171": 0x9010,
-           "1711": 0x9011,
-           "1712": 0x9012,
-           "172": 0x900B,
-           "1721": 0x9003,
-           "1722": 0x9001,
-           "1723": 0x9004,
-           "1724": 0x9006,
-           "173": 0x9020,
-           "174": 0x9030,
-           "175": 0x9040,
-
-           "180": 0x0090,  # Assault
-           "181": 0x0091,
-           "182": 0x0092,
-           "1821": 0x0093,
-           "1822": 0x0094,
-           "1823": 0x0095,
-           "1824": 0x0096,
-           "183": 0x0097,
-           "1831": 0x0098,
-           "1832": 0x0099,
-           "1833": 0x009A,
-           "1834": 0x009B,
-           "184": 0x009C,
-           "185": 0x009D,
-           "186": 0x009E,
-
-
-           "190": 0x00A0,  # Fight
-           "191": 0x00A1,
-           "192": 0x00A2,
-           "193": 0x00A3,
-           "194": 0x00A4,
-           "195": 0x00A5,
-           "1951": 0x00A6,
-           "1952": 0x00A7,
-           "196": 0x00A8,
-
-           "200": 0x00B0,  # Use Unconventional Mass Violence
-           "---": 0}
-
-    if forward:
-        passive = False
-        active = code.split(":")
-        passive = active[1] if len(active) > 1 else "---"
-        active = active[0] if active[0] else "---"
-
-        if active in cat:
-            active = cat[active]
-        else:
-            active = cat[active[:2] + "0"]
-        if passive in cat:
-            passive = cat[passive]
-        else:
-            passive = cat[passive[:2] + "0"]
-
-        return active, passive
-
-    else:
-        reverse = dict(map(lambda a: (a[1], a[0]), cat.items()) +  # Other weird quirks
-                       [(0x30a0, "138"),   # Want to attack
-
-                        ])
-        if code and code in reverse:
-            return reverse[code]
-
-        return 0  # hex(code)